@@ -10,6 +10,113 @@ class Settings(BaseSettings):
     openai_api_key: str | None = Field(None, alias="OPENAI_API_KEY")
     log_level: str = Field("INFO", alias="LOG_LEVEL")
     db_path: str = Field("bot.db", alias="DB_PATH")
+    db_pool_size: int = Field(4, alias="DB_POOL_SIZE")
+    db_busy_timeout_ms: int = Field(5000, alias="DB_BUSY_TIMEOUT_MS")
+    db_mmap_size: int = Field(268_435_456, alias="DB_MMAP_SIZE")
+    quota_ledger_enabled: bool = Field(False, alias="QUOTA_LEDGER_ENABLED")
+    quota_ledger_flush_ms: int = Field(500, alias="QUOTA_LEDGER_FLUSH_MS")
+    quota_ledger_flush_changes: int = Field(200, alias="QUOTA_LEDGER_FLUSH_CHANGES")
+    quota_ledger_max_entries: int = Field(50_000, alias="QUOTA_LEDGER_MAX_ENTRIES")
+    quota_ledger_durability: str = Field("batch", alias="QUOTA_LEDGER_DURABILITY")
+    request_log_queue_size: int = Field(10_000, alias="REQUEST_LOG_QUEUE_SIZE")
+    request_log_batch_size: int = Field(500, alias="REQUEST_LOG_BATCH_SIZE")
+    request_log_flush_ms: int = Field(250, alias="REQUEST_LOG_FLUSH_MS")
+    log_retention_days: int = Field(30, alias="LOG_RETENTION_DAYS")
+    maintenance_interval_hours: float = Field(24, alias="MAINTENANCE_INTERVAL_HOURS")
+    maintenance_chunk_size: int = Field(5000, alias="MAINTENANCE_CHUNK_SIZE")
+    maintenance_vacuum_pages: int = Field(2000, alias="MAINTENANCE_VACUUM_PAGES")
+    known_users_max: int = Field(100_000, alias="KNOWN_USERS_MAX")
+    known_users_warm: int = Field(20_000, alias="KNOWN_USERS_WARM")
+    response_cache_enabled: bool = Field(True, alias="RESPONSE_CACHE_ENABLED")
+    response_cache_memory_items: int = Field(2000, alias="RESPONSE_CACHE_MEMORY_ITEMS")
+    response_cache_tz: str = Field("Europe/Moscow", alias="RESPONSE_CACHE_TZ")
+    ai_single_flight: bool = Field(True, alias="AI_SINGLE_FLIGHT")
+    ai_streaming: bool = Field(True, alias="AI_STREAMING")
+    stream_edit_interval_ms: int = Field(1000, alias="STREAM_EDIT_INTERVAL_MS")
+    ai_scheduler_enabled: bool = Field(True, alias="AI_SCHEDULER_ENABLED")
+    ai_max_concurrency: int = Field(8, alias="AI_MAX_CONCURRENCY")
+    ai_requests_per_minute: int = Field(500, alias="AI_REQUESTS_PER_MINUTE")
+    ai_tokens_per_minute: int = Field(200_000, alias="AI_TOKENS_PER_MINUTE")
+    ai_queue_max: int = Field(200, alias="AI_QUEUE_MAX")
+    ai_queue_max_wait_s: float = Field(20.0, alias="AI_QUEUE_MAX_WAIT_S")
+    ai_lane_weight_paid: float = Field(6.0, alias="AI_LANE_WEIGHT_PAID")
+    ai_lane_weight_free: float = Field(3.0, alias="AI_LANE_WEIGHT_FREE")
+    ai_lane_weight_background: float = Field(1.0, alias="AI_LANE_WEIGHT_BACKGROUND")
+    ai_free_starvation_s: float = Field(8.0, alias="AI_FREE_STARVATION_S")
+    ai_slo_wait_paid_s: float = Field(1.0, alias="AI_SLO_WAIT_PAID_S")
+    ai_slo_wait_free_s: float = Field(5.0, alias="AI_SLO_WAIT_FREE_S")
+    ai_slo_wait_background_s: float = Field(300.0, alias="AI_SLO_WAIT_BACKGROUND_S")
+    ai_backends: str = Field("gpt-4o-mini", alias="AI_BACKENDS")
+    ai_hedge_percentile: float = Field(90.0, alias="AI_HEDGE_PERCENTILE")
+    ai_hedge_min_delay_s: float = Field(1.0, alias="AI_HEDGE_MIN_DELAY_S")
+    ai_hedge_initial_delay_s: float = Field(8.0, alias="AI_HEDGE_INITIAL_DELAY_S")
+    ai_hedge_min_samples: int = Field(20, alias="AI_HEDGE_MIN_SAMPLES")
+    ai_hedge_max_ratio: float = Field(0.1, alias="AI_HEDGE_MAX_RATIO")
+    ai_request_deadline_s: float = Field(40.0, alias="AI_REQUEST_DEADLINE_S")
+    ai_attempt_timeout_s: float = Field(25.0, alias="AI_ATTEMPT_TIMEOUT_S")
+    ai_retry_base_s: float = Field(0.5, alias="AI_RETRY_BASE_S")
+    ai_retry_cap_s: float = Field(8.0, alias="AI_RETRY_CAP_S")
+    ai_retry_max_attempts: int = Field(4, alias="AI_RETRY_MAX_ATTEMPTS")
+    ai_circuit_enabled: bool = Field(True, alias="AI_CIRCUIT_ENABLED")
+    ai_circuit_window: int = Field(20, alias="AI_CIRCUIT_WINDOW")
+    ai_circuit_min_calls: int = Field(5, alias="AI_CIRCUIT_MIN_CALLS")
+    ai_circuit_error_rate: float = Field(0.5, alias="AI_CIRCUIT_ERROR_RATE")
+    ai_circuit_slow_call_s: float = Field(20.0, alias="AI_CIRCUIT_SLOW_CALL_S")
+    ai_circuit_slow_rate: float = Field(0.6, alias="AI_CIRCUIT_SLOW_RATE")
+    ai_circuit_open_s: float = Field(30.0, alias="AI_CIRCUIT_OPEN_S")
+    ai_circuit_probe_timeout_s: float = Field(15.0, alias="AI_CIRCUIT_PROBE_TIMEOUT_S")
+    ai_circuit_fallback: bool = Field(True, alias="AI_CIRCUIT_FALLBACK")
+    ai_circuit_state_path: str = Field("logs/ai_circuit.json", alias="AI_CIRCUIT_STATE_PATH")
+    degrade_enabled: bool = Field(True, alias="DEGRADE_ENABLED")
+    degrade_sign_cache_depth: int = Field(10, alias="DEGRADE_SIGN_CACHE_DEPTH")
+    degrade_compact_depth: int = Field(40, alias="DEGRADE_COMPACT_DEPTH")
+    degrade_eta_depth: int = Field(100, alias="DEGRADE_ETA_DEPTH")
+    degrade_sign_cache_p95_s: float = Field(10.0, alias="DEGRADE_SIGN_CACHE_P95_S")
+    degrade_compact_p95_s: float = Field(18.0, alias="DEGRADE_COMPACT_P95_S")
+    degrade_eta_p95_s: float = Field(28.0, alias="DEGRADE_ETA_P95_S")
+    degrade_cooldown_s: float = Field(30.0, alias="DEGRADE_COOLDOWN_S")
+    degrade_max_tokens: int = Field(350, alias="DEGRADE_MAX_TOKENS")
+    degrade_bullets: int = Field(4, alias="DEGRADE_BULLETS")
+    precompute_enabled: bool = Field(True, alias="PRECOMPUTE_ENABLED")
+    precompute_serve: bool = Field(False, alias="PRECOMPUTE_SERVE")
+    precompute_on_start: bool = Field(False, alias="PRECOMPUTE_ON_START")
+    precompute_at: str = Field("00:05", alias="PRECOMPUTE_AT")
+    precompute_batch: bool = Field(False, alias="PRECOMPUTE_BATCH")
+    precompute_concurrency: int = Field(4, alias="PRECOMPUTE_CONCURRENCY")
+    ai_batch_dir: str = Field("batches", alias="AI_BATCH_DIR")
+    ai_batch_poll_s: float = Field(30.0, alias="AI_BATCH_POLL_S")
+    ai_batch_max_wait_s: float = Field(600.0, alias="AI_BATCH_MAX_WAIT_S")
+    http_telegram_max_connections: int = Field(100, alias="HTTP_TELEGRAM_MAX_CONNECTIONS")
+    http_openai_max_connections: int = Field(50, alias="HTTP_OPENAI_MAX_CONNECTIONS")
+    http_openai_max_keepalive: int = Field(20, alias="HTTP_OPENAI_MAX_KEEPALIVE")
+    http_openai_http2: bool = Field(False, alias="HTTP_OPENAI_HTTP2")
+    http_keepalive_s: float = Field(60.0, alias="HTTP_KEEPALIVE_S")
+    http_connect_timeout_s: float = Field(5.0, alias="HTTP_CONNECT_TIMEOUT_S")
+    http_warmup_connections: int = Field(2, alias="HTTP_WARMUP_CONNECTIONS")
+    ai_costs_enabled: bool = Field(True, alias="AI_COSTS_ENABLED")
+    ai_prices: str = Field("gpt-4o-mini=0.15/0.60,gpt-4o=2.50/10.00", alias="AI_PRICES")
+    ai_budget_daily_usd: float = Field(0.0, alias="AI_BUDGET_DAILY_USD")
+    ai_budget_monthly_usd: float = Field(0.0, alias="AI_BUDGET_MONTHLY_USD")
+    ai_budget_segments_daily_usd: str = Field("", alias="AI_BUDGET_SEGMENTS_DAILY_USD")
+    ai_costs_flush_ms: int = Field(5000, alias="AI_COSTS_FLUSH_MS")
+    ai_costs_flush_rows: int = Field(100, alias="AI_COSTS_FLUSH_ROWS")
+    natal_enabled: bool = Field(True, alias="NATAL_ENABLED")
+    natal_workers: int = Field(1, alias="NATAL_WORKERS")
+    natal_default_tz: str = Field("Europe/Moscow", alias="NATAL_DEFAULT_TZ")
+    gazetteer_path: str = Field("gazetteer.sqlite", alias="GAZETTEER_PATH")
+    gazetteer_suggestions: int = Field(3, alias="GAZETTEER_SUGGESTIONS")
+    fsm_storage: str = Field("sqlite", alias="FSM_STORAGE")
+    fsm_cache_size: int = Field(10_000, alias="FSM_CACHE_SIZE")
+    fsm_session_ttl_days: float = Field(30, alias="FSM_SESSION_TTL_DAYS")
+    fsm_sweep_interval_min: float = Field(60, alias="FSM_SWEEP_INTERVAL_MIN")
+    fsm_sweep_batch: int = Field(500, alias="FSM_SWEEP_BATCH")
+    webhook_url: str = Field("", alias="WEBHOOK_URL")
+    webhook_path: str = Field("/telegram/webhook", alias="WEBHOOK_PATH")
+    webhook_secret: str = Field("", alias="WEBHOOK_SECRET")
+    webhook_host: str = Field("0.0.0.0", alias="WEBHOOK_HOST")
+    webhook_port: int = Field(8080, alias="WEBHOOK_PORT")
+    webhook_workers: int = Field(1, alias="WEBHOOK_WORKERS")
+    webhook_max_connections: int = Field(40, alias="WEBHOOK_MAX_CONNECTIONS")
     free_quota: int = Field(3, alias="FREE_QUOTA")
     request_price_stars: int = Field(3, alias="REQUEST_PRICE_STARS")
     overrides_path: str = Field("bot_overrides.json", alias="OVERRIDES_PATH")
@@ -48,6 +48,12 @@ def gender_kb() -> InlineKeyboardMarkup:
     )
 
 
+def place_suggestions_kb(names: list[str]) -> InlineKeyboardMarkup:
+    rows = [[InlineKeyboardButton(text=name, callback_data=f"place_{index}")] for index, name in enumerate(names)]
+    rows.append([InlineKeyboardButton(text="Оставить как ввели", callback_data="place_keep")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
 def focus_kb() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
@@ -10,10 +10,15 @@ LOG_DIR = Path("logs")
 LOG_FILE = LOG_DIR / "app.log"
 
 
-def setup_logging() -> Path:
-    """Configure application logging to console and rotating file."""
+def setup_logging(worker: int = 0) -> Path:
+    """Configure application logging to console and rotating file.
+
+    Extra webhook worker processes get their own file: several processes rotating
+    one file would lose records.
+    """
 
     LOG_DIR.mkdir(parents=True, exist_ok=True)
+    log_file = LOG_DIR / f"app.worker{worker}.log" if worker else LOG_FILE
 
     log_level = getattr(logging, settings.log_level.upper(), logging.INFO)
 
@@ -24,10 +29,10 @@ def setup_logging() -> Path:
     console_handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(name)s: %(message)s"))
     handlers.append(console_handler)
 
-    file_handler = RotatingFileHandler(LOG_FILE, maxBytes=1_000_000, backupCount=3, encoding="utf-8")
+    file_handler = RotatingFileHandler(log_file, maxBytes=1_000_000, backupCount=3, encoding="utf-8")
     file_handler.setLevel(log_level)
     file_handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(name)s: %(message)s"))
     handlers.append(file_handler)
 
     logging.basicConfig(level=log_level, handlers=handlers, force=True)
-    return LOG_FILE
+    return log_file
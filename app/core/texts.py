@@ -13,6 +13,7 @@ ASK_BIRTH_DATE = "Введите дату рождения в формате Д
 ASK_TIME_KNOWN = "Знаете ли вы точное время рождения?"
 ASK_BIRTH_TIME = "Введите время рождения в формате ЧЧ:ММ"
 ASK_BIRTH_PLACE = "Введите место рождения"
+PLACE_SUGGESTIONS = "Не нашёл «{place}» в справочнике городов. Возможно, вы имели в виду:"
 ASK_GENDER = "Выберите ваш пол"
 ASK_FOCUS = "Какой аспект интересует?"
 INVALID_DATE = "Неверный формат даты. Используйте ДД.ММ.ГГГГ"
@@ -20,6 +21,13 @@ INVALID_TIME = "Неверный формат времени. Используй
 NATAL_SOON = "Натальная карта скоро будет доступна."
 PROCESSING = "Готовлю ваш прогноз..."
 GENERATION_ERROR = "Не удалось получить ответ. Попробуйте позже."
+PROCESSING_QUEUED = "Сейчас много запросов. Готовлю ваш прогноз, ожидание около {wait}..."
+OVERLOADED = "Сервис перегружен. Попробуйте снова примерно через {wait}, запрос не списан."
+AI_UNAVAILABLE = "Прогнозы временно недоступны. Попробуйте позже, запрос не списан."
+SIGN_HOROSCOPE = (
+    "Общий прогноз для знака {sign}, запрос не списан. "
+    "Персональный прогноз — кнопка «Сгенерировать заново».\n\n{text}"
+)
 GENERATION_STUB_NOTICE = "Бот работает в демо-режиме (OpenAI отключён)."
 
 
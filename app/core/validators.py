@@ -1,19 +1,41 @@
 from __future__ import annotations
 
-from datetime import datetime
+import re
+from datetime import date, datetime, time
 
+DATE_FORMAT = "%d.%m.%Y"
+TIME_FORMAT = "%H:%M"
 
-def validate_date(date_str: str) -> bool:
+# "1.1.1990", "01/01/1990", "1-1-1990", "01 01 1990".
+_DATE_RE = re.compile(r"^(\d{1,2})[./\-\s](\d{1,2})[./\-\s](\d{4})$")
+# "9:05", "09.05", "9 05".
+_TIME_RE = re.compile(r"^(\d{1,2})[:.\s](\d{2})$")
+
+
+def validate_date(date_str: str) -> date | None:
+    """Parsed birth date, or ``None`` if the text is not a real past date after 1900."""
+
+    match = _DATE_RE.match(date_str.strip())
+    if match is None:
+        return None
+    day, month, year = (int(part) for part in match.groups())
     try:
-        datetime.strptime(date_str, "%d.%m.%Y")
-        return True
+        parsed = date(year, month, day)
     except ValueError:
-        return False
+        return None
+    if parsed.year < 1900 or parsed > datetime.now().date():
+        return None
+    return parsed
+
 
+def validate_time(time_str: str) -> time | None:
+    """Parsed ``ЧЧ:ММ`` time, or ``None``."""
 
-def validate_time(time_str: str) -> bool:
+    match = _TIME_RE.match(time_str.strip())
+    if match is None:
+        return None
+    hour, minute = (int(part) for part in match.groups())
     try:
-        datetime.strptime(time_str, "%H:%M")
-        return True
+        return time(hour, minute)
     except ValueError:
-        return False
+        return None
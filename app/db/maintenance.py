@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+import aiosqlite
+
+from app.config.settings import settings
+from app.db.storage import Database
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_SQL = (
+    "INSERT INTO requests_daily (day, module, action, tier, requests) "
+    "SELECT date(created_at), coalesce(module, ''), coalesce(action, ''), coalesce(tier, 'free'), count(*) "
+    "FROM requests_log WHERE id <= ? AND created_at < ? "
+    "GROUP BY 1, 2, 3, 4 "
+    "ON CONFLICT(day, module, action, tier) DO UPDATE SET requests = requests + excluded.requests"
+)
+
+
+@dataclass(slots=True)
+class MaintenanceReport:
+    rolled_up: int = 0
+    chunks: int = 0
+    expired_cache: int = 0
+    freed_pages: int = 0
+
+
+def retention_cutoff(horizon_days: int, now: datetime | None = None) -> str:
+    now = now or datetime.now(timezone.utc)
+    return (now - timedelta(days=horizon_days)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+async def rollup_requests_log(
+    db: Database,
+    horizon_days: int | None = None,
+    chunk_size: int | None = None,
+    pause: float = 0.05,
+) -> MaintenanceReport:
+    """Aggregate raw rows older than the horizon into ``requests_daily`` and delete them.
+
+    Works in chunks of ``chunk_size`` rows, each in its own short write transaction,
+    so the request log writer is never blocked for long.
+    """
+
+    horizon_days = horizon_days if horizon_days is not None else settings.log_retention_days
+    chunk_size = chunk_size or settings.maintenance_chunk_size
+    cutoff = retention_cutoff(horizon_days)
+    report = MaintenanceReport()
+    while True:
+        async with db.connect() as conn:
+            await conn.execute("BEGIN IMMEDIATE")
+            cursor = await conn.execute(
+                "SELECT max(id) AS max_id, count(*) AS total FROM "
+                "(SELECT id FROM requests_log WHERE created_at < ? ORDER BY id LIMIT ?)",
+                (cutoff, chunk_size),
+            )
+            row = await cursor.fetchone()
+            await cursor.close()
+            if row is None or row["max_id"] is None:
+                await conn.rollback()
+                break
+            await conn.execute(ROLLUP_SQL, (row["max_id"], cutoff))
+            await conn.execute("DELETE FROM requests_log WHERE id <= ? AND created_at < ?", (row["max_id"], cutoff))
+            await conn.commit()
+        report.rolled_up += int(row["total"])
+        report.chunks += 1
+        if int(row["total"]) < chunk_size:
+            break
+        await asyncio.sleep(pause)
+    return report
+
+
+async def purge_expired_cache(db: Database) -> int:
+    async with db.connect() as conn:
+        cursor = await conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (int(time.time()),))
+        deleted = cursor.rowcount
+        await cursor.close()
+        await conn.commit()
+    return max(0, deleted)
+
+
+async def incremental_vacuum(db: Database, max_pages: int | None = None) -> int:
+    """Release up to ``max_pages`` free pages back to the OS; returns pages freed."""
+
+    max_pages = max_pages or settings.maintenance_vacuum_pages
+    async with db.connect() as conn:
+        mode = await _pragma_int(conn, "auto_vacuum")
+        if mode != 2:
+            logger.warning(
+                "auto_vacuum is not INCREMENTAL (mode %s); run `python launch.py --maintenance --vacuum` once", mode
+            )
+            return 0
+        before = await _pragma_int(conn, "freelist_count")
+        cursor = await conn.execute(f"PRAGMA incremental_vacuum({int(max_pages)})")
+        await cursor.fetchall()
+        await cursor.close()
+        after = await _pragma_int(conn, "freelist_count")
+    return max(0, before - after)
+
+
+async def enable_incremental_vacuum(db_path: str) -> None:
+    """One-time conversion of an existing database to ``auto_vacuum=INCREMENTAL`` (full VACUUM)."""
+
+    async with aiosqlite.connect(db_path) as conn:
+        await conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        await conn.execute("VACUUM")
+    logger.info("Database %s rebuilt with auto_vacuum=INCREMENTAL", db_path)
+
+
+async def _pragma_int(conn: aiosqlite.Connection, name: str) -> int:
+    cursor = await conn.execute(f"PRAGMA {name}")
+    row = await cursor.fetchone()
+    await cursor.close()
+    return int(row[0]) if row else 0
+
+
+async def run_maintenance(db: Database, horizon_days: int | None = None) -> MaintenanceReport:
+    report = await rollup_requests_log(db, horizon_days=horizon_days)
+    report.expired_cache = await purge_expired_cache(db)
+    report.freed_pages = await incremental_vacuum(db)
+    logger.info(
+        "Maintenance done: %s rows rolled up in %s chunks, %s expired cache entries, %s pages freed",
+        report.rolled_up,
+        report.chunks,
+        report.expired_cache,
+        report.freed_pages,
+    )
+    return report
+
+
+class MaintenanceJob:
+    """Runs :func:`run_maintenance` periodically inside the bot process."""
+
+    def __init__(self, db: Database, interval_hours: float | None = None) -> None:
+        self.db = db
+        self.interval_hours = interval_hours if interval_hours is not None else settings.maintenance_interval_hours
+        self._task: asyncio.Task[None] | None = None
+
+    async def start(self) -> None:
+        if self._task is not None or self.interval_hours <= 0:
+            return
+        self._task = asyncio.create_task(self._run(), name="db-maintenance")
+        logger.info("DB maintenance scheduled every %s h", self.interval_hours)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await run_maintenance(self.db)
+            except Exception:  # pragma: no cover - runtime guard
+                logger.exception("DB maintenance failed")
+            await asyncio.sleep(self.interval_hours * 3600)
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
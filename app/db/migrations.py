@@ -1,18 +1,82 @@
 from __future__ import annotations
 
 import logging
+import re
 from pathlib import Path
 
 import aiosqlite
 
 logger = logging.getLogger(__name__)
 
+SCHEMA_DIR = Path(__file__).with_name("schema")
+MIGRATION_NAME = re.compile(r"^(\d{4})_[\w-]+\.sql$")
 
-async def apply_migrations(db_path: str) -> None:
-    sql_path = Path(__file__).with_name("models.sql")
-    sql_content = sql_path.read_text(encoding="utf-8")
+
+def discover_migrations(schema_dir: Path = SCHEMA_DIR) -> list[tuple[int, Path]]:
+    """Return numbered migration files sorted by version."""
+
+    migrations: list[tuple[int, Path]] = []
+    for path in schema_dir.glob("*.sql"):
+        match = MIGRATION_NAME.match(path.name)
+        if match:
+            migrations.append((int(match.group(1)), path))
+    migrations.sort()
+    versions = [number for number, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"Duplicate migration numbers in {schema_dir}")
+    return migrations
+
+
+def latest_version(schema_dir: Path = SCHEMA_DIR) -> int:
+    migrations = discover_migrations(schema_dir)
+    return migrations[-1][0] if migrations else 0
+
+
+async def get_schema_version(db: aiosqlite.Connection) -> int:
+    cursor = await db.execute("PRAGMA user_version")
+    row = await cursor.fetchone()
+    await cursor.close()
+    return int(row[0]) if row else 0
+
+
+async def _has_tables(db: aiosqlite.Connection) -> bool:
+    cursor = await db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' LIMIT 1")
+    row = await cursor.fetchone()
+    await cursor.close()
+    return row is not None
+
+
+async def apply_migrations(db_path: str) -> int:
+    """Apply pending migrations tracked by ``PRAGMA user_version``; return the schema version."""
 
     async with aiosqlite.connect(db_path) as db:
-        await db.executescript(sql_content)
+        version = await get_schema_version(db)
+        pending = [(number, path) for number, path in discover_migrations() if number > version]
+        if not pending:
+            logger.info("Schema is up to date (version %s)", version)
+            return version
+
+        if version == 0 and not await _has_tables(db):
+            # Only possible on an empty file; existing databases switch via the one-time VACUUM.
+            await db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
+        for number, path in pending:
+            sql_content = path.read_text(encoding="utf-8")
+            try:
+                # executescript runs the whole file; the explicit BEGIN/COMMIT makes it one transaction
+                # together with the version bump.
+                await db.executescript(
+                    f"BEGIN IMMEDIATE;\n{sql_content}\n;PRAGMA user_version = {number};\nCOMMIT;"
+                )
+            except Exception:
+                if db.in_transaction:
+                    await db.rollback()
+                logger.exception("Migration %s failed, schema stays at version %s", path.name, version)
+                raise
+            version = number
+            logger.info("Migration applied: %s", path.name)
+
+        await db.execute("ANALYZE")
         await db.commit()
-        logger.info("Migrations applied")
+        logger.info("Migrations applied, schema version %s", version)
+        return version
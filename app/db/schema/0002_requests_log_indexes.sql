@@ -0,0 +1,7 @@
+-- Per-user history lookups (WHERE telegram_id = ? ORDER BY created_at).
+CREATE INDEX IF NOT EXISTS idx_requests_log_user_created
+    ON requests_log (telegram_id, created_at);
+
+-- Time-range scans and aggregates by module/action without touching the table rows.
+CREATE INDEX IF NOT EXISTS idx_requests_log_created_module_action
+    ON requests_log (created_at, module, action);
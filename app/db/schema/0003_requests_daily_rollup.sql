@@ -0,0 +1,16 @@
+-- User tier at request time, needed to aggregate paid and free traffic separately.
+ALTER TABLE requests_log ADD COLUMN tier TEXT DEFAULT 'free';
+
+DROP INDEX IF EXISTS idx_requests_log_created_module_action;
+CREATE INDEX IF NOT EXISTS idx_requests_log_created_module_action_tier
+    ON requests_log (created_at, module, action, tier);
+
+-- Daily aggregate of requests_log rows older than the retention horizon.
+CREATE TABLE IF NOT EXISTS requests_daily (
+    day TEXT NOT NULL,
+    module TEXT NOT NULL,
+    action TEXT NOT NULL,
+    tier TEXT NOT NULL,
+    requests INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, module, action, tier)
+) WITHOUT ROWID;
@@ -0,0 +1,10 @@
+-- Persistent tier of the AI response cache; expires_at is a UTC unix timestamp.
+CREATE TABLE IF NOT EXISTS response_cache (
+    cache_key TEXT PRIMARY KEY,
+    mode TEXT NOT NULL,
+    response TEXT NOT NULL,
+    created_at INTEGER NOT NULL,
+    expires_at INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_response_cache_expires ON response_cache (expires_at);
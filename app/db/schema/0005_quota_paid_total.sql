@@ -0,0 +1,2 @@
+-- Requests ever bought by the user; any purchase puts the user in the paid tier.
+ALTER TABLE quotas ADD COLUMN paid_total INTEGER NOT NULL DEFAULT 0;
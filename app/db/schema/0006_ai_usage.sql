@@ -0,0 +1,29 @@
+-- One row per provider call; joins requests_log on prompt_hash. Cost is in USD.
+CREATE TABLE IF NOT EXISTS ai_usage (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    prompt_hash TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    focus TEXT NOT NULL,
+    model TEXT NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    latency_ms INTEGER NOT NULL,
+    cost_usd REAL NOT NULL,
+    created_at TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_ai_usage_prompt_hash ON ai_usage (prompt_hash);
+CREATE INDEX IF NOT EXISTS idx_ai_usage_created ON ai_usage (created_at);
+
+-- Daily spend per mode, focus and model; the budget check sums it for the current day and month.
+CREATE TABLE IF NOT EXISTS ai_spend_daily (
+    day TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    focus TEXT NOT NULL,
+    model TEXT NOT NULL,
+    requests INTEGER NOT NULL DEFAULT 0,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    cost_usd REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, mode, focus, model)
+) WITHOUT ROWID;
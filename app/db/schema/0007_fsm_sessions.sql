@@ -0,0 +1,10 @@
+-- aiogram FSM state per chat/user (app/services/fsm_storage.py). data is compact JSON,
+-- zlib-compressed when large; updated_ns is the write time in ns since the epoch.
+CREATE TABLE IF NOT EXISTS fsm_sessions (
+    session_key TEXT PRIMARY KEY,
+    state TEXT,
+    data BLOB,
+    updated_ns INTEGER NOT NULL
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_fsm_sessions_updated ON fsm_sessions (updated_ns);
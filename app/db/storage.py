@@ -2,32 +2,126 @@ from __future__ import annotations
 
 import asyncio
 import logging
+from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import Any, AsyncIterator, Callable
 
 import aiosqlite
 
+from app.config.settings import settings
 from app.db.migrations import apply_migrations
 
 logger = logging.getLogger(__name__)
 
 
 class Database:
-    def __init__(self, db_path: str) -> None:
+    """SQLite access through a small pool of long-lived, pre-configured connections."""
+
+    def __init__(
+        self,
+        db_path: str,
+        pool_size: int | None = None,
+        busy_timeout_ms: int | None = None,
+        mmap_size: int | None = None,
+    ) -> None:
         self.db_path = db_path
+        self.pool_size = max(1, pool_size or settings.db_pool_size)
+        self.busy_timeout_ms = busy_timeout_ms if busy_timeout_ms is not None else settings.db_busy_timeout_ms
+        self.mmap_size = mmap_size if mmap_size is not None else settings.db_mmap_size
         self._lock = asyncio.Lock()
+        self._idle: list[aiosqlite.Connection] = []
+        self._connections: list[aiosqlite.Connection] = []
+        self._waiters: list[asyncio.Future[aiosqlite.Connection]] = []
+        self._opening = 0
+        self._closed = False
 
     async def init(self) -> None:
         Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
         async with self._lock:
             await apply_migrations(self.db_path)
-            logger.info("Database initialized at %s", self.db_path)
+            self._closed = False
+            logger.info("Database initialized at %s (pool size %s)", self.db_path, self.pool_size)
 
-    async def connect(self) -> aiosqlite.Connection:
+    async def _open_connection(self) -> aiosqlite.Connection:
         conn = await aiosqlite.connect(self.db_path)
         conn.row_factory = aiosqlite.Row
+        await conn.execute("PRAGMA journal_mode=WAL")
+        await conn.execute("PRAGMA synchronous=NORMAL")
+        await conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        await conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        await conn.execute("PRAGMA temp_store=MEMORY")
         return conn
 
+    async def _acquire(self) -> aiosqlite.Connection:
+        if self._closed:
+            raise RuntimeError("Database pool is closed")
+        if self._idle:
+            return self._idle.pop()
+        if self._opening + len(self._connections) < self.pool_size:
+            # Count the slot before awaiting so concurrent callers do not overshoot the pool size.
+            self._opening += 1
+            try:
+                conn = await self._open_connection()
+            finally:
+                self._opening -= 1
+            self._connections.append(conn)
+            return conn
+        waiter: asyncio.Future[aiosqlite.Connection] = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            elif waiter.done() and not waiter.cancelled():
+                self._release(waiter.result())
+            raise
+
+    def _release(self, conn: aiosqlite.Connection) -> None:
+        while self._waiters:
+            waiter = self._waiters.pop(0)
+            if not waiter.done():
+                waiter.set_result(conn)
+                return
+        self._idle.append(conn)
+
+    @asynccontextmanager
+    async def connect(self) -> AsyncIterator[aiosqlite.Connection]:
+        conn = await self._acquire()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                try:
+                    await conn.rollback()
+                except Exception:  # pragma: no cover - runtime guard
+                    logger.exception("Failed to roll back pooled connection")
+            if self._closed:
+                self._connections.remove(conn)
+                await conn.close()
+            else:
+                self._release(conn)
+
+    async def close(self) -> None:
+        """Close idle pooled connections; connections in use are closed when released."""
+
+        self._closed = True
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_exception(RuntimeError("Database pool is closed"))
+        self._waiters.clear()
+        connections = list(self._idle)
+        self._idle.clear()
+        for conn in connections:
+            self._connections.remove(conn)
+        for conn in connections:
+            try:
+                await conn.close()
+            except Exception:  # pragma: no cover - runtime guard
+                logger.exception("Failed to close pooled connection")
+        if connections:
+            logger.info("Database pool closed (%s connections)", len(connections))
+
     async def execute(self, query: str, params: tuple[Any, ...] = ()) -> None:
         async with self.connect() as conn:
             await conn.execute(query, params)
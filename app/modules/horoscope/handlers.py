@@ -2,12 +2,18 @@ from __future__ import annotations
 
 import hashlib
 import logging
+import time
+from contextlib import asynccontextmanager
+from dataclasses import asdict
+from typing import AsyncIterator
 
 from aiogram import F, Router
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.types import CallbackQuery, Message
 
+from app.config.settings import settings as app_settings
 from app.core import texts
 from app.core.keyboards import (
     focus_kb,
@@ -15,15 +21,38 @@ from app.core.keyboards import (
     horoscope_menu_kb,
     limit_kb,
     main_menu_kb,
+    place_suggestions_kb,
     result_kb,
     time_known_kb,
 )
 from app.core.states import HoroscopeStates
-from app.core.validators import validate_date, validate_time
-from app.services.ai_service import AIService
+from app.core.validators import DATE_FORMAT, TIME_FORMAT, validate_date, validate_time
+from app.services.ai_service import AIOverloadedError, AIService
+from app.services.degradation import (
+    LEVEL_COMPACT,
+    LEVEL_ETA,
+    LEVEL_NORMAL,
+    LEVEL_SIGN_CACHE,
+    DegradationController,
+    format_wait,
+)
+from app.modules.natal.engine import NatalEngine, NatalInput
+from app.services.normalizer import CanonicalRequest, RequestNormalizer
 from app.services.payment_service import PaymentService
-from app.services.prompt_builder import HoroscopeRequest, build_horoscope_prompt
-from app.services.quota_service import QuotaService
+from app.services.precompute import SignHoroscopes
+from app.services.prompt_builder import (
+    MODE_NATAL,
+    MODE_TODAY,
+    MODE_WEEK,
+    BuiltPrompt,
+    HoroscopeRequest,
+    build_horoscope_prompt,
+    build_sign_prompt,
+    prompt_hash,
+    zodiac_sign,
+)
+from app.services.quota_service import QuotaReservation, QuotaService
+from app.services.response_cache import CachingAIService
 
 logger = logging.getLogger(__name__)
 
@@ -33,14 +62,73 @@ quota_service: QuotaService | None = None
 ai_service: AIService | None = None
 payment_service: PaymentService | None = None
 ai_mode: str = "stub"
-
-
-def init_horoscope_services(qs: QuotaService, ai: AIService, pay: PaymentService, mode: str = "stub") -> None:
-    global quota_service, ai_service, payment_service, ai_mode
+degradation_controller: DegradationController | None = None
+sign_horoscopes: SignHoroscopes | None = None
+request_normalizer: RequestNormalizer | None = None
+natal_engine: NatalEngine | None = None
+response_cache: CachingAIService | None = None
+
+
+def init_horoscope_services(
+    qs: QuotaService,
+    ai: AIService,
+    pay: PaymentService,
+    mode: str = "stub",
+    degradation: DegradationController | None = None,
+    signs: SignHoroscopes | None = None,
+    normalizer: RequestNormalizer | None = None,
+    natal: NatalEngine | None = None,
+    cache: CachingAIService | None = None,
+) -> None:
+    global quota_service, ai_service, payment_service, ai_mode, degradation_controller, sign_horoscopes
+    global request_normalizer, natal_engine, response_cache
     quota_service = qs
     ai_service = ai
     payment_service = pay
     ai_mode = mode
+    degradation_controller = degradation
+    sign_horoscopes = signs
+    request_normalizer = normalizer
+    natal_engine = natal
+    response_cache = cache
+
+
+async def _normalized(req: HoroscopeRequest) -> tuple[HoroscopeRequest, CanonicalRequest | None]:
+    """Canonical spelling of the request, so equal requests share prompts and cache entries."""
+
+    if request_normalizer is None:
+        return req, None
+    canonical = await request_normalizer.normalize(req)
+    return (canonical.to_request(), canonical) if canonical is not None else (req, None)
+
+
+async def _natal_chart(req: HoroscopeRequest, canonical: CanonicalRequest | None) -> str | None:
+    """Computed chart summary for a natal request; ``None`` for other modes or without the engine."""
+
+    if req.mode != MODE_NATAL or natal_engine is None or canonical is None:
+        return None
+    place = canonical.place
+    chart = await natal_engine.chart(
+        NatalInput(canonical.birth_date, canonical.birth_time, place.latitude, place.longitude, place.tz)
+    )
+    return chart.describe()
+
+
+def _request_key(req: HoroscopeRequest, canonical: CanonicalRequest | None, level: int) -> str:
+    """Canonical key of the answer ``_build_prompt`` would ask for; empty without a canonical request."""
+
+    if canonical is None:
+        return ""
+    variant = "compact" if level >= LEVEL_COMPACT else "full"
+    if req.mode == MODE_NATAL and natal_engine is not None:
+        variant += "+chart"
+    return f"{canonical.key}|{variant}"
+
+
+async def _cached_answer(req: HoroscopeRequest, request_key: str) -> str | None:
+    if response_cache is None or not request_key:
+        return None
+    return await response_cache.lookup_key(request_key, req.mode)
 
 
 def _ensure_services() -> None:
@@ -48,6 +136,125 @@ def _ensure_services() -> None:
         raise RuntimeError("Services are not initialized")
 
 
+def _with_stub_notice(text: str) -> str:
+    return f"{texts.GENERATION_STUB_NOTICE}\n\n{text}" if ai_mode == "stub" else text
+
+
+async def _safe_edit(message: Message, text: str) -> bool:
+    try:
+        await message.edit_text(text)
+    except TelegramRetryAfter as exc:
+        logger.debug("Progress edit skipped, retry after %s s", exc.retry_after)
+        return False
+    except TelegramBadRequest as exc:
+        logger.debug("Progress edit skipped: %s", exc)
+        return False
+    return True
+
+
+async def _generate_with_progress(message: Message, prompt: BuiltPrompt) -> str:
+    """Generate the response, showing partial text with at most one edit per interval."""
+
+    if not app_settings.ai_streaming:
+        return await ai_service.generate(prompt)  # type: ignore[union-attr]
+
+    interval = app_settings.stream_edit_interval_ms / 1000
+    parts: list[str] = []
+    shown = ""
+    last_edit = time.monotonic()
+    async for chunk in ai_service.generate_stream(prompt):  # type: ignore[union-attr]
+        parts.append(chunk)
+        now = time.monotonic()
+        if now - last_edit < interval:
+            continue
+        text = "".join(parts).strip()
+        # A fallback answer (budget used up, circuit open) is never shown; see _answer.
+        changed = bool(text) and text != shown and not prompt.fallback
+        if changed and await _safe_edit(message, _with_stub_notice(f"{text} …")):
+            shown = text
+        last_edit = now
+    return "".join(parts)
+
+
+def _degradation_level() -> int:
+    return degradation_controller.level() if degradation_controller is not None else LEVEL_NORMAL
+
+
+def _build_prompt(req: HoroscopeRequest, level: int, chart: str | None = None) -> BuiltPrompt:
+    if level >= LEVEL_COMPACT:
+        return build_horoscope_prompt(
+            req, bullets=app_settings.degrade_bullets, max_tokens=app_settings.degrade_max_tokens, chart=chart
+        )
+    return build_horoscope_prompt(req, chart=chart)
+
+
+async def _sign_answer(
+    req: HoroscopeRequest, canonical: CanonicalRequest | None, level: int
+) -> tuple[str, str] | None:
+    """Generic forecast for the user's sign and the hash of its prompt, when one may replace a personal answer.
+
+    The precomputed matrix is served when ``PRECOMPUTE_SERVE`` is on, and under load
+    at the sign-cache degradation level.
+    """
+
+    sign = canonical.sign if canonical is not None else zodiac_sign(req.birth_date)
+    if not sign:
+        return None
+    text: str | None = None
+    if sign_horoscopes is not None and app_settings.precompute_serve:
+        text = await sign_horoscopes.lookup(req)
+    if text is None and level >= LEVEL_SIGN_CACHE:
+        text = await degradation_controller.sign_cached(req)  # type: ignore[union-attr]
+    if text is None:
+        return None
+    sign_prompt = build_sign_prompt(sign, req.mode, req.focus, req.gender)
+    return texts.SIGN_HOROSCOPE.format(sign=sign, text=text), prompt_hash(sign_prompt)
+
+
+def _estimated_wait(minimum: float = 0.0) -> str:
+    wait = degradation_controller.estimated_wait() if degradation_controller is not None else 0.0
+    return format_wait(max(wait, minimum))
+
+
+@asynccontextmanager
+async def _refund_on_error(reservation: QuotaReservation) -> AsyncIterator[None]:
+    """Return the reserved request to the balance if anything fails before the answer is ready."""
+
+    try:
+        yield
+    except Exception:
+        await quota_service.release(reservation)  # type: ignore[union-attr]
+        raise
+
+
+async def _answer(call: CallbackQuery, prompt: BuiltPrompt, reservation: QuotaReservation, level: int) -> str | None:
+    """Generate the response; ``None`` after a failure or a fallback answer.
+
+    In that case the reservation is refunded and the user is told so.
+    """
+
+    processing = texts.PROCESSING_QUEUED.format(wait=_estimated_wait()) if level >= LEVEL_ETA else texts.PROCESSING
+    await call.message.edit_text(processing)
+    try:
+        response = await _generate_with_progress(call.message, prompt)
+    except AIOverloadedError as exc:
+        logger.warning("AI request shed: %s", exc)
+        error_text = texts.OVERLOADED.format(wait=_estimated_wait(minimum=30))
+    except Exception as exc:  # pragma: no cover - runtime guard
+        logger.exception("AI generation failed: %s", exc)
+        error_text = texts.GENERATION_ERROR
+    else:
+        if not prompt.fallback:
+            return response
+        # The spend budget is used up or the circuit is open: the stub answered, which is not worth a request.
+        logger.warning("AI fallback answer withheld, request refunded")
+        error_text = texts.AI_UNAVAILABLE
+    await quota_service.release(reservation)  # type: ignore[union-attr]
+    await call.message.edit_text(error_text, reply_markup=horoscope_menu_kb())
+    await call.answer()
+    return None
+
+
 @horoscope_router.message(Command("start"))
 async def cmd_start(message: Message, state: FSMContext) -> None:
     await state.clear()
@@ -92,7 +299,7 @@ async def open_horoscope(call: CallbackQuery, state: FSMContext) -> None:
 
 @horoscope_router.callback_query(F.data.in_({"hs_today", "hs_week"}))
 async def start_horoscope(call: CallbackQuery, state: FSMContext) -> None:
-    mode = "Прогноз на сегодня" if call.data == "hs_today" else "Прогноз на неделю"
+    mode = MODE_TODAY if call.data == "hs_today" else MODE_WEEK
     await state.update_data(mode=mode, action=call.data)
     await state.set_state(HoroscopeStates.waiting_for_birth_date)
     await call.message.edit_text(texts.ASK_BIRTH_DATE)
@@ -100,8 +307,14 @@ async def start_horoscope(call: CallbackQuery, state: FSMContext) -> None:
 
 
 @horoscope_router.callback_query(F.data == "hs_natal")
-async def natal_soon(call: CallbackQuery) -> None:
-    await call.message.edit_text(texts.NATAL_SOON, reply_markup=horoscope_menu_kb())
+async def start_natal(call: CallbackQuery, state: FSMContext) -> None:
+    if natal_engine is None:
+        await call.message.edit_text(texts.NATAL_SOON, reply_markup=horoscope_menu_kb())
+        await call.answer()
+        return
+    await state.update_data(mode=MODE_NATAL, action=call.data)
+    await state.set_state(HoroscopeStates.waiting_for_birth_date)
+    await call.message.edit_text(texts.ASK_BIRTH_DATE)
     await call.answer()
 
 
@@ -114,10 +327,11 @@ async def back_horoscope(call: CallbackQuery, state: FSMContext) -> None:
 
 @horoscope_router.message(HoroscopeStates.waiting_for_birth_date)
 async def birth_date(message: Message, state: FSMContext) -> None:
-    if not validate_date(message.text or ""):
+    parsed = validate_date(message.text or "")
+    if parsed is None:
         await message.answer(texts.INVALID_DATE)
         return
-    await state.update_data(birth_date=message.text)
+    await state.update_data(birth_date=parsed.strftime(DATE_FORMAT))
     await state.set_state(HoroscopeStates.waiting_for_time_known)
     await message.answer(texts.ASK_TIME_KNOWN, reply_markup=time_known_kb())
 
@@ -136,21 +350,45 @@ async def time_known(call: CallbackQuery, state: FSMContext) -> None:
 
 @horoscope_router.message(HoroscopeStates.waiting_for_birth_time)
 async def birth_time(message: Message, state: FSMContext) -> None:
-    if not validate_time(message.text or ""):
+    parsed = validate_time(message.text or "")
+    if parsed is None:
         await message.answer(texts.INVALID_TIME)
         return
-    await state.update_data(birth_time=message.text)
+    await state.update_data(birth_time=parsed.strftime(TIME_FORMAT))
     await state.set_state(HoroscopeStates.waiting_for_birth_place)
     await message.answer(texts.ASK_BIRTH_PLACE)
 
 
 @horoscope_router.message(HoroscopeStates.waiting_for_birth_place)
 async def birth_place(message: Message, state: FSMContext) -> None:
-    await state.update_data(birth_place=message.text)
+    text = message.text or ""
+    await state.update_data(birth_place=text)
+    suggestions = await request_normalizer.suggest(text) if request_normalizer is not None else []
+    if suggestions:
+        # Unknown place with close matches: offer them, the answer arrives as a place_* callback.
+        names = [place.name for place in suggestions]
+        await state.update_data(place_options=names)
+        await message.answer(
+            texts.PLACE_SUGGESTIONS.format(place=text.strip()), reply_markup=place_suggestions_kb(names)
+        )
+        return
     await state.set_state(HoroscopeStates.waiting_for_gender)
     await message.answer(texts.ASK_GENDER, reply_markup=gender_kb())
 
 
+@horoscope_router.callback_query(HoroscopeStates.waiting_for_birth_place, F.data.startswith("place_"))
+async def birth_place_choice(call: CallbackQuery, state: FSMContext) -> None:
+    data = await state.get_data()
+    options = data.get("place_options") or []
+    choice = call.data.removeprefix("place_")
+    if choice.isdigit() and int(choice) < len(options):
+        await state.update_data(birth_place=options[int(choice)])
+    await state.update_data(place_options=None)
+    await state.set_state(HoroscopeStates.waiting_for_gender)
+    await call.message.edit_text(texts.ASK_GENDER, reply_markup=gender_kb())
+    await call.answer()
+
+
 @horoscope_router.callback_query(HoroscopeStates.waiting_for_gender, F.data.startswith("gender_"))
 async def gender(call: CallbackQuery, state: FSMContext) -> None:
     await state.update_data(gender=call.data)
@@ -165,47 +403,59 @@ async def focus(call: CallbackQuery, state: FSMContext) -> None:
     await state.update_data(focus=call.data)
     data = await state.get_data()
 
-    free_left = await quota_service.get_free_left(call.from_user.id)  # type: ignore[union-attr]
-    if free_left <= 0:
-        await state.clear()
-        await call.message.edit_text(texts.LIMIT_REACHED, reply_markup=limit_kb())
-        await call.answer()
-        return
-
-    consumed = await quota_service.consume_one(call.from_user.id)  # type: ignore[union-attr]
-    if not consumed:
-        await state.clear()
-        await call.message.edit_text(texts.LIMIT_REACHED, reply_markup=limit_kb())
-        await call.answer()
-        return
-
-    req = HoroscopeRequest(
-        mode=data.get("mode", "Гороскоп"),
-        birth_date=data.get("birth_date", ""),
-        birth_time=data.get("birth_time"),
-        birth_place=data.get("birth_place", ""),
-        gender=data.get("gender", ""),
-        focus=data.get("focus", call.data),
+    req, canonical = await _normalized(
+        HoroscopeRequest(
+            mode=data.get("mode", "Гороскоп"),
+            birth_date=data.get("birth_date", ""),
+            birth_time=data.get("birth_time"),
+            birth_place=data.get("birth_place", ""),
+            gender=data.get("gender", ""),
+            focus=data.get("focus", call.data),
+        )
     )
-    prompt = build_horoscope_prompt(req)
-    prompt_hash = hashlib.sha256((prompt.system_prompt + prompt.user_prompt).encode()).hexdigest()
-    await quota_service.log_request(call.from_user.id, "horoscope", data.get("action", ""), prompt_hash)  # type: ignore[union-attr]
-
-    await call.message.edit_text(texts.PROCESSING)
-    try:
-        response = await ai_service.generate(prompt)  # type: ignore[union-attr]
-    except Exception as exc:  # pragma: no cover - runtime guard
-        logger.exception("AI generation failed: %s", exc)
-        await quota_service.refund_one(call.from_user.id)  # type: ignore[union-attr]
-        await call.message.edit_text(texts.GENERATION_ERROR, reply_markup=horoscope_menu_kb())
-        await call.answer()
-        return
-
-    await state.update_data(last_request=req.__dict__)
+    level = _degradation_level()
+    action = data.get("action", "")
+    sign_answer = await _sign_answer(req, canonical, level)
+    if sign_answer is not None:
+        # Generic sign answers are free and never touch the quota; "regen" gives a charged personal one.
+        response, sign_hash = sign_answer
+        await quota_service.log_request(call.from_user.id, "horoscope", action, sign_hash)  # type: ignore[union-attr]
+    else:
+        reservation = await quota_service.reserve(call.from_user.id)  # type: ignore[union-attr]
+        if reservation is None:
+            await state.clear()
+            await call.message.edit_text(texts.LIMIT_REACHED, reply_markup=limit_kb())
+            await call.answer()
+            return
+
+        async with _refund_on_error(reservation):
+            request_key = _request_key(req, canonical, level)
+            cached = await _cached_answer(req, request_key)
+            if cached is not None:
+                # Answered before a prompt (or a natal chart) was built; the log gets the key's hash instead.
+                await quota_service.log_request(  # type: ignore[union-attr]
+                    call.from_user.id,
+                    "horoscope",
+                    action,
+                    hashlib.sha256(request_key.encode()).hexdigest(),
+                    tier=reservation.tier,
+                )
+                response = cached
+            else:
+                prompt = _build_prompt(req, level, await _natal_chart(req, canonical))
+                prompt.request_key = request_key
+                prompt.priority = reservation.tier
+                await quota_service.log_request(  # type: ignore[union-attr]
+                    call.from_user.id, "horoscope", action, prompt_hash(prompt), tier=reservation.tier
+                )
+                answer = await _answer(call, prompt, reservation, level)
+                if answer is None:
+                    return
+                response = answer
+        await quota_service.commit(reservation)  # type: ignore[union-attr]
+    await state.update_data(last_request=asdict(req))
     await state.set_state(HoroscopeStates.waiting_for_regeneration)
-    if ai_mode == "stub":
-        response = f"{texts.GENERATION_STUB_NOTICE}\n\n{response}"
-    await call.message.edit_text(response, reply_markup=result_kb())
+    await call.message.edit_text(_with_stub_notice(response), reply_markup=result_kb())
     await call.answer()
 
 
@@ -220,36 +470,30 @@ async def regenerate(call: CallbackQuery, state: FSMContext) -> None:
         await call.answer()
         return
 
-    free_left = await quota_service.get_free_left(call.from_user.id)  # type: ignore[union-attr]
-    if free_left <= 0:
-        await call.message.edit_text(texts.LIMIT_REACHED, reply_markup=limit_kb())
-        await call.answer()
-        return
-
-    consumed = await quota_service.consume_one(call.from_user.id)  # type: ignore[union-attr]
-    if not consumed:
+    reservation = await quota_service.reserve(call.from_user.id)  # type: ignore[union-attr]
+    if reservation is None:
         await call.message.edit_text(texts.LIMIT_REACHED, reply_markup=limit_kb())
         await call.answer()
         return
 
-    req = HoroscopeRequest(**last_request)
-    prompt = build_horoscope_prompt(req)
-    prompt_hash = hashlib.sha256((prompt.system_prompt + prompt.user_prompt).encode()).hexdigest()
-    await quota_service.log_request(call.from_user.id, "horoscope", data.get("action", "regen"), prompt_hash)  # type: ignore[union-attr]
-
-    await call.message.edit_text(texts.PROCESSING)
-    try:
-        response = await ai_service.generate(prompt)  # type: ignore[union-attr]
-    except Exception as exc:  # pragma: no cover - runtime guard
-        logger.exception("AI regeneration failed: %s", exc)
-        await quota_service.refund_one(call.from_user.id)  # type: ignore[union-attr]
-        await call.message.edit_text(texts.GENERATION_ERROR, reply_markup=horoscope_menu_kb())
-        await call.answer()
-        return
-
-    if ai_mode == "stub":
-        response = f"{texts.GENERATION_STUB_NOTICE}\n\n{response}"
-    await call.message.edit_text(response, reply_markup=result_kb())
+    async with _refund_on_error(reservation):
+        req, canonical = await _normalized(HoroscopeRequest(**last_request))
+        level = _degradation_level()
+        prompt = _build_prompt(req, level, await _natal_chart(req, canonical))
+        # The user explicitly asked for a new answer, so the response cache is skipped (and refreshed).
+        prompt.fresh = True
+        prompt.request_key = _request_key(req, canonical, level)
+        prompt.priority = reservation.tier
+        await quota_service.log_request(  # type: ignore[union-attr]
+            call.from_user.id, "horoscope", data.get("action", "regen"), prompt_hash(prompt), tier=reservation.tier
+        )
+
+        response = await _answer(call, prompt, reservation, level)
+        if response is None:
+            return
+
+    await quota_service.commit(reservation)  # type: ignore[union-attr]
+    await call.message.edit_text(_with_stub_notice(response), reply_markup=result_kb())
     await call.answer()
 
 
@@ -3,3 +3,8 @@ HOROSCOPE_TEMPLATE = (
     "Данные пользователя: дата рождения {birth_date}, время {birth_time}, место {birth_place}, пол {gender}. "
     "Фокус запроса: {focus}. Дай полезный и эмпатичный ответ без лишней воды."
 )
+
+SIGN_TEMPLATE = (
+    "Ты астролог. Сгенерируй сжатый гороскоп ({mode}) на русском языке для знака {sign}, пол {gender}. "
+    "Фокус запроса: {focus}. Дай полезный и эмпатичный ответ без лишней воды."
+)
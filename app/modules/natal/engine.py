@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import multiprocessing
+import time as clock
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import date, datetime, time, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from app.config.settings import settings
+from app.modules.natal import ephemeris
+
+logger = logging.getLogger(__name__)
+
+SIGNS = (
+    "Овен",
+    "Телец",
+    "Близнецы",
+    "Рак",
+    "Лев",
+    "Дева",
+    "Весы",
+    "Скорпион",
+    "Стрелец",
+    "Козерог",
+    "Водолей",
+    "Рыбы",
+)
+BODY_NAMES = {
+    "sun": "Солнце",
+    "moon": "Луна",
+    "mercury": "Меркурий",
+    "venus": "Венера",
+    "mars": "Марс",
+    "jupiter": "Юпитер",
+    "saturn": "Сатурн",
+    "uranus": "Уран",
+    "neptune": "Нептун",
+}
+# Unknown birth time: the chart is cast for local noon, the usual convention.
+NOON = time(12, 0)
+
+
+def sign_position(longitude: float) -> str:
+    """``Лев 12°`` for an ecliptic longitude."""
+
+    return f"{SIGNS[int(longitude // 30) % 12]} {int(longitude % 30)}°"
+
+
+@dataclass(slots=True, frozen=True)
+class NatalInput:
+    birth_date: date
+    birth_time: time | None = None
+    latitude: float | None = None
+    longitude: float | None = None
+    tz: str | None = None
+
+    @property
+    def with_angles(self) -> bool:
+        """Ascendant and houses need both the exact time and the place."""
+
+        return self.birth_time is not None and self.latitude is not None and self.longitude is not None
+
+    def julian_day(self) -> float:
+        try:
+            zone = ZoneInfo(self.tz or settings.natal_default_tz)
+        except ZoneInfoNotFoundError:
+            logger.warning("Часовой пояс %s не найден (нужен пакет tzdata), считаю время UTC", self.tz)
+            zone = timezone.utc  # type: ignore[assignment]
+        local = datetime.combine(self.birth_date, self.birth_time or NOON, tzinfo=zone)
+        utc = local.astimezone(timezone.utc)
+        hours = utc.hour + utc.minute / 60 + utc.second / 3600
+        return float(ephemeris.julian_day(utc.year, utc.month, utc.day, hours))
+
+
+@dataclass(slots=True)
+class NatalChart:
+    positions: dict[str, float]
+    ascendant: float | None = None
+    midheaven: float | None = None
+    houses: list[float] | None = None
+
+    def house_of(self, longitude: float) -> int | None:
+        if self.houses is None:
+            return None
+        return int(((longitude - self.houses[0]) % 360) // 30) + 1
+
+    def describe(self) -> str:
+        """Chart summary for the prompt: ``Солнце — Лев 12° (5 дом); …``."""
+
+        parts = []
+        for body, longitude in self.positions.items():
+            house = self.house_of(longitude)
+            suffix = f" ({house} дом)" if house is not None else ""
+            parts.append(f"{BODY_NAMES[body]} — {sign_position(longitude)}{suffix}")
+        if self.ascendant is not None and self.midheaven is not None:
+            parts.append(f"Асцендент — {sign_position(self.ascendant)}")
+            parts.append(f"MC — {sign_position(self.midheaven)}")
+        return "; ".join(parts)
+
+
+class NatalEngine:
+    """Computes natal charts off the event loop.
+
+    The maths runs in a process pool (``workers`` processes, ``spawn`` start method
+    so it behaves the same on Windows and Linux); ``workers=0`` uses a thread
+    instead, for tools that compute a single chart. A list of inputs is computed in
+    one vectorised call, so a precompute run over many subscribers costs one
+    round trip to the pool.
+    """
+
+    def __init__(self, workers: int | None = None) -> None:
+        self.workers = workers if workers is not None else settings.natal_workers
+        self._pool: Executor | None = None
+        self.charts_computed = 0
+        self.batches = 0
+        self.compute_seconds = 0.0
+
+    def _executor(self) -> Executor | None:
+        if self.workers <= 0:
+            return None
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+
+    async def start(self) -> None:
+        """Start the worker processes now instead of on the first user request."""
+
+        started = clock.monotonic()
+        await self.charts([NatalInput(date(2000, 1, 1))])
+        logger.info("Natal engine ready (%s workers) in %.2f s", self.workers, clock.monotonic() - started)
+
+    async def charts(self, inputs: list[NatalInput]) -> list[NatalChart]:
+        if not inputs:
+            return []
+        jd = [item.julian_day() for item in inputs]
+        latitude = [item.latitude or 0.0 for item in inputs]
+        longitude = [item.longitude or 0.0 for item in inputs]
+        with_angles = [item.with_angles for item in inputs]
+        started = clock.monotonic()
+        loop = asyncio.get_running_loop()
+        raw = await loop.run_in_executor(
+            self._executor(), ephemeris.compute_batch, jd, latitude, longitude, with_angles
+        )
+        self.compute_seconds += clock.monotonic() - started
+        self.batches += 1
+        self.charts_computed += len(inputs)
+        return [NatalChart(**chart) for chart in raw]  # type: ignore[arg-type]
+
+    async def chart(self, item: NatalInput) -> NatalChart:
+        return (await self.charts([item]))[0]
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "charts": self.charts_computed,
+            "batches": self.batches,
+            "compute_seconds": round(self.compute_seconds, 3),
+        }
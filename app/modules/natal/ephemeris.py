@@ -0,0 +1,261 @@
+"""Low-precision geocentric ephemeris, vectorised over many charts at once.
+
+Mean orbital elements with the main perturbation terms (P. Schlyter, "How to
+compute planetary positions"): about 1' for the Sun and the inner planets and a
+few arcminutes for the Moon and the outer planets between 1900 and 2100, which
+is far below the 1° that matters for a natal chart. Longitudes are ecliptic and
+refer to the equinox of date (tropical zodiac). Every function takes NumPy arrays
+with one element per chart, so a whole batch is computed in one call.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+
+# Julian day of 1999-12-31 0:00 UT, day zero of the element series below.
+EPOCH_JD = 2451543.5
+J2000_JD = 2451545.0
+
+BODIES = ("sun", "moon", "mercury", "venus", "mars", "jupiter", "saturn", "uranus", "neptune")
+
+# N, i, w, a, e, M as (value at epoch, change per day).
+_ELEMENTS: dict[str, tuple[tuple[float, float], ...]] = {
+    "sun": (
+        (0.0, 0.0),
+        (0.0, 0.0),
+        (282.9404, 4.70935e-5),
+        (1.0, 0.0),
+        (0.016709, -1.151e-9),
+        (356.0470, 0.9856002585),
+    ),
+    "moon": (
+        (125.1228, -0.0529538083),
+        (5.1454, 0.0),
+        (318.0634, 0.1643573223),
+        (60.2666, 0.0),
+        (0.054900, 0.0),
+        (115.3654, 13.0649929509),
+    ),
+    "mercury": (
+        (48.3313, 3.24587e-5),
+        (7.0047, 5.00e-8),
+        (29.1241, 1.01444e-5),
+        (0.387098, 0.0),
+        (0.205635, 5.59e-10),
+        (168.6562, 4.0923344368),
+    ),
+    "venus": (
+        (76.6799, 2.46590e-5),
+        (3.3946, 2.75e-8),
+        (54.8910, 1.38374e-5),
+        (0.723330, 0.0),
+        (0.006773, -1.302e-9),
+        (48.0052, 1.6021302244),
+    ),
+    "mars": (
+        (49.5574, 2.11081e-5),
+        (1.8497, -1.78e-8),
+        (286.5016, 2.92961e-5),
+        (1.523688, 0.0),
+        (0.093405, 2.516e-9),
+        (18.6021, 0.5240207766),
+    ),
+    "jupiter": (
+        (100.4542, 2.76854e-5),
+        (1.3030, -1.557e-7),
+        (273.8777, 1.64505e-5),
+        (5.20256, 0.0),
+        (0.048498, 4.469e-9),
+        (19.8950, 0.0830853001),
+    ),
+    "saturn": (
+        (113.6634, 2.38980e-5),
+        (2.4886, -1.081e-7),
+        (339.3939, 2.97661e-5),
+        (9.55475, 0.0),
+        (0.055546, -9.499e-9),
+        (316.9670, 0.0334442282),
+    ),
+    "uranus": (
+        (74.0005, 1.3978e-5),
+        (0.7733, 1.9e-8),
+        (96.6612, 3.0565e-5),
+        (19.18171, -1.55e-8),
+        (0.047318, 7.45e-9),
+        (142.5905, 0.011725806),
+    ),
+    "neptune": (
+        (131.7806, 3.0173e-5),
+        (1.7700, -2.55e-7),
+        (272.8461, -6.027e-6),
+        (30.05826, 3.313e-8),
+        (0.008606, 2.15e-9),
+        (260.2471, 0.005995147),
+    ),
+}
+
+
+def _elements(body: str, d: np.ndarray) -> tuple[np.ndarray, ...]:
+    return tuple(value + rate * d for value, rate in _ELEMENTS[body])
+
+
+def _sin(deg: np.ndarray) -> np.ndarray:
+    return np.sin(np.radians(deg))
+
+
+def _cos(deg: np.ndarray) -> np.ndarray:
+    return np.cos(np.radians(deg))
+
+
+def _orbit(body: str, d: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Heliocentric (geocentric for the Moon) ecliptic x, y, z."""
+
+    node, incl, peri, axis, ecc, mean = _elements(body, d)
+    m = np.radians(np.mod(mean, 360.0))
+    # Kepler's equation by Newton iteration; converges in a few steps for e < 0.21.
+    e_anomaly = m + ecc * np.sin(m) * (1.0 + ecc * np.cos(m))
+    for _ in range(5):
+        e_anomaly -= (e_anomaly - ecc * np.sin(e_anomaly) - m) / (1.0 - ecc * np.cos(e_anomaly))
+    xv = axis * (np.cos(e_anomaly) - ecc)
+    yv = axis * np.sqrt(1.0 - ecc * ecc) * np.sin(e_anomaly)
+    v = np.degrees(np.arctan2(yv, xv))
+    r = np.hypot(xv, yv)
+    arg = v + peri
+    x = r * (_cos(node) * _cos(arg) - _sin(node) * _sin(arg) * _cos(incl))
+    y = r * (_sin(node) * _cos(arg) + _cos(node) * _sin(arg) * _cos(incl))
+    z = r * _sin(arg) * _sin(incl)
+    return x, y, z
+
+
+def _moon_longitude(d: np.ndarray) -> np.ndarray:
+    x, y, _ = _orbit("moon", d)
+    lon = np.degrees(np.arctan2(y, x))
+    _, _, w_sun, _, _, m_sun = _elements("sun", d)
+    node, _, w_moon, _, _, m_moon = _elements("moon", d)
+    l_sun = m_sun + w_sun
+    l_moon = m_moon + w_moon + node
+    elong = l_moon - l_sun
+    arg_lat = l_moon - node
+    lon = (
+        lon
+        - 1.274 * _sin(m_moon - 2 * elong)
+        + 0.658 * _sin(2 * elong)
+        - 0.186 * _sin(m_sun)
+        - 0.059 * _sin(2 * m_moon - 2 * elong)
+        - 0.057 * _sin(m_moon - 2 * elong + m_sun)
+        + 0.053 * _sin(m_moon + 2 * elong)
+        + 0.046 * _sin(2 * elong - m_sun)
+        + 0.041 * _sin(m_moon - m_sun)
+        - 0.035 * _sin(elong)
+        - 0.031 * _sin(m_moon + m_sun)
+        - 0.015 * _sin(2 * arg_lat - 2 * elong)
+        + 0.011 * _sin(m_moon - 4 * elong)
+    )
+    return lon
+
+
+def _outer_perturbations(d: np.ndarray) -> dict[str, np.ndarray]:
+    mj = _elements("jupiter", d)[5]
+    ms = _elements("saturn", d)[5]
+    mu = _elements("uranus", d)[5]
+    return {
+        "jupiter": (
+            -0.332 * _sin(2 * mj - 5 * ms - 67.6)
+            - 0.056 * _sin(2 * mj - 2 * ms + 21)
+            + 0.042 * _sin(3 * mj - 5 * ms + 21)
+            - 0.036 * _sin(mj - 2 * ms)
+            + 0.022 * _cos(mj - ms)
+            + 0.023 * _sin(2 * mj - 3 * ms + 52)
+            - 0.016 * _sin(mj - 5 * ms - 69)
+        ),
+        "saturn": (
+            0.812 * _sin(2 * mj - 5 * ms - 67.6)
+            - 0.229 * _cos(2 * mj - 4 * ms - 2)
+            + 0.119 * _sin(mj - 2 * ms - 3)
+            + 0.046 * _sin(2 * mj - 6 * ms - 69)
+            + 0.014 * _sin(mj - 3 * ms + 32)
+        ),
+        "uranus": (
+            0.040 * _sin(ms - 2 * mu + 6) + 0.035 * _sin(ms - 3 * mu + 33) - 0.015 * _sin(mj - mu + 20)
+        ),
+    }
+
+
+def julian_day(year: np.ndarray, month: np.ndarray, day: np.ndarray, hour_ut: np.ndarray) -> np.ndarray:
+    """Julian day for Gregorian calendar dates; ``hour_ut`` may be fractional."""
+
+    year = np.asarray(year, dtype=np.int64)
+    month = np.asarray(month, dtype=np.int64)
+    a = (14 - month) // 12
+    y = year + 4800 - a
+    m = month + 12 * a - 3
+    jdn = np.asarray(day, dtype=np.int64) + (153 * m + 2) // 5 + 365 * y + y // 4 - y // 100 + y // 400 - 32045
+    return jdn - 0.5 + np.asarray(hour_ut, dtype=np.float64) / 24.0
+
+
+def longitudes(jd_ut: np.ndarray) -> dict[str, np.ndarray]:
+    """Geocentric ecliptic longitude (0..360°) of every body in :data:`BODIES`."""
+
+    d = np.asarray(jd_ut, dtype=np.float64) - EPOCH_JD
+    sun_x, sun_y, _ = _orbit("sun", d)
+    result = {"sun": np.degrees(np.arctan2(sun_y, sun_x)), "moon": _moon_longitude(d)}
+    perturbations = _outer_perturbations(d)
+    for body in BODIES[2:]:
+        x, y, z = _orbit(body, d)
+        if body in perturbations:
+            r = np.sqrt(x * x + y * y + z * z)
+            lon = np.arctan2(y, x) + np.radians(perturbations[body])
+            lat = np.arctan2(z, np.hypot(x, y))
+            x = r * np.cos(lon) * np.cos(lat)
+            y = r * np.sin(lon) * np.cos(lat)
+        result[body] = np.degrees(np.arctan2(y + sun_y, x + sun_x))
+    return {body: np.mod(lon, 360.0) for body, lon in result.items()}
+
+
+def obliquity(jd_ut: np.ndarray) -> np.ndarray:
+    return 23.4393 - 3.563e-7 * (np.asarray(jd_ut, dtype=np.float64) - EPOCH_JD)
+
+
+def angles(jd_ut: np.ndarray, latitude: np.ndarray, longitude: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Ascendant and Midheaven (ecliptic longitudes) for observers at ``latitude``/``longitude`` (east +)."""
+
+    jd_ut = np.asarray(jd_ut, dtype=np.float64)
+    gmst = 280.46061837 + 360.98564736629 * (jd_ut - J2000_JD)
+    ramc = np.mod(gmst + np.asarray(longitude, dtype=np.float64), 360.0)
+    eps = obliquity(jd_ut)
+    mc = np.degrees(np.arctan2(_sin(ramc), _cos(ramc) * _cos(eps)))
+    # Near the poles the ascendant is undefined; clip so the maths stays finite.
+    lat = np.clip(np.asarray(latitude, dtype=np.float64), -66.0, 66.0)
+    asc = np.degrees(np.arctan2(_cos(ramc), -(_sin(ramc) * _cos(eps) + np.tan(np.radians(lat)) * _sin(eps))))
+    return np.mod(asc, 360.0), np.mod(mc, 360.0)
+
+
+def equal_houses(ascendant: np.ndarray) -> np.ndarray:
+    """Cusps of the 12 equal houses, shape ``(n, 12)``; works at every latitude, unlike Placidus."""
+
+    return np.mod(np.asarray(ascendant, dtype=np.float64)[:, None] + 30.0 * np.arange(12), 360.0)
+
+
+def compute_batch(
+    jd_ut: list[float], latitude: list[float], longitude: list[float], with_angles: list[bool]
+) -> list[dict[str, object]]:
+    """Whole charts for a batch; plain lists in and out so it can run in a worker process.
+
+    Charts without a known birth time or place (``with_angles`` false) get planet
+    positions only: the ascendant and houses change every few minutes of time.
+    """
+
+    jd = np.asarray(jd_ut, dtype=np.float64)
+    mask = np.asarray(with_angles, dtype=bool)
+    positions = longitudes(jd)
+    asc, mc = angles(jd, np.asarray(latitude, dtype=np.float64), np.asarray(longitude, dtype=np.float64))
+    houses = equal_houses(asc)
+    charts: list[dict[str, object]] = []
+    for index in range(len(jd)):
+        chart: dict[str, object] = {"positions": {body: float(positions[body][index]) for body in BODIES}}
+        if mask[index]:
+            chart["ascendant"] = float(asc[index])
+            chart["midheaven"] = float(mc[index])
+            chart["houses"] = [float(cusp) for cusp in houses[index]]
+        charts.append(chart)
+    return charts
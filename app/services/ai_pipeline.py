@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass, field
+from typing import Any
+
+from app.config.settings import settings
+from app.db.storage import Database
+from app.services.ai_scheduler import AIScheduler
+from app.services.ai_service import AIResolution, AIService, AIServiceWrapper, resolve_ai_service
+from app.services.circuit_breaker import CircuitBreakerAIService, CircuitGateAIService
+from app.services.cost_ledger import CostAccountingAIService, CostGateAIService, CostLedger
+from app.services.degradation import DegradationController
+from app.services.precompute import SignHoroscopes
+from app.services.response_cache import CachingAIService, ResponseCache
+from app.services.single_flight import SingleFlightAIService
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class AIPipeline:
+    service: AIService
+    mode: str
+    layers: list[AIService] = field(default_factory=list)
+    scheduler: AIScheduler | None = None
+    degradation: DegradationController | None = None
+    signs: SignHoroscopes | None = None
+    costs: CostLedger | None = None
+    cache: CachingAIService | None = None
+
+    def stats(self) -> dict[str, Any]:
+        stats = {
+            type(layer).__name__: layer.stats()  # type: ignore[attr-defined]
+            for layer in self.layers
+            if hasattr(layer, "stats")
+        }
+        if self.degradation is not None:
+            stats["degradation"] = self.degradation.stats()
+        if self.signs is not None:
+            stats["sign_matrix"] = self.signs.stats()
+        return stats
+
+
+def _share(limit: int, workers: int) -> int:
+    """This process's part of a limit split between ``workers`` processes; 0 (no limit) stays 0."""
+
+    return max(1, limit // workers) if limit else 0
+
+
+def build_ai_pipeline(db: Database, resolution: AIResolution | None = None, workers: int = 1) -> AIPipeline:
+    """Stack the optional AI layers (outermost first).
+
+    Single-flight -> response cache -> budget gate -> circuit gate -> scheduler -> costs -> provider.
+
+    The cost layer records every provider call and enforces the spend budgets. The circuit
+    breaker, when enabled, already wraps the provider in ``resolve_ai_service``; it and the
+    provider (retry counters) are reported in the stats as well. The gates consult the
+    budgets and that breaker before the scheduler, so an exhausted budget or an open
+    circuit does not queue requests.
+
+    With several bot ``workers`` each process gets its share of the OpenAI rate limits,
+    and the spend budgets are checked against the totals of all processes.
+    """
+
+    resolution = resolution or resolve_ai_service()
+    service: AIService = resolution.service
+    layers: list[AIService] = []
+    inner: AIService | None = service
+    while inner is not None:
+        layers.insert(0, inner)
+        inner = inner.inner if isinstance(inner, AIServiceWrapper) else None
+    costs: CostLedger | None = None
+    accounting: CostAccountingAIService | None = None
+    if settings.ai_costs_enabled:
+        costs = CostLedger(db, shared=workers > 1)
+        service = accounting = CostAccountingAIService(service, costs)
+        layers.append(service)
+    scheduler: AIScheduler | None = None
+    cache: CachingAIService | None = None
+    if settings.ai_scheduler_enabled:
+        scheduler = AIScheduler(
+            service,
+            requests_per_minute=_share(settings.ai_requests_per_minute, workers),
+            tokens_per_minute=_share(settings.ai_tokens_per_minute, workers),
+        )
+        service = scheduler
+        layers.append(service)
+        breaker = next((layer for layer in layers if isinstance(layer, CircuitBreakerAIService)), None)
+        if breaker is not None:
+            service = CircuitGateAIService(service, breaker)
+            layers.append(service)
+        if accounting is not None:
+            service = CostGateAIService(service, accounting)
+            layers.append(service)
+    if settings.response_cache_enabled:
+        cache = CachingAIService(service, ResponseCache(db), namespace=resolution.mode)
+        service = cache
+        layers.append(service)
+    if settings.ai_single_flight:
+        service = SingleFlightAIService(service)
+        layers.append(service)
+    degradation: DegradationController | None = None
+    if scheduler is not None and settings.degrade_enabled:
+        # Load shedding reads the backlog from the scheduler, so it needs one.
+        degradation = DegradationController(scheduler, cache)
+    # The precomputed sign matrix is stored in the response cache, so it needs one.
+    signs = SignHoroscopes(cache) if cache is not None else None
+    return AIPipeline(
+        service=service,
+        mode=resolution.mode,
+        layers=layers,
+        scheduler=scheduler,
+        degradation=degradation,
+        signs=signs,
+        costs=costs,
+        cache=cache,
+    )
@@ -0,0 +1,281 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import AsyncIterator
+
+from app.config.settings import settings
+from app.services.ai_service import AIOverloadedError, AIService, AIServiceWrapper
+from app.services.metrics import LatencyWindow
+from app.services.prompt_builder import BuiltPrompt
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Refilling budget of ``rate_per_minute`` units; a rate of 0 disables the limit."""
+
+    def __init__(self, rate_per_minute: float, capacity: float | None = None) -> None:
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.rate <= 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until ``amount`` units are available (0 if they are available now)."""
+
+        if self.unlimited:
+            return 0.0
+        self._refill()
+        # A single request larger than the bucket is let through once the bucket is full.
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float) -> None:
+        if not self.unlimited:
+            self._refill()
+            self.tokens -= amount
+
+    def adjust(self, delta: float) -> None:
+        """Correct an earlier estimate: positive ``delta`` returns units, negative takes more."""
+
+        if not self.unlimited:
+            self.tokens = min(self.capacity, self.tokens + delta)
+
+
+LANE_PAID = "paid"
+LANE_FREE = "free"
+LANE_BACKGROUND = "background"
+LANES = (LANE_PAID, LANE_FREE, LANE_BACKGROUND)
+
+
+@dataclass(slots=True)
+class _Waiter:
+    cost: int
+    lane: str
+    tag: float
+    future: asyncio.Future[None]
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class AIScheduler(AIServiceWrapper):
+    """Admission control in front of the AI provider.
+
+    Limits concurrent calls, smooths requests/min and tokens/min with token buckets
+    (corrected with the ``usage`` reported by the provider) and parks the rest in a
+    bounded queue. Callers that would exceed the queue or wait longer than
+    ``max_wait_s`` get :class:`AIOverloadedError` instead of a provider 429.
+
+    The queue has one lane per ``prompt.priority`` (paid, free, background) served by
+    weighted fair queueing: each waiter gets a virtual finish tag advanced by
+    ``1 / weight`` of its lane, and the smallest tag goes first. A free request that
+    waited longer than ``starvation_s`` is served next regardless of its tag.
+    """
+
+    def __init__(
+        self,
+        inner: AIService,
+        max_concurrency: int | None = None,
+        requests_per_minute: int | None = None,
+        tokens_per_minute: int | None = None,
+        max_queue: int | None = None,
+        max_wait_s: float | None = None,
+        weights: dict[str, float] | None = None,
+        starvation_s: float | None = None,
+    ) -> None:
+        super().__init__(inner)
+        self.max_concurrency = max_concurrency or settings.ai_max_concurrency
+        rpm = requests_per_minute if requests_per_minute is not None else settings.ai_requests_per_minute
+        tpm = tokens_per_minute if tokens_per_minute is not None else settings.ai_tokens_per_minute
+        self.request_bucket = TokenBucket(rpm)
+        self.token_bucket = TokenBucket(tpm)
+        self.max_queue = max_queue if max_queue is not None else settings.ai_queue_max
+        self.max_wait_s = max_wait_s if max_wait_s is not None else settings.ai_queue_max_wait_s
+        self.weights = weights or {
+            LANE_PAID: settings.ai_lane_weight_paid,
+            LANE_FREE: settings.ai_lane_weight_free,
+            LANE_BACKGROUND: settings.ai_lane_weight_background,
+        }
+        self.starvation_s = starvation_s if starvation_s is not None else settings.ai_free_starvation_s
+        self.slo_s = {
+            LANE_PAID: settings.ai_slo_wait_paid_s,
+            LANE_FREE: settings.ai_slo_wait_free_s,
+            LANE_BACKGROUND: settings.ai_slo_wait_background_s,
+        }
+        self.active = 0
+        self._lanes: dict[str, deque[_Waiter]] = {lane: deque() for lane in LANES}
+        self._lane_tags: dict[str, float] = {lane: 0.0 for lane in LANES}
+        self._virtual_time = 0.0
+        self._timer: asyncio.TimerHandle | None = None
+        self.wait_times = LatencyWindow()
+        self.latencies = LatencyWindow()
+        self.lane_waits: dict[str, LatencyWindow] = {lane: LatencyWindow() for lane in LANES}
+        self.slo_violations: dict[str, int] = {lane: 0 for lane in LANES}
+        self.lane_admitted: dict[str, int] = {lane: 0 for lane in LANES}
+        self.starvation_promotions = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.max_depth = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(lane) for lane in self._lanes.values())
+
+    def estimated_wait(self) -> float:
+        """Rough seconds until a newly queued request starts, from the mean provider latency."""
+
+        if not self.queue_depth and self.active < self.max_concurrency:
+            return 0.0
+        return (self.queue_depth + 1) / self.max_concurrency * self.latencies.mean()
+
+    @staticmethod
+    def lane_of(prompt: BuiltPrompt) -> str:
+        return prompt.priority if prompt.priority in LANES else LANE_FREE
+
+    def _budget_wait(self, cost: int) -> float:
+        return max(self.request_bucket.wait_time(1), self.token_bucket.wait_time(cost))
+
+    def _admit(self, cost: int, lane: str) -> None:
+        self.request_bucket.consume(1)
+        self.token_bucket.consume(cost)
+        self.active += 1
+        self.admitted += 1
+        self.lane_admitted[lane] += 1
+
+    def _next_waiter(self) -> _Waiter | None:
+        for lane in self._lanes.values():
+            while lane and lane[0].future.done():
+                lane.popleft()
+        free = self._lanes[LANE_FREE]
+        if free and time.monotonic() - free[0].enqueued_at >= self.starvation_s:
+            heads = [lane[0] for lane in self._lanes.values() if lane]
+            if min(heads, key=lambda waiter: waiter.tag) is not free[0]:
+                self.starvation_promotions += 1
+            return free[0]
+        heads = [lane[0] for lane in self._lanes.values() if lane]
+        return min(heads, key=lambda waiter: waiter.tag) if heads else None
+
+    def _dispatch(self) -> None:
+        self._timer = None
+        while self.active < self.max_concurrency:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            delay = self._budget_wait(waiter.cost)
+            if delay > 0:
+                self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+                return
+            self._lanes[waiter.lane].popleft()
+            self._virtual_time = max(self._virtual_time, waiter.tag)
+            self._admit(waiter.cost, waiter.lane)
+            waiter.future.set_result(None)
+
+    def _record_wait(self, lane: str, waited: float) -> None:
+        self.wait_times.add(waited)
+        self.lane_waits[lane].add(waited)
+        if waited > self.slo_s[lane]:
+            self.slo_violations[lane] += 1
+
+    async def _acquire(self, cost: int, lane: str) -> None:
+        if not self.queue_depth and self.active < self.max_concurrency and self._budget_wait(cost) == 0:
+            self._admit(cost, lane)
+            self._record_wait(lane, 0.0)
+            return
+        if self.queue_depth >= self.max_queue:
+            self.rejected += 1
+            logger.warning("AI queue is full (%s waiting), %s request rejected", self.queue_depth, lane)
+            raise AIOverloadedError("Сервис перегружен, попробуйте через минуту")
+
+        tag = max(self._virtual_time, self._lane_tags[lane]) + 1 / self.weights[lane]
+        self._lane_tags[lane] = tag
+        waiter = _Waiter(cost=cost, lane=lane, tag=tag, future=asyncio.get_running_loop().create_future())
+        self._lanes[lane].append(waiter)
+        self.max_depth = max(self.max_depth, self.queue_depth)
+        if self._timer is None:
+            self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=self.max_wait_s)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as exc:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Admitted at the last moment: give the slot back.
+                self._release()
+            else:
+                waiter.future.cancel()
+            if isinstance(exc, asyncio.TimeoutError):
+                self.timed_out += 1
+                logger.warning("AI queue wait exceeded %.1f s (%s lane)", self.max_wait_s, lane)
+                raise AIOverloadedError("Очередь к AI слишком длинная, попробуйте позже") from exc
+            raise
+        finally:
+            self._record_wait(lane, time.monotonic() - waiter.enqueued_at)
+
+    def _release(self) -> None:
+        self.active -= 1
+        if self._timer is None:
+            self._dispatch()
+
+    def _settle(self, prompt: BuiltPrompt, cost: int) -> None:
+        billed = prompt.billed_tokens()
+        if billed is not None:
+            self.token_bucket.adjust(cost - billed)
+
+    async def generate(self, prompt: BuiltPrompt) -> str:
+        cost = prompt.estimated_tokens()
+        await self._acquire(cost, self.lane_of(prompt))
+        started = time.monotonic()
+        try:
+            return await self.inner.generate(prompt)
+        finally:
+            self.latencies.add(time.monotonic() - started)
+            self._settle(prompt, cost)
+            self._release()
+
+    async def generate_stream(self, prompt: BuiltPrompt) -> AsyncIterator[str]:
+        cost = prompt.estimated_tokens()
+        await self._acquire(cost, self.lane_of(prompt))
+        started = time.monotonic()
+        try:
+            async for chunk in self.inner.generate_stream(prompt):
+                yield chunk
+        finally:
+            self.latencies.add(time.monotonic() - started)
+            self._settle(prompt, cost)
+            self._release()
+
+    def stats(self) -> dict[str, object]:
+        return {
+            "active": self.active,
+            "queue_depth": self.queue_depth,
+            "max_depth": self.max_depth,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "wait": self.wait_times.summary(),
+            "latency": self.latencies.summary(),
+            "starvation_promotions": self.starvation_promotions,
+            "lanes": {
+                lane: {
+                    "depth": len(self._lanes[lane]),
+                    "admitted": self.lane_admitted[lane],
+                    "wait": self.lane_waits[lane].summary(),
+                    "slo_wait_s": self.slo_s[lane],
+                    "slo_violations": self.slo_violations[lane],
+                }
+                for lane in LANES
+            },
+        }
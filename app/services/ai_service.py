@@ -3,21 +3,42 @@ from __future__ import annotations
 import abc
 import asyncio
 import logging
-import socket
 from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncIterator
+
+import httpx
 
 from app.config.settings import settings
-from app.services.prompt_builder import BuiltPrompt
+from app.services.http_clients import http_clients
+from app.services.prompt_builder import BuiltPrompt, TokenUsage
+from app.services.retry_policy import (
+    ERROR_CONNECTION,
+    ERROR_OTHER,
+    ERROR_RATE_LIMIT,
+    ERROR_SERVER,
+    ERROR_TIMEOUT,
+    RetryPolicy,
+    parse_retry_after,
+)
 
 logger = logging.getLogger(__name__)
 
 try:  # pragma: no cover - optional
     from openai import AsyncOpenAI
     from openai import BadRequestError
-    from openai._exceptions import APIError, AuthenticationError, RateLimitError
+    from openai._exceptions import (
+        APIConnectionError,
+        APIError,
+        APIStatusError,
+        APITimeoutError,
+        AuthenticationError,
+        RateLimitError,
+    )
 except Exception:  # pragma: no cover
     AsyncOpenAI = None
     BadRequestError = AuthenticationError = APIError = RateLimitError = None
+    APIConnectionError = APIStatusError = APITimeoutError = None
 
 
 class AIService(abc.ABC):
@@ -32,57 +53,250 @@ class AIService(abc.ABC):
         )
         return await self.generate(prompt)
 
+    async def generate_stream(self, prompt: BuiltPrompt) -> AsyncIterator[str]:
+        """Yield the response in text pieces; backends without streaming yield it whole."""
+        yield await self.generate(prompt)
+
 
 class AIServiceError(RuntimeError):
     pass
 
 
+class AIOverloadedError(AIServiceError):
+    """The request was shed before reaching the provider (queue full or waited too long)."""
+
+
+class AICircuitOpenError(AIServiceError):
+    """The provider is failing and the circuit breaker has no fallback to offer."""
+
+
+class AIServiceWrapper(AIService):
+    """Base for layers stacked in front of another AIService."""
+
+    def __init__(self, inner: AIService) -> None:
+        self.inner = inner
+
+    async def generate(self, prompt: BuiltPrompt) -> str:
+        return await self.inner.generate(prompt)
+
+    async def healthcheck(self) -> str:
+        return await self.inner.healthcheck()
+
+    async def generate_stream(self, prompt: BuiltPrompt) -> AsyncIterator[str]:
+        async for chunk in self.inner.generate_stream(prompt):
+            yield chunk
+
+
+STUB_RESPONSE = "Режим STUB: это демо-гороскоп. Подключите OpenAI, чтобы получить реальный прогноз."
+
+
 class StubAIService(AIService):
+    def __init__(self, chunk_delay: float = 0.05) -> None:
+        self.chunk_delay = chunk_delay
+
     async def generate(self, prompt: BuiltPrompt) -> str:  # pragma: no cover - stub
         logger.info("Stub AI generation (offline mode)")
-        return "Режим STUB: это демо-гороскоп. Подключите OpenAI, чтобы получить реальный прогноз."
+        return STUB_RESPONSE
+
+    async def generate_stream(self, prompt: BuiltPrompt) -> AsyncIterator[str]:  # pragma: no cover - stub
+        logger.info("Stub AI streaming generation (offline mode)")
+        words = STUB_RESPONSE.split(" ")
+        for idx, word in enumerate(words):
+            await asyncio.sleep(self.chunk_delay)
+            yield word if idx == 0 else f" {word}"
+
+
+class FakeAIService(AIService):
+    """Offline backend with a scripted latency profile, for hedging and load tests.
+
+    Every ``slow_every``-th call takes ``slow_latency_s`` instead of ``latency_s``;
+    every ``fail_every``-th call raises :class:`AIServiceError`.
+    """
+
+    def __init__(
+        self,
+        name: str = "fake",
+        latency_s: float = 0.05,
+        slow_latency_s: float = 1.0,
+        slow_every: int = 0,
+        fail_every: int = 0,
+    ) -> None:
+        self.name = name
+        self.latency_s = latency_s
+        self.slow_latency_s = slow_latency_s
+        self.slow_every = slow_every
+        self.fail_every = fail_every
+        self.calls = 0
+        self.cancelled = 0
+
+    async def _wait(self, prompt: BuiltPrompt) -> str:
+        self.calls += 1
+        call = self.calls
+        slow = self.slow_every and call % self.slow_every == 0
+        try:
+            await asyncio.sleep(self.slow_latency_s if slow else self.latency_s)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.fail_every and call % self.fail_every == 0:
+            raise AIServiceError(f"{self.name}: сбой #{call}")
+        text = f"{self.name}: ответ #{call}"
+        prompt.usage = TokenUsage(prompt.estimated_tokens() - prompt.max_tokens, len(text) // 3, self.name)
+        return text
+
+    async def generate(self, prompt: BuiltPrompt) -> str:
+        return await self._wait(prompt)
+
+    async def generate_stream(self, prompt: BuiltPrompt) -> AsyncIterator[str]:
+        words = (await self._wait(prompt)).split(" ")
+        for idx, word in enumerate(words):
+            yield word if idx == 0 else f" {word}"
 
 
 class OpenAIService(AIService):
-    def __init__(self, api_key: str, model: str = "gpt-4o-mini") -> None:
+    def __init__(
+        self,
+        api_key: str,
+        model: str = "gpt-4o-mini",
+        retry: RetryPolicy | None = None,
+        base_url: str | None = None,
+    ) -> None:
         if AsyncOpenAI is None:
             raise RuntimeError("OpenAI SDK не установлен")
-        self.client = AsyncOpenAI(api_key=api_key, timeout=30.0, max_retries=2)
+        self.retry = retry or RetryPolicy(classify_openai_error, retry_after=openai_retry_after)
+        self.api_key = api_key
+        self.base_url = base_url
         self.model = model
+        self._client: AsyncOpenAI | None = None
+        self._http_client: httpx.AsyncClient | None = None
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        """SDK client on the connection pool of the running event loop."""
+
+        http_client = http_clients.openai()
+        if self._client is None or http_client is not self._http_client:
+            # Retries and timeouts belong to self.retry; the SDK must not add its own on top.
+            self._client = AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                timeout=self.retry.attempt_timeout_s,
+                max_retries=0,
+                http_client=http_client,
+            )
+            self._http_client = http_client
+        return self._client
+
+    def _messages(self, prompt: BuiltPrompt) -> list[dict[str, str]]:
+        return [
+            {"role": "system", "content": prompt.system_prompt},
+            {"role": "user", "content": prompt.user_prompt},
+        ]
 
     async def _call_completion(self, prompt: BuiltPrompt) -> str:
         completion = await self.client.chat.completions.create(
             model=self.model,
-            messages=[
-                {"role": "system", "content": prompt.system_prompt},
-                {"role": "user", "content": prompt.user_prompt},
-            ],
-            max_tokens=700,
+            messages=self._messages(prompt),
+            max_tokens=prompt.max_tokens,
             temperature=0.7,
         )
+        if completion.usage is not None:
+            prompt.usage = TokenUsage(
+                completion.usage.prompt_tokens, completion.usage.completion_tokens, completion.model or self.model
+            )
         return completion.choices[0].message.content or ""
 
     async def generate(self, prompt: BuiltPrompt) -> str:  # pragma: no cover - network call
         try:
-            return await asyncio.wait_for(self._call_completion(prompt), timeout=40.0)
-        except asyncio.TimeoutError as exc:
-            logger.exception("OpenAI request timeout")
-            raise AIServiceError("Timeout при обращении к OpenAI") from exc
-        except AuthenticationError as exc:  # type: ignore[misc]
-            logger.exception("OpenAI authentication error")
-            raise AIServiceError("Проверьте OPENAI_API_KEY: доступ запрещен") from exc
-        except RateLimitError as exc:  # type: ignore[misc]
-            logger.exception("OpenAI rate limit")
-            raise AIServiceError("OpenAI вернул 429 (лимиты). Попробуйте позже") from exc
-        except APIError as exc:  # type: ignore[misc]
-            logger.exception("OpenAI server error")
-            raise AIServiceError("Сервер OpenAI недоступен, попробуйте позже") from exc
-        except BadRequestError as exc:  # type: ignore[misc]
-            logger.exception("OpenAI bad request: %s", exc)
-            raise AIServiceError("Некорректный запрос в OpenAI") from exc
-        except Exception as exc:  # pragma: no cover - unexpected
-            logger.exception("OpenAI request failed: %s", exc)
-            raise AIServiceError("Не удалось получить ответ от OpenAI") from exc
+            return await self.retry.run(lambda: self._call_completion(prompt))
+        except Exception as exc:
+            raise _translate_openai_error(exc) from exc
+
+    async def generate_stream(self, prompt: BuiltPrompt) -> AsyncIterator[str]:  # pragma: no cover - network call
+        deadline = self.retry.deadline()
+        try:
+            # Only opening the stream is retried: once text reached the user, a retry would repeat it.
+            stream = await self.retry.run(
+                lambda: self.client.chat.completions.create(
+                    model=self.model,
+                    messages=self._messages(prompt),
+                    max_tokens=prompt.max_tokens,
+                    temperature=0.7,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                ),
+                deadline=deadline,
+            )
+            async with asyncio.timeout(deadline.remaining()):
+                async for chunk in stream:
+                    if chunk.usage is not None:
+                        prompt.usage = TokenUsage(
+                            chunk.usage.prompt_tokens, chunk.usage.completion_tokens, chunk.model or self.model
+                        )
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+        except Exception as exc:
+            raise _translate_openai_error(exc) from exc
+
+    def stats(self) -> dict[str, object]:
+        return {"retry": self.retry.stats()}
+
+
+def classify_openai_error(exc: BaseException) -> str:
+    if isinstance(exc, asyncio.TimeoutError) or (APITimeoutError is not None and isinstance(exc, APITimeoutError)):
+        return ERROR_TIMEOUT
+    if APIConnectionError is not None and isinstance(exc, APIConnectionError):
+        return ERROR_CONNECTION
+    if APIStatusError is not None and isinstance(exc, APIStatusError):
+        if exc.status_code == 429:
+            # An exhausted account quota is also a 429 but will not pass on retry.
+            return ERROR_OTHER if getattr(exc, "code", None) == "insufficient_quota" else ERROR_RATE_LIMIT
+        if exc.status_code in (500, 502, 503, 504):
+            return ERROR_SERVER
+    return ERROR_OTHER
+
+
+def openai_retry_after(exc: BaseException) -> float | None:
+    if APIStatusError is None or not isinstance(exc, APIStatusError):
+        return None
+    if exc.status_code not in (429, 503):
+        return None
+    return parse_retry_after(exc.response.headers)
+
+
+def _translate_openai_error(exc: Exception) -> AIServiceError:
+    if isinstance(exc, AIServiceError):
+        return exc
+    if isinstance(exc, asyncio.TimeoutError):
+        logger.exception("OpenAI request timeout")
+        return AIServiceError("Timeout при обращении к OpenAI")
+    if AuthenticationError is not None and isinstance(exc, AuthenticationError):
+        logger.exception("OpenAI authentication error")
+        return AIServiceError("Проверьте OPENAI_API_KEY: доступ запрещен")
+    if RateLimitError is not None and isinstance(exc, RateLimitError):
+        logger.exception("OpenAI rate limit")
+        return AIServiceError("OpenAI вернул 429 (лимиты). Попробуйте позже")
+    if APIError is not None and isinstance(exc, APIError):
+        logger.exception("OpenAI server error")
+        return AIServiceError("Сервер OpenAI недоступен, попробуйте позже")
+    if BadRequestError is not None and isinstance(exc, BadRequestError):
+        logger.exception("OpenAI bad request: %s", exc)
+        return AIServiceError("Некорректный запрос в OpenAI")
+    logger.exception("OpenAI request failed: %s", exc)
+    return AIServiceError("Не удалось получить ответ от OpenAI")
+
+
+def parse_ai_backends(value: str) -> list[tuple[str, str | None]]:
+    """``AI_BACKENDS``: comma-separated ``model`` or ``model@base_url`` entries, primary first."""
+
+    backends: list[tuple[str, str | None]] = []
+    for entry in value.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        model, _, base_url = entry.partition("@")
+        backends.append((model.strip(), base_url.strip() or None))
+    return backends or [("gpt-4o-mini", None)]
 
 
 @dataclass(slots=True)
@@ -91,12 +305,36 @@ class AIResolution:
     mode: str
 
 
-def resolve_ai_service() -> AIResolution:
+def resolve_ai_service(circuit_state_path: str | Path | None = None) -> AIResolution:
+    """Pick the AI provider from the settings.
+
+    ``circuit_state_path`` is where the circuit breaker writes its transitions; only the
+    bot passes it, so tools building their own service leave the bot's file alone.
+    """
+
     if settings.use_openai:
         if settings.openai_api_key:
             try:
-                logger.info("AI mode: OpenAI (%s)", "gpt-4o-mini")
-                return AIResolution(OpenAIService(settings.openai_api_key), mode="openai")
+                backends = parse_ai_backends(settings.ai_backends)
+                logger.info("AI mode: OpenAI (%s)", ", ".join(model for model, _ in backends))
+                services: list[AIService] = [
+                    OpenAIService(settings.openai_api_key, model=model, base_url=base_url)
+                    for model, base_url in backends
+                ]
+                service: AIService = services[0]
+                # Imported here: these modules build on the classes above.
+                from app.services.circuit_breaker import CircuitBreakerAIService
+                from app.services.hedging import HedgingAIService
+
+                if len(services) > 1:
+                    service = HedgingAIService(services)
+                if settings.ai_circuit_enabled:
+                    service = CircuitBreakerAIService(
+                        service,
+                        fallback=StubAIService() if settings.ai_circuit_fallback else None,
+                        state_path=circuit_state_path,
+                    )
+                return AIResolution(service, mode="openai")
             except Exception as exc:  # pragma: no cover - runtime guard
                 logger.warning("Не удалось инициализировать OpenAI: %s. Переключаюсь на STUB.", exc)
         else:
@@ -104,10 +342,3 @@ def resolve_ai_service() -> AIResolution:
     logger.info("AI mode: STUB")
     return AIResolution(StubAIService(), mode="stub")
 
-
-def check_network_host(host: str, port: int, timeout: float = 3.0) -> bool:
-    try:
-        with socket.create_connection((host, port), timeout=timeout):
-            return True
-    except OSError:
-        return False
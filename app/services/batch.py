@@ -0,0 +1,360 @@
+from __future__ import annotations
+
+import abc
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable
+
+from app.config.settings import settings
+from app.services.ai_service import STUB_RESPONSE, parse_ai_backends
+from app.services.http_clients import http_clients
+from app.services.cost_ledger import CostLedger
+from app.services.prompt_builder import BuiltPrompt, TokenUsage, prompt_hash
+from app.services.response_cache import CachingAIService, cache_expiry
+
+logger = logging.getLogger(__name__)
+
+try:  # pragma: no cover - optional
+    from openai import AsyncOpenAI
+except Exception:  # pragma: no cover
+    AsyncOpenAI = None
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+# OpenAI batch states after which nothing changes any more.
+FINAL_STATES = frozenset({"completed", "failed", "expired", "cancelled"})
+# The Batch API bills tokens at half the interactive price.
+BATCH_PRICE_FACTOR = 0.5
+
+
+def chat_body(prompt: BuiltPrompt, model: str) -> dict[str, Any]:
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": prompt.system_prompt},
+            {"role": "user", "content": prompt.user_prompt},
+        ],
+        "max_tokens": prompt.max_tokens,
+        "temperature": 0.7,
+    }
+
+
+@dataclass(slots=True)
+class BatchStatus:
+    state: str
+    output_file_id: str | None = None
+    error_file_id: str | None = None
+
+
+class BatchProvider(abc.ABC):
+    """Where batch jobs run: the OpenAI Batch API or a local stand-in."""
+
+    model: str = ""
+
+    @abc.abstractmethod
+    async def submit(self, input_path: Path) -> str:
+        """Upload the JSONL input and start a batch; returns the batch id."""
+
+    @abc.abstractmethod
+    async def status(self, batch_id: str) -> BatchStatus:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def download(self, file_id: str) -> str:
+        raise NotImplementedError
+
+
+class OpenAIBatchProvider(BatchProvider):  # pragma: no cover - network calls
+    def __init__(self, api_key: str, model: str = "gpt-4o-mini", base_url: str | None = None) -> None:
+        if AsyncOpenAI is None:
+            raise RuntimeError("OpenAI SDK не установлен")
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model = model
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        # Built per call on the pool of the running loop, see HttpClients.
+        return AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, http_client=http_clients.openai())
+
+    async def submit(self, input_path: Path) -> str:
+        with input_path.open("rb") as handle:
+            uploaded = await self.client.files.create(file=handle, purpose="batch")
+        batch = await self.client.batches.create(
+            input_file_id=uploaded.id, endpoint=BATCH_ENDPOINT, completion_window="24h"
+        )
+        return batch.id
+
+    async def status(self, batch_id: str) -> BatchStatus:
+        batch = await self.client.batches.retrieve(batch_id)
+        return BatchStatus(batch.status, batch.output_file_id, batch.error_file_id)
+
+    async def download(self, file_id: str) -> str:
+        content = await self.client.files.content(file_id)
+        return content.text
+
+
+class LocalBatchProvider(BatchProvider):
+    """File-based stand-in for the Batch API: answers every line with ``responder``.
+
+    A batch completes on its ``polls_to_complete``-th status check, which is enough
+    to exercise submit/poll/resume/ingest offline. Lines the responder raises on go
+    to the error file, like requests the Batch API rejects.
+    """
+
+    model = "local"
+
+    def __init__(
+        self, directory: str | Path, responder: Callable[[dict[str, Any]], str], polls_to_complete: int = 1
+    ) -> None:
+        self.directory = Path(directory)
+        self.responder = responder
+        self.polls_to_complete = polls_to_complete
+        self.submitted = 0
+
+    def _paths(self, batch_id: str) -> tuple[Path, Path, Path, Path]:
+        return (
+            self.directory / f"{batch_id}.input.jsonl",
+            self.directory / f"{batch_id}.output.jsonl",
+            self.directory / f"{batch_id}.errors.jsonl",
+            self.directory / f"{batch_id}.polls",
+        )
+
+    async def submit(self, input_path: Path) -> str:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        batch_id = f"local_batch_{uuid.uuid4().hex[:12]}"
+        stored, _, _, polls = self._paths(batch_id)
+        stored.write_text(input_path.read_text(encoding="utf-8"), encoding="utf-8")
+        polls.write_text("0", encoding="utf-8")
+        self.submitted += 1
+        return batch_id
+
+    async def status(self, batch_id: str) -> BatchStatus:
+        stored, output, errors, polls = self._paths(batch_id)
+        if not stored.exists():
+            return BatchStatus("failed")
+        count = int(polls.read_text(encoding="utf-8")) + 1
+        polls.write_text(str(count), encoding="utf-8")
+        if count < self.polls_to_complete:
+            return BatchStatus("in_progress")
+        if not output.exists():
+            lines = []
+            failed = []
+            for raw in stored.read_text(encoding="utf-8").splitlines():
+                request = json.loads(raw)
+                try:
+                    text = self.responder(request["body"])
+                except Exception as exc:
+                    error = {"status_code": 500, "body": {"error": {"message": str(exc)}}}
+                    line = {"custom_id": request["custom_id"], "response": error}
+                    failed.append(json.dumps(line, ensure_ascii=False))
+                    continue
+                prompt_chars = sum(len(message["content"]) for message in request["body"]["messages"])
+                body = {
+                    "model": self.model,
+                    "choices": [{"message": {"role": "assistant", "content": text}}],
+                    # Rough token counts (about four characters per token), like a real batch reports.
+                    "usage": {"prompt_tokens": prompt_chars // 4, "completion_tokens": len(text) // 4},
+                }
+                lines.append(
+                    json.dumps(
+                        {"custom_id": request["custom_id"], "response": {"status_code": 200, "body": body}},
+                        ensure_ascii=False,
+                    )
+                )
+            output.write_text("\n".join(lines), encoding="utf-8")
+            if failed:
+                errors.write_text("\n".join(failed), encoding="utf-8")
+        return BatchStatus(
+            "completed", output_file_id=output.name, error_file_id=errors.name if errors.exists() else None
+        )
+
+    async def download(self, file_id: str) -> str:
+        return (self.directory / file_id).read_text(encoding="utf-8")
+
+
+def resolve_batch_provider() -> BatchProvider:
+    """OpenAI Batch API (first ``AI_BACKENDS`` entry) when OpenAI is configured, otherwise the local stand-in."""
+
+    if settings.use_openai and settings.openai_api_key:
+        model, base_url = parse_ai_backends(settings.ai_backends)[0]
+        return OpenAIBatchProvider(settings.openai_api_key, model=model, base_url=base_url)
+    return LocalBatchProvider(Path(settings.ai_batch_dir) / "local", responder=lambda body: STUB_RESPONSE)
+
+
+@dataclass(slots=True)
+class BatchReport:
+    state: str = "empty"
+    batch_id: str = ""
+    submitted: int = 0
+    ingested: int = 0
+    failed: int = 0
+    expired: int = 0
+
+
+class BatchGenerator:
+    """Bulk generation through a batch job, with results ingested into the response cache.
+
+    Each named job keeps a manifest in ``work_dir``: the batch id, the request ids
+    (cache keys) and their expiry. Running the same job again resumes polling the
+    batch that is in flight instead of submitting a new one; a finished job is
+    ingested once and only prompts that are still missing from the cache go into the
+    next batch. Results whose cache entry would already have expired are dropped.
+    The ``usage`` of every result line goes to ``ledger`` at the batch price.
+    """
+
+    def __init__(
+        self,
+        provider: BatchProvider,
+        cache: CachingAIService,
+        work_dir: str | Path | None = None,
+        poll_interval_s: float | None = None,
+        ledger: CostLedger | None = None,
+    ) -> None:
+        self.provider = provider
+        self.cache = cache
+        self.ledger = ledger
+        self.work_dir = Path(work_dir or settings.ai_batch_dir)
+        self.poll_interval_s = poll_interval_s if poll_interval_s is not None else settings.ai_batch_poll_s
+
+    def _manifest_path(self, job: str) -> Path:
+        return self.work_dir / f"{job}.json"
+
+    def _load(self, job: str) -> dict[str, Any] | None:
+        path = self._manifest_path(job)
+        if not path.exists():
+            return None
+        return json.loads(path.read_text(encoding="utf-8"))
+
+    def _save(self, job: str, manifest: dict[str, Any]) -> None:
+        path = self._manifest_path(job)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(manifest, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(path)
+
+    async def _submit(self, job: str, prompts: list[BuiltPrompt]) -> dict[str, Any]:
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        input_path = self.work_dir / f"{job}.input.jsonl"
+        requests: dict[str, dict[str, Any]] = {}
+        with input_path.open("w", encoding="utf-8") as handle:
+            for prompt in prompts:
+                key = self.cache.cache_key(prompt)
+                if key in requests:
+                    continue
+                requests[key] = {
+                    "mode": prompt.mode,
+                    "focus": prompt.focus,
+                    "prompt_hash": prompt_hash(prompt),
+                    "expires_at": cache_expiry(prompt.mode),
+                }
+                line = {
+                    "custom_id": key,
+                    "method": "POST",
+                    "url": BATCH_ENDPOINT,
+                    "body": chat_body(prompt, self.provider.model),
+                }
+                handle.write(json.dumps(line, ensure_ascii=False) + "\n")
+        batch_id = await self.provider.submit(input_path)
+        manifest = {"batch_id": batch_id, "state": "submitted", "submitted_at": time.time(), "requests": requests}
+        self._save(job, manifest)
+        logger.info("Batch %s submitted for job %s (%s requests)", batch_id, job, len(requests))
+        return manifest
+
+    async def _ingest(self, job: str, manifest: dict[str, Any], status: BatchStatus, report: BatchReport) -> None:
+        usages: list[tuple[dict[str, Any], dict[str, Any]]] = []
+        if status.output_file_id:
+            now = time.time()
+            for raw in (await self.provider.download(status.output_file_id)).splitlines():
+                if not raw.strip():
+                    continue
+                line = json.loads(raw)
+                request = manifest["requests"].get(line.get("custom_id"))
+                response = line.get("response") or {}
+                if request is None or response.get("status_code") != 200:
+                    report.failed += 1
+                    continue
+                usages.append((request, response["body"]))
+                expires_at = request.get("expires_at")
+                if not expires_at or expires_at <= now:
+                    report.expired += 1
+                    continue
+                text = response["body"]["choices"][0]["message"]["content"] or ""
+                await self.cache.cache.put(line["custom_id"], text, request["mode"], expires_at)
+                report.ingested += 1
+        if status.error_file_id:
+            await self._log_errors(manifest["batch_id"], status.error_file_id)
+        # Requests missing from the output (rejected or left over in an expired batch) count as failed.
+        report.failed = len(manifest["requests"]) - report.ingested - report.expired
+        manifest["state"] = "ingested"
+        manifest["batch_state"] = status.state
+        self._save(job, manifest)
+        # Billed only once the manifest says "ingested": a rerun after an interrupted
+        # ingest stores the answers again, but must not count their cost twice.
+        for request, body in usages:
+            await self._record_usage(request, body)
+        logger.info(
+            "Batch %s (%s) ingested: %s stored, %s failed, %s expired",
+            manifest["batch_id"],
+            status.state,
+            report.ingested,
+            report.failed,
+            report.expired,
+        )
+
+    async def _log_errors(self, batch_id: str, file_id: str) -> None:
+        reasons: Counter[str] = Counter()
+        for raw in (await self.provider.download(file_id)).splitlines():
+            if not raw.strip():
+                continue
+            line = json.loads(raw)
+            error = line.get("error") or ((line.get("response") or {}).get("body") or {}).get("error") or {}
+            reasons[error.get("message") or "unknown error"] += 1
+        for reason, count in reasons.most_common():
+            logger.warning("Batch %s: %s requests failed: %s", batch_id, count, reason)
+
+    async def _record_usage(self, request: dict[str, Any], body: dict[str, Any]) -> None:
+        usage = body.get("usage")
+        if self.ledger is None or not usage:
+            return
+        await self.ledger.record_usage(
+            request.get("prompt_hash", ""),
+            request["mode"],
+            request.get("focus", ""),
+            TokenUsage(
+                usage.get("prompt_tokens", 0),
+                usage.get("completion_tokens", 0),
+                model=body.get("model") or self.provider.model,
+            ),
+            price_factor=BATCH_PRICE_FACTOR,
+        )
+
+    async def run(self, job: str, prompts: list[BuiltPrompt], max_wait_s: float | None = None) -> BatchReport:
+        """Submit (or resume) ``job`` and wait up to ``max_wait_s`` for it to finish."""
+
+        report = BatchReport()
+        manifest = self._load(job)
+        if manifest is None or manifest.get("state") == "ingested":
+            missing = [prompt for prompt in prompts if await self.cache.lookup(prompt) is None]
+            if not missing:
+                return report
+            manifest = await self._submit(job, missing)
+        report.batch_id = manifest["batch_id"]
+        report.submitted = len(manifest["requests"])
+
+        max_wait_s = max_wait_s if max_wait_s is not None else settings.ai_batch_max_wait_s
+        deadline = time.monotonic() + max_wait_s
+        while True:
+            status = await self.provider.status(manifest["batch_id"])
+            report.state = status.state
+            if status.state in FINAL_STATES:
+                await self._ingest(job, manifest, status, report)
+                return report
+            if time.monotonic() + self.poll_interval_s > deadline:
+                logger.info("Batch %s is %s, run the job again later to resume", manifest["batch_id"], status.state)
+                return report
+            await asyncio.sleep(self.poll_interval_s)
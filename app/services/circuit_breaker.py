@@ -0,0 +1,246 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+from collections import Counter, deque
+from pathlib import Path
+from typing import Any, AsyncIterator
+
+from app.config.settings import settings
+from app.services.ai_service import AICircuitOpenError, AIOverloadedError, AIService, AIServiceWrapper
+from app.services.prompt_builder import BuiltPrompt
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+def circuit_state_path(worker: int = 0) -> Path:
+    """State file of one bot process: ``AI_CIRCUIT_STATE_PATH`` for worker 0, a sibling for the others."""
+
+    path = Path(settings.ai_circuit_state_path)
+    return path if worker == 0 else path.with_name(f"{path.stem}.worker{worker}{path.suffix}")
+
+
+def read_circuit_state(path: str | Path | None = None) -> dict[str, Any] | None:
+    """Last state written by a running bot, ``None`` if there is none (used by the launcher)."""
+
+    path = Path(path or settings.ai_circuit_state_path)
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def read_worker_circuit_states() -> dict[int, dict[str, Any]]:
+    """States written by the bot processes, keyed by worker number."""
+
+    base = circuit_state_path()
+    paths = {0: base}
+    for path in base.parent.glob(f"{base.stem}.worker*{base.suffix}"):
+        number = path.name[len(base.stem) + len(".worker") : len(path.name) - len(base.suffix)]
+        if number.isdigit():
+            paths[int(number)] = path
+    states = {worker: read_circuit_state(path) for worker, path in sorted(paths.items())}
+    return {worker: state for worker, state in states.items() if state is not None}
+
+
+class CircuitBreakerAIService(AIServiceWrapper):
+    """Stops calling a failing AI provider until it recovers.
+
+    The last ``window`` calls are kept as (failed, slow) outcomes. Once there are at
+    least ``min_calls`` of them and the error rate or the share of calls slower than
+    ``slow_call_s`` reaches its threshold, the circuit opens: requests get the
+    ``fallback`` answer (or :class:`AICircuitOpenError`) without touching the provider.
+    After ``open_s`` the next request starts a ``healthcheck()`` probe in the
+    background (half-open); a successful probe closes the circuit, a failed one
+    opens it again. Shed requests (:class:`AIOverloadedError`) are not counted.
+
+    Transitions are written to ``state_path`` when it is given (only the bot passes one).
+    """
+
+    def __init__(
+        self,
+        inner: AIService,
+        fallback: AIService | None = None,
+        window: int | None = None,
+        min_calls: int | None = None,
+        error_rate: float | None = None,
+        slow_call_s: float | None = None,
+        slow_rate: float | None = None,
+        open_s: float | None = None,
+        probe_timeout_s: float | None = None,
+        state_path: str | Path | None = None,
+    ) -> None:
+        super().__init__(inner)
+        self.fallback = fallback
+        self._outcomes: deque[tuple[bool, bool]] = deque(maxlen=window or settings.ai_circuit_window)
+        self.min_calls = min_calls or settings.ai_circuit_min_calls
+        self.error_rate = error_rate if error_rate is not None else settings.ai_circuit_error_rate
+        self.slow_call_s = slow_call_s if slow_call_s is not None else settings.ai_circuit_slow_call_s
+        self.slow_rate = slow_rate if slow_rate is not None else settings.ai_circuit_slow_rate
+        self.open_s = open_s if open_s is not None else settings.ai_circuit_open_s
+        self.probe_timeout_s = probe_timeout_s if probe_timeout_s is not None else settings.ai_circuit_probe_timeout_s
+        self.state_path = Path(state_path) if state_path else None
+        self.state = STATE_CLOSED
+        self._changed_at = time.monotonic()
+        self._reason = ""
+        self._probe: asyncio.Task[None] | None = None
+        self.transitions: Counter[str] = Counter()
+        self.short_circuited = 0
+        self.fallbacks = 0
+        self.probes = 0
+
+    def _transition(self, state: str, reason: str) -> None:
+        if state == self.state:
+            return
+        log = logger.info if state == STATE_CLOSED else logger.warning
+        log("AI circuit %s -> %s: %s", self.state, state, reason)
+        self.transitions[f"{self.state}->{state}"] += 1
+        self.state = state
+        self._changed_at = time.monotonic()
+        self._reason = reason
+        if state == STATE_CLOSED:
+            self._outcomes.clear()
+        self._write_state()
+
+    def _write_state(self) -> None:
+        if self.state_path is None:
+            return
+        try:
+            self.state_path.parent.mkdir(parents=True, exist_ok=True)
+            self.state_path.write_text(
+                json.dumps(
+                    {"state": self.state, "reason": self._reason, "since": time.time(), **self.stats()},
+                    ensure_ascii=False,
+                ),
+                encoding="utf-8",
+            )
+        except OSError:  # pragma: no cover - runtime guard
+            logger.exception("Failed to write AI circuit state")
+
+    def _record(self, failed: bool, elapsed: float) -> None:
+        if self.state != STATE_CLOSED:
+            # A call admitted before the circuit opened; the probe decides from here.
+            return
+        self._outcomes.append((failed, elapsed >= self.slow_call_s))
+        if len(self._outcomes) < self.min_calls:
+            return
+        total = len(self._outcomes)
+        errors = sum(1 for failed_call, _ in self._outcomes if failed_call) / total
+        slow = sum(1 for _, slow_call in self._outcomes if slow_call) / total
+        if errors >= self.error_rate:
+            self._transition(STATE_OPEN, f"ошибок {errors:.0%} из {total} запросов")
+        elif slow >= self.slow_rate:
+            self._transition(STATE_OPEN, f"медленных ответов {slow:.0%} из {total} запросов")
+
+    async def _run_probe(self) -> None:
+        self.probes += 1
+        try:
+            await asyncio.wait_for(self.inner.healthcheck(), timeout=self.probe_timeout_s)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            self._transition(STATE_OPEN, f"проверка не прошла: {exc}")
+        else:
+            self._transition(STATE_CLOSED, "проверка прошла")
+        finally:
+            self._probe = None
+
+    def _allow(self) -> bool:
+        """Whether a request may go to the provider; starts the probe when it is due."""
+
+        if self.state == STATE_CLOSED:
+            return True
+        if self.state == STATE_OPEN and time.monotonic() - self._changed_at >= self.open_s and self._probe is None:
+            self._transition(STATE_HALF_OPEN, "пробный запрос")
+            self._probe = asyncio.create_task(self._run_probe())
+        return False
+
+    def short_circuit(self, prompt: BuiltPrompt) -> AIService | None:
+        """``None`` when the request may go to the provider, otherwise the service that answers instead.
+
+        Raises :class:`AICircuitOpenError` when the circuit is open and there is no fallback.
+        """
+
+        if self._allow():
+            return None
+        self.short_circuited += 1
+        if self.fallback is None:
+            raise AICircuitOpenError("AI временно недоступен, попробуйте через минуту")
+        self.fallbacks += 1
+        prompt.fallback = True
+        return self.fallback
+
+    async def generate(self, prompt: BuiltPrompt) -> str:
+        service = self.short_circuit(prompt)
+        if service is not None:
+            return await service.generate(prompt)
+        started = time.monotonic()
+        failed = True
+        try:
+            response = await self.inner.generate(prompt)
+            failed = False
+            return response
+        except (asyncio.CancelledError, AIOverloadedError):
+            failed = False
+            raise
+        finally:
+            self._record(failed, time.monotonic() - started)
+
+    async def generate_stream(self, prompt: BuiltPrompt) -> AsyncIterator[str]:
+        service = self.short_circuit(prompt)
+        if service is not None:
+            async for chunk in service.generate_stream(prompt):
+                yield chunk
+            return
+        started = time.monotonic()
+        failed = True
+        try:
+            async for chunk in self.inner.generate_stream(prompt):
+                yield chunk
+            failed = False
+        except (asyncio.CancelledError, GeneratorExit, AIOverloadedError):
+            failed = False
+            raise
+        finally:
+            self._record(failed, time.monotonic() - started)
+
+    def stats(self) -> dict[str, object]:
+        total = len(self._outcomes)
+        return {
+            "state": self.state,
+            "window": total,
+            "error_rate": round(sum(1 for failed, _ in self._outcomes if failed) / total, 3) if total else 0.0,
+            "slow_rate": round(sum(1 for _, slow in self._outcomes if slow) / total, 3) if total else 0.0,
+            "transitions": dict(self.transitions),
+            "short_circuited": self.short_circuited,
+            "fallbacks": self.fallbacks,
+            "probes": self.probes,
+        }
+
+
+class CircuitGateAIService(AIServiceWrapper):
+    """Asks ``breaker`` before the request is queued, so an open circuit fails fast.
+
+    Placed above the scheduler: short-circuited requests neither wait for a slot nor
+    spend the rate budget. Requests let through still pass the breaker itself, which
+    records the outcome.
+    """
+
+    def __init__(self, inner: AIService, breaker: CircuitBreakerAIService) -> None:
+        super().__init__(inner)
+        self.breaker = breaker
+
+    async def generate(self, prompt: BuiltPrompt) -> str:
+        service = self.breaker.short_circuit(prompt)
+        return await (service or self.inner).generate(prompt)
+
+    async def generate_stream(self, prompt: BuiltPrompt) -> AsyncIterator[str]:
+        service = self.breaker.short_circuit(prompt)
+        async for chunk in (service or self.inner).generate_stream(prompt):
+            yield chunk
@@ -0,0 +1,443 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import AsyncIterator
+
+from app.config.settings import settings
+from app.db.storage import Database
+from app.services.ai_service import AIService, AIServiceWrapper, StubAIService
+from app.services.prompt_builder import BuiltPrompt, TokenUsage, prompt_hash
+
+logger = logging.getLogger(__name__)
+
+INSERT_USAGE_SQL = (
+    "INSERT INTO ai_usage (prompt_hash, mode, focus, model, prompt_tokens, completion_tokens, latency_ms, cost_usd, "
+    "created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+UPSERT_DAILY_SQL = (
+    "INSERT INTO ai_spend_daily (day, mode, focus, model, requests, prompt_tokens, completion_tokens, cost_usd) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (day, mode, focus, model) DO UPDATE SET "
+    "requests = requests + excluded.requests, prompt_tokens = prompt_tokens + excluded.prompt_tokens, "
+    "completion_tokens = completion_tokens + excluded.completion_tokens, cost_usd = cost_usd + excluded.cost_usd"
+)
+
+UsageRow = tuple[str, str, str, str, int, int, int, float, str]
+# (day, mode, focus, model)
+SpendKey = tuple[str, str, str, str]
+
+
+def parse_prices(value: str) -> dict[str, tuple[float, float]]:
+    """``AI_PRICES``: ``model=input/output`` entries in USD per million tokens."""
+
+    prices: dict[str, tuple[float, float]] = {}
+    for entry in value.split(","):
+        model, _, rates = entry.partition("=")
+        if not model.strip() or not rates:
+            continue
+        prompt_rate, _, completion_rate = rates.partition("/")
+        prices[model.strip()] = (float(prompt_rate), float(completion_rate or prompt_rate))
+    return prices
+
+
+def parse_segment_budgets(value: str) -> dict[str, float]:
+    """``AI_BUDGET_SEGMENTS_DAILY_USD``: ``key=usd`` where the key is a focus (``focus_love``) or a mode."""
+
+    budgets: dict[str, float] = {}
+    for entry in value.split(","):
+        key, _, amount = entry.partition("=")
+        if key.strip() and amount.strip():
+            budgets[key.strip()] = float(amount)
+    return budgets
+
+
+def _utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+@dataclass(slots=True)
+class Spend:
+    requests: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost_usd: float = 0.0
+    # Answers that used the whole max_tokens, i.e. were probably cut off.
+    at_limit: int = 0
+
+    def add(self, other: Spend) -> None:
+        self.requests += other.requests
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.cost_usd += other.cost_usd
+        self.at_limit += other.at_limit
+
+    def summary(self) -> dict[str, float]:
+        return {
+            "requests": self.requests,
+            "cost_usd": round(self.cost_usd, 4),
+            "avg_prompt_tokens": round(self.prompt_tokens / self.requests) if self.requests else 0,
+            "avg_completion_tokens": round(self.completion_tokens / self.requests) if self.requests else 0,
+            "at_limit": self.at_limit,
+        }
+
+
+class CostLedger:
+    """Token usage and spend of every provider call, with daily and monthly budgets.
+
+    Each call becomes an ``ai_usage`` row keyed by ``prompt_hash`` (the same hash as
+    in ``requests_log``). Spend is aggregated in memory per UTC day, mode, focus and
+    model; rows and the aggregate deltas are written in one transaction every
+    ``flush_interval_ms`` or ``flush_max_rows`` calls. The current month is loaded
+    from ``ai_spend_daily`` at start so budgets survive restarts. A budget of 0 is
+    off; segment budgets cap the daily spend of one focus or mode. When ``shared``
+    (several bot processes spend the same budgets), the totals are reloaded from
+    ``ai_spend_daily`` after every background flush.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        prices: dict[str, tuple[float, float]] | None = None,
+        daily_budget_usd: float | None = None,
+        monthly_budget_usd: float | None = None,
+        segment_budgets: dict[str, float] | None = None,
+        flush_interval_ms: int | None = None,
+        flush_max_rows: int | None = None,
+        shared: bool = False,
+    ) -> None:
+        self.db = db
+        self.shared = shared
+        self.prices = prices if prices is not None else parse_prices(settings.ai_prices)
+        self.daily_budget_usd = (
+            daily_budget_usd if daily_budget_usd is not None else settings.ai_budget_daily_usd
+        )
+        self.monthly_budget_usd = (
+            monthly_budget_usd if monthly_budget_usd is not None else settings.ai_budget_monthly_usd
+        )
+        self.segment_budgets = (
+            segment_budgets
+            if segment_budgets is not None
+            else parse_segment_budgets(settings.ai_budget_segments_daily_usd)
+        )
+        self.flush_interval = (flush_interval_ms or settings.ai_costs_flush_ms) / 1000
+        self.flush_max_rows = flush_max_rows or settings.ai_costs_flush_rows
+        self._spend: dict[SpendKey, Spend] = defaultdict(Spend)
+        self._pending_rows: list[UsageRow] = []
+        self._pending_spend: dict[SpendKey, Spend] = defaultdict(Spend)
+        self._flush_lock = asyncio.Lock()
+        self._wake: asyncio.Event | None = None
+        self._task: asyncio.Task[None] | None = None
+        self._unpriced: set[str] = set()
+        self.recorded = 0
+        self.blocked = 0
+        self.flushes = 0
+        self.rows_flushed = 0
+
+    def price(self, usage: TokenUsage) -> float:
+        rates = self.prices.get(usage.model)
+        if rates is None:
+            # Dated snapshots ("gpt-4o-mini-2024-07-18") are billed like their base model.
+            matches = [model for model in self.prices if usage.model.startswith(model)]
+            rates = self.prices[max(matches, key=len)] if matches else None
+        if rates is None:
+            if usage.model not in self._unpriced:
+                self._unpriced.add(usage.model)
+                logger.warning("Нет цены для модели %s в AI_PRICES, расход считается нулевым", usage.model)
+            return 0.0
+        return (usage.prompt_tokens * rates[0] + usage.completion_tokens * rates[1]) / 1_000_000
+
+    async def load(self, now: datetime | None = None) -> None:
+        """Replace the in-memory totals with the current month from ``ai_spend_daily``.
+
+        Spend that is not flushed yet is added on top.
+        """
+
+        month = (now or _utc_now()).strftime("%Y-%m")
+        async with self._flush_lock:
+            rows = await self.db.fetchall(
+                "SELECT day, mode, focus, model, requests, prompt_tokens, completion_tokens, cost_usd "
+                "FROM ai_spend_daily WHERE day >= ?",
+                (f"{month}-01",),
+            )
+            totals: dict[SpendKey, Spend] = defaultdict(Spend)
+            for row in rows:
+                totals[(row[0], row[1], row[2], row[3])].add(Spend(row[4], row[5], row[6], row[7]))
+            for key, spend in self._pending_spend.items():
+                totals[key].add(spend)
+            for key, spend in self._spend.items():
+                # Not stored in ai_spend_daily; this process's count is kept.
+                if key in totals:
+                    totals[key].at_limit = spend.at_limit
+            self._spend = totals
+
+    async def record(self, prompt: BuiltPrompt, latency_s: float, now: datetime | None = None) -> None:
+        """Account every billed usage of ``prompt``: the answer and any cancelled hedge attempts."""
+
+        usages = ([prompt.usage] if prompt.usage is not None else []) + prompt.extra_usage
+        if not usages:
+            return
+        now = now or _utc_now()
+        digest = prompt_hash(prompt)
+        for usage in usages:
+            at_limit = usage is prompt.usage and usage.completion_tokens >= prompt.max_tokens
+            self._add(digest, prompt.mode, prompt.focus, usage, latency_s, at_limit, 1.0, now)
+        await self._recorded()
+
+    async def record_usage(
+        self,
+        digest: str,
+        mode: str,
+        focus: str,
+        usage: TokenUsage,
+        price_factor: float = 1.0,
+        now: datetime | None = None,
+    ) -> None:
+        """Account a usage billed outside the provider layer (batch jobs) at ``price_factor`` of the price."""
+
+        self._add(digest, mode, focus, usage, 0.0, False, price_factor, now or _utc_now())
+        await self._recorded()
+
+    def _add(
+        self,
+        digest: str,
+        mode: str,
+        focus: str,
+        usage: TokenUsage,
+        latency_s: float,
+        at_limit: bool,
+        price_factor: float,
+        now: datetime,
+    ) -> None:
+        cost = self.price(usage) * price_factor
+        spend = Spend(1, usage.prompt_tokens, usage.completion_tokens, cost, 1 if at_limit else 0)
+        key = (now.strftime("%Y-%m-%d"), mode, focus, usage.model)
+        self._spend[key].add(spend)
+        self._pending_spend[key].add(spend)
+        self._pending_rows.append(
+            (
+                digest,
+                mode,
+                focus,
+                usage.model,
+                usage.prompt_tokens,
+                usage.completion_tokens,
+                round(latency_s * 1000),
+                cost,
+                now.strftime("%Y-%m-%d %H:%M:%S"),
+            )
+        )
+        self.recorded += 1
+
+    async def _recorded(self) -> None:
+        if self._task is None:
+            await self.flush()
+        elif len(self._pending_rows) >= self.flush_max_rows and self._wake is not None:
+            self._wake.set()
+
+    def spent(self, period: str, segment: str | None = None) -> float:
+        """Spend of the current UTC day (``period`` = ``YYYY-MM-DD``) or month (``YYYY-MM``)."""
+
+        return sum(
+            spend.cost_usd
+            for (day, mode, focus, _), spend in self._spend.items()
+            if day.startswith(period) and (segment is None or segment in (mode, focus))
+        )
+
+    def exhausted(self, prompt: BuiltPrompt, now: datetime | None = None) -> str | None:
+        """Which budget the prompt would exceed, ``None`` if it may go to the provider."""
+
+        now = now or _utc_now()
+        day, month = now.strftime("%Y-%m-%d"), now.strftime("%Y-%m")
+        if self.daily_budget_usd and self.spent(day) >= self.daily_budget_usd:
+            return "daily"
+        if self.monthly_budget_usd and self.spent(month) >= self.monthly_budget_usd:
+            return "monthly"
+        for segment in (prompt.mode, prompt.focus):
+            budget = self.segment_budgets.get(segment)
+            if budget and self.spent(day, segment) >= budget:
+                return segment
+        return None
+
+    async def flush(self) -> int:
+        """Write pending usage rows and spend deltas in one transaction. Returns rows written."""
+
+        async with self._flush_lock:
+            if not self._pending_rows:
+                return 0
+            rows, self._pending_rows = self._pending_rows, []
+            spend, self._pending_spend = self._pending_spend, defaultdict(Spend)
+            try:
+                async with self.db.connect() as conn:
+                    await conn.executemany(INSERT_USAGE_SQL, rows)
+                    await conn.executemany(
+                        UPSERT_DAILY_SQL,
+                        [
+                            (*key, item.requests, item.prompt_tokens, item.completion_tokens, item.cost_usd)
+                            for key, item in spend.items()
+                        ],
+                    )
+                    await conn.commit()
+            except Exception:
+                # Keep everything for the next flush.
+                self._pending_rows[:0] = rows
+                for key, item in spend.items():
+                    self._pending_spend[key].add(item)
+                raise
+            self.flushes += 1
+            self.rows_flushed += len(rows)
+            return len(rows)
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        await self.load()
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="ai-cost-flush")
+        logger.info(
+            "AI cost ledger started: today $%.4f, month $%.4f (budgets: day %s, month %s)",
+            self.spent(_utc_now().strftime("%Y-%m-%d")),
+            self.spent(_utc_now().strftime("%Y-%m")),
+            self.daily_budget_usd or "off",
+            self.monthly_budget_usd or "off",
+        )
+
+    async def _run(self) -> None:
+        assert self._wake is not None
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+                if self.shared:
+                    # Pick up what the other processes have spent.
+                    await self.load()
+            except Exception:  # pragma: no cover - runtime guard
+                logger.exception("AI cost ledger flush failed")
+
+    async def stop(self) -> None:
+        """Stop the background flusher and write everything still pending."""
+
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._wake = None
+        written = await self.flush()
+        logger.info("AI cost ledger stopped, final flush wrote %s rows", written)
+
+    def breakdown(self, period: str) -> dict[str, dict[str, dict[str, float]]]:
+        """Spend per mode, focus and model within ``period`` (a day or a month prefix)."""
+
+        groups: dict[str, dict[str, Spend]] = {
+            "mode": defaultdict(Spend),
+            "focus": defaultdict(Spend),
+            "model": defaultdict(Spend),
+        }
+        for (day, mode, focus, model), spend in self._spend.items():
+            if not day.startswith(period):
+                continue
+            groups["mode"][mode].add(spend)
+            groups["focus"][focus].add(spend)
+            groups["model"][model].add(spend)
+        return {name: {key: spend.summary() for key, spend in items.items()} for name, items in groups.items()}
+
+    def stats(self) -> dict[str, object]:
+        now = _utc_now()
+        day, month = now.strftime("%Y-%m-%d"), now.strftime("%Y-%m")
+        return {
+            "today_usd": round(self.spent(day), 4),
+            "month_usd": round(self.spent(month), 4),
+            "recorded": self.recorded,
+            "blocked": self.blocked,
+            "pending": len(self._pending_rows),
+            "flushes": self.flushes,
+            "unpriced_models": sorted(self._unpriced),
+            "today": self.breakdown(day),
+        }
+
+
+class CostAccountingAIService(AIServiceWrapper):
+    """Records the cost of every provider call and enforces the spend budgets.
+
+    Sits right above the provider, so cache hits never reach it. Once a budget is
+    used up, requests are answered by ``fallback`` (the stub) with
+    ``prompt.fallback`` set, which keeps those answers out of the response cache
+    and makes the handlers refund the request instead of showing the stub text:
+    the bot then serves only cached answers until the period ends.
+    """
+
+    def __init__(self, inner: AIService, ledger: CostLedger, fallback: AIService | None = None) -> None:
+        super().__init__(inner)
+        self.ledger = ledger
+        self.fallback = fallback or StubAIService()
+        self._warned: set[str] = set()
+
+    def over_budget(self, prompt: BuiltPrompt) -> bool:
+        reason = self.ledger.exhausted(prompt)
+        if reason is None:
+            self._warned.clear()
+            return False
+        self.ledger.blocked += 1
+        prompt.fallback = True
+        if reason not in self._warned:
+            self._warned.add(reason)
+            logger.warning("Бюджет AI исчерпан (%s): новые запросы получают только кэш и демо-ответ", reason)
+        return True
+
+    async def generate(self, prompt: BuiltPrompt) -> str:
+        if self.over_budget(prompt):
+            return await self.fallback.generate(prompt)
+        started = time.monotonic()
+        try:
+            return await self.inner.generate(prompt)
+        finally:
+            await self.ledger.record(prompt, time.monotonic() - started)
+
+    async def generate_stream(self, prompt: BuiltPrompt) -> AsyncIterator[str]:
+        if self.over_budget(prompt):
+            async for chunk in self.fallback.generate_stream(prompt):
+                yield chunk
+            return
+        started = time.monotonic()
+        try:
+            async for chunk in self.inner.generate_stream(prompt):
+                yield chunk
+        finally:
+            # Streams report usage with their last chunk.
+            await self.ledger.record(prompt, time.monotonic() - started)
+
+    def stats(self) -> dict[str, object]:
+        return self.ledger.stats()
+
+
+class CostGateAIService(AIServiceWrapper):
+    """Checks the spend budgets of ``accounting`` before the request is queued.
+
+    Placed above the scheduler next to the circuit gate: over-budget requests get the
+    stub at once instead of waiting for a rate-limit slot first. Requests let through
+    are still recorded (and re-checked) by the accounting layer below.
+    """
+
+    def __init__(self, inner: AIService, accounting: CostAccountingAIService) -> None:
+        super().__init__(inner)
+        self.accounting = accounting
+
+    def _target(self, prompt: BuiltPrompt) -> AIService:
+        return self.accounting.fallback if self.accounting.over_budget(prompt) else self.inner
+
+    async def generate(self, prompt: BuiltPrompt) -> str:
+        return await self._target(prompt).generate(prompt)
+
+    async def generate_stream(self, prompt: BuiltPrompt) -> AsyncIterator[str]:
+        async for chunk in self._target(prompt).generate_stream(prompt):
+            yield chunk
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import logging
+import time
+from collections import Counter
+
+from app.config.settings import settings
+from app.services.ai_scheduler import AIScheduler
+from app.services.prompt_builder import MODE_NATAL, HoroscopeRequest, build_sign_prompt, zodiac_sign
+from app.services.response_cache import CachingAIService
+
+logger = logging.getLogger(__name__)
+
+LEVEL_NORMAL = 0
+# Serve a cached sign-level horoscope when one exists.
+LEVEL_SIGN_CACHE = 1
+# Ask the AI for a shorter answer (fewer bullets, lower max_tokens).
+LEVEL_COMPACT = 2
+# Also tell the user how long they are likely to wait.
+LEVEL_ETA = 3
+LEVEL_NAMES = ("normal", "sign_cache", "compact", "eta")
+
+
+def format_wait(seconds: float) -> str:
+    if seconds < 60:
+        return f"{max(5, int(round(seconds / 5)) * 5)} сек"
+    return f"{int(round(seconds / 60))} мин"
+
+
+class DegradationController:
+    """Chooses how much to degrade horoscope answers from the live AI backlog.
+
+    Each level has a queue-depth and a p95-latency threshold; the level is the
+    highest one whose threshold is reached. Latency only counts while there is a
+    backlog, so a slow spike in the past does not degrade an idle bot. Levels rise
+    immediately and fall only after ``cooldown_s`` without a rise.
+    """
+
+    def __init__(
+        self,
+        scheduler: AIScheduler,
+        cache: CachingAIService | None = None,
+        depth_thresholds: tuple[int, int, int] | None = None,
+        p95_thresholds: tuple[float, float, float] | None = None,
+        cooldown_s: float | None = None,
+    ) -> None:
+        self.scheduler = scheduler
+        self.cache = cache
+        self.depth_thresholds = depth_thresholds or (
+            settings.degrade_sign_cache_depth,
+            settings.degrade_compact_depth,
+            settings.degrade_eta_depth,
+        )
+        self.p95_thresholds = p95_thresholds or (
+            settings.degrade_sign_cache_p95_s,
+            settings.degrade_compact_p95_s,
+            settings.degrade_eta_p95_s,
+        )
+        self.cooldown_s = cooldown_s if cooldown_s is not None else settings.degrade_cooldown_s
+        self._level = LEVEL_NORMAL
+        self._raised_at = 0.0
+        self.changes: Counter[str] = Counter()
+        self.requests: Counter[str] = Counter()
+        self.sign_cache_hits = 0
+        self.sign_cache_misses = 0
+
+    def _target_level(self) -> int:
+        depth = self.scheduler.queue_depth
+        backlog = depth > 0 or self.scheduler.active >= self.scheduler.max_concurrency
+        p95 = self.scheduler.latencies.percentile(95) if backlog else 0.0
+        level = LEVEL_NORMAL
+        for step, (max_depth, max_p95) in enumerate(zip(self.depth_thresholds, self.p95_thresholds), start=1):
+            if depth >= max_depth or p95 >= max_p95:
+                level = step
+        return level
+
+    def level(self) -> int:
+        """Current level for a new request; counts the request at that level."""
+
+        target = self._target_level()
+        now = time.monotonic()
+        if target > self._level or (target < self._level and now - self._raised_at >= self.cooldown_s):
+            logger.warning(
+                "AI degradation %s -> %s (queue %s, p95 %.1f s)",
+                LEVEL_NAMES[self._level],
+                LEVEL_NAMES[target],
+                self.scheduler.queue_depth,
+                self.scheduler.latencies.percentile(95),
+            )
+            self.changes[f"{LEVEL_NAMES[self._level]}->{LEVEL_NAMES[target]}"] += 1
+            if target > self._level:
+                self._raised_at = now
+            self._level = target
+        self.requests[LEVEL_NAMES[self._level]] += 1
+        return self._level
+
+    def estimated_wait(self) -> float:
+        return self.scheduler.estimated_wait()
+
+    async def sign_cached(self, req: HoroscopeRequest) -> str | None:
+        """Cached sign-level horoscope matching the request's sign, mode, focus and gender.
+
+        Natal charts are never precomputed per sign, so they skip the lookup.
+        """
+
+        if self.cache is None or req.mode == MODE_NATAL:
+            return None
+        sign = zodiac_sign(req.birth_date)
+        if sign is None:
+            return None
+        cached = await self.cache.lookup(build_sign_prompt(sign, req.mode, req.focus, req.gender))
+        if cached is None:
+            self.sign_cache_misses += 1
+        else:
+            self.sign_cache_hits += 1
+        return cached
+
+    def stats(self) -> dict[str, object]:
+        return {
+            "level": LEVEL_NAMES[self._level],
+            "requests": dict(self.requests),
+            "changes": dict(self.changes),
+            "sign_cache_hits": self.sign_cache_hits,
+            "sign_cache_misses": self.sign_cache_misses,
+        }
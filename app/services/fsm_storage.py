@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from app.config.settings import settings
+from app.db.storage import Database
+
+logger = logging.getLogger(__name__)
+
+# Payloads up to this size are stored as plain JSON; compression does not pay off below it.
+COMPRESS_MIN_BYTES = 256
+_PLAIN = b"j"
+_ZLIB = b"z"
+
+
+def encode_data(data: dict[str, Any]) -> bytes | None:
+    """Compact form of FSM data: minified UTF-8 JSON, zlib-compressed when large; ``None`` if empty."""
+
+    if not data:
+        return None
+    raw = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if len(raw) < COMPRESS_MIN_BYTES:
+        return _PLAIN + raw
+    return _ZLIB + zlib.compress(raw, 6)
+
+
+def decode_data(payload: bytes | None) -> dict[str, Any]:
+    if not payload:
+        return {}
+    marker, body = payload[:1], payload[1:]
+    if marker == _ZLIB:
+        body = zlib.decompress(body)
+    return json.loads(body.decode("utf-8"))
+
+
+def session_key(key: StorageKey) -> str:
+    parts = (key.bot_id, key.chat_id, key.user_id, key.thread_id or "", key.business_connection_id or "", key.destiny)
+    return ":".join(str(part) for part in parts)
+
+
+@dataclass(slots=True)
+class _Session:
+    state: str | None = None
+    data: dict[str, Any] = field(default_factory=dict)
+    # Write time in ns since the epoch: orders concurrent writes and drives TTL eviction.
+    updated_ns: int = 0
+
+
+class SQLiteStorage(BaseStorage):
+    """aiogram FSM storage in the ``fsm_sessions`` table behind a write-through LRU.
+
+    Every change is written to SQLite before the handler continues, so dialogues
+    and ``last_request`` survive restarts; reads are served from a bounded LRU of
+    ``cache_size`` sessions (0 disables it, e.g. when several processes share the
+    database). Each row carries its write time, and an upsert only replaces an
+    older row, so writes that reach the pool out of order cannot resurrect stale
+    data. Sessions idle for longer than ``ttl_days`` read as empty and are deleted
+    by a background sweeper in batches of ``sweep_batch`` rows.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        cache_size: int | None = None,
+        ttl_days: float | None = None,
+        sweep_interval_min: float | None = None,
+        sweep_batch: int | None = None,
+    ) -> None:
+        self.db = db
+        self.cache_size = cache_size if cache_size is not None else settings.fsm_cache_size
+        self.ttl_ns = int((ttl_days if ttl_days is not None else settings.fsm_session_ttl_days) * 86400 * 1e9)
+        self.sweep_interval = (
+            sweep_interval_min if sweep_interval_min is not None else settings.fsm_sweep_interval_min
+        ) * 60
+        self.sweep_batch = sweep_batch or settings.fsm_sweep_batch
+        self._cache: OrderedDict[str, _Session] = OrderedDict()
+        self._last_ns = 0
+        self._task: asyncio.Task[None] | None = None
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.swept = 0
+
+    def _now_ns(self) -> int:
+        # Strictly increasing even if the clock does not move between two writes.
+        self._last_ns = max(self._last_ns + 1, time.time_ns())
+        return self._last_ns
+
+    def _expired(self, session: _Session) -> bool:
+        return session.updated_ns < time.time_ns() - self.ttl_ns
+
+    def _remember(self, key: str, session: _Session) -> None:
+        if self.cache_size <= 0:
+            return
+        self._cache[key] = session
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _session(self, key: str) -> _Session:
+        session = self._cache.get(key)
+        if session is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+        else:
+            self.misses += 1
+            row = await self.db.fetchone(
+                "SELECT state, data, updated_ns FROM fsm_sessions WHERE session_key = ?", (key,)
+            )
+            # Unknown users are cached too, so a new user's first steps cost no extra reads.
+            session = _Session(row["state"], decode_data(row["data"]), row["updated_ns"]) if row else _Session()
+            self._remember(key, session)
+        if session.updated_ns and self._expired(session):
+            return _Session()
+        return session
+
+    async def _write(self, key: str, state: str | None, data: dict[str, Any]) -> None:
+        session = _Session(state, data, self._now_ns())
+        self._remember(key, session)
+        self.writes += 1
+        await self.db.execute(
+            "INSERT INTO fsm_sessions (session_key, state, data, updated_ns) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(session_key) DO UPDATE SET state = excluded.state, data = excluded.data, "
+            "updated_ns = excluded.updated_ns WHERE excluded.updated_ns > fsm_sessions.updated_ns",
+            (key, state, encode_data(data), session.updated_ns),
+        )
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        name = session_key(key)
+        session = await self._session(name)
+        await self._write(name, state.state if isinstance(state, State) else state, session.data)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        return (await self._session(session_key(key))).state
+
+    async def set_data(self, key: StorageKey, data: dict[str, Any]) -> None:
+        name = session_key(key)
+        session = await self._session(name)
+        await self._write(name, session.state, data.copy())
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        return (await self._session(session_key(key))).data.copy()
+
+    async def sweep(self, pause: float = 0.05) -> int:
+        """Delete idle and empty sessions in short batches; returns the number of rows removed."""
+
+        cutoff = time.time_ns() - self.ttl_ns
+        removed = 0
+        while True:
+            async with self.db.connect() as conn:
+                cursor = await conn.execute(
+                    "DELETE FROM fsm_sessions WHERE session_key IN (SELECT session_key FROM fsm_sessions "
+                    "WHERE updated_ns < ? OR (state IS NULL AND data IS NULL) LIMIT ?)",
+                    (cutoff, self.sweep_batch),
+                )
+                deleted = max(0, cursor.rowcount)
+                await cursor.close()
+                await conn.commit()
+            removed += deleted
+            if deleted < self.sweep_batch:
+                break
+            await asyncio.sleep(pause)
+        for name in [name for name, session in self._cache.items() if self._expired(session)]:
+            del self._cache[name]
+        self.swept += removed
+        if removed:
+            logger.info("FSM sweeper removed %s idle sessions", removed)
+        return removed
+
+    async def start(self) -> None:
+        if self._task is not None or self.sweep_interval <= 0:
+            return
+        self._task = asyncio.create_task(self._run(), name="fsm-sweeper")
+        logger.info(
+            "FSM storage: SQLite, cache %s sessions, TTL %.0f days", self.cache_size, self.ttl_ns / 86400e9
+        )
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.sweep()
+            except Exception:  # pragma: no cover - runtime guard
+                logger.exception("FSM sweep failed")
+            await asyncio.sleep(self.sweep_interval)
+
+    async def close(self) -> None:
+        """Stop the sweeper; there is nothing to flush, every write already reached the database."""
+
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "cached": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "swept": self.swept,
+        }
@@ -0,0 +1,274 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import time
+from dataclasses import dataclass
+from difflib import SequenceMatcher
+from pathlib import Path
+
+from app.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOURCE = Path(__file__).resolve().parents[1] / "db" / "gazetteer.tsv"
+# Bump when the index layout changes so existing index files are rebuilt.
+INDEX_VERSION = 1
+# Trigram matches ranked by bm25 before the edit-distance check.
+FUZZY_CANDIDATES = 50
+FUZZY_CUTOFF = 0.7
+# Sorts after every other character in SQLite's BINARY (UTF-8 memcmp) collation.
+_MAX_CHAR = "\U0010ffff"
+
+# "г. Москва", "город Омск", "пгт Ильский", "с.Ивановка".
+_PLACE_PREFIX_RE = re.compile(
+    r"^(?:г|гор|город|пгт|пос|поселок|с|село|д|дер|деревня|ст|станица)(?:\.\s*|\s+)", re.IGNORECASE
+)
+_DASHES_RE = re.compile(r"\s*[‐-―-]\s*")
+_PUNCTUATION_RE = re.compile(r"[^\w\s-]")
+_SPACES_RE = re.compile(r"\s+")
+
+_SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID;
+CREATE TABLE places (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    latitude REAL NOT NULL,
+    longitude REAL NOT NULL,
+    tz TEXT NOT NULL,
+    population INTEGER NOT NULL
+);
+CREATE TABLE aliases (
+    key TEXT NOT NULL,
+    place_id INTEGER NOT NULL,
+    PRIMARY KEY (key, place_id)
+) WITHOUT ROWID;
+CREATE VIRTUAL TABLE alias_trigrams USING fts5(key, place_id UNINDEXED, tokenize = 'trigram');
+"""
+_PLACE_COLUMNS = "p.id, p.name, p.latitude, p.longitude, p.tz"
+
+
+def place_key(text: str) -> str:
+    """Spelling-insensitive form of a place name, the form the gazetteer index is keyed by."""
+
+    key = text.casefold().replace("ё", "е").strip()
+    key = _PLACE_PREFIX_RE.sub("", key)
+    key = _DASHES_RE.sub("-", key)
+    key = _PUNCTUATION_RE.sub(" ", key)
+    return _SPACES_RE.sub(" ", key).strip()
+
+
+def tidy_place(text: str) -> str:
+    """Readable canonical form of a place that is not in the gazetteer."""
+
+    tidy = _SPACES_RE.sub(" ", text).strip(" ,.")
+    tidy = _PLACE_PREFIX_RE.sub("", tidy)
+    return tidy[:1].upper() + tidy[1:]
+
+
+@dataclass(slots=True, frozen=True)
+class Place:
+    name: str
+    # Whether the gazetteer knows the place; coordinates are only known for such places.
+    known: bool = False
+    latitude: float | None = None
+    longitude: float | None = None
+    tz: str | None = None
+
+
+def _read_source(source: Path) -> list[tuple[str, float, float, str, int, list[str]]]:
+    rows = []
+    for number, line in enumerate(source.read_text(encoding="utf-8").splitlines(), start=1):
+        if not line.strip() or line.startswith("#"):
+            continue
+        parts = line.split("\t")
+        if len(parts) != 6:
+            raise ValueError(f"{source}:{number}: ожидается 6 полей через табуляцию, получено {len(parts)}")
+        name, latitude, longitude, tz, population, variants = parts
+        rows.append(
+            (name, float(latitude), float(longitude), tz, int(population), [v for v in variants.split("|") if v])
+        )
+    return rows
+
+
+def build_index(source: Path, path: Path, digest: str) -> int:
+    """Write the lookup index for ``source`` to ``path`` (atomically); returns the number of places."""
+
+    rows = _read_source(source)
+    # Several bot processes may rebuild at once: each writes its own file and the last rename wins.
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp.unlink(missing_ok=True)
+    conn = sqlite3.connect(tmp)
+    try:
+        conn.executescript(_SCHEMA)
+        aliases: set[tuple[str, int]] = set()
+        for place_id, (name, latitude, longitude, tz, population, variants) in enumerate(rows, start=1):
+            conn.execute(
+                "INSERT INTO places (id, name, latitude, longitude, tz, population) VALUES (?, ?, ?, ?, ?, ?)",
+                (place_id, name, latitude, longitude, tz, population),
+            )
+            aliases.update((place_key(spelling), place_id) for spelling in (name, *variants))
+        conn.executemany("INSERT INTO aliases (key, place_id) VALUES (?, ?)", sorted(aliases))
+        conn.executemany("INSERT INTO alias_trigrams (key, place_id) VALUES (?, ?)", sorted(aliases))
+        conn.execute("INSERT INTO alias_trigrams (alias_trigrams) VALUES ('optimize')")
+        conn.execute("INSERT INTO meta (key, value) VALUES ('digest', ?)", (digest,))
+        conn.commit()
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    os.replace(tmp, path)
+    return len(rows)
+
+
+class Gazetteer:
+    """Offline city gazetteer: exact, prefix and fuzzy place lookup.
+
+    The bundled ``app/db/gazetteer.tsv`` (names, old names and transliterations,
+    coordinates, time zone, population) is compiled into a small SQLite file at
+    ``GAZETTEER_PATH``: a ``WITHOUT ROWID`` alias table answers exact and prefix
+    lookups with one B-tree range scan, and an FTS5 trigram index finds
+    candidates for misspelt names, which are then ranked by edit similarity.
+    The file is opened read-only and memory-mapped, so an exact or prefix lookup
+    takes tens of microseconds (a fuzzy one well under a millisecond) and runs
+    right on the event loop. Nothing is read until the first lookup; the index is
+    rebuilt automatically when the TSV changes.
+    """
+
+    def __init__(self, source: Path = DEFAULT_SOURCE, path: str | None = None) -> None:
+        self.source = source
+        self.path = Path(path or settings.gazetteer_path)
+        self._conn: sqlite3.Connection | None = None
+        self.lookups = 0
+        self.lookup_seconds = 0.0
+        self.suggestions = 0
+
+    def _digest(self) -> str:
+        return f"{INDEX_VERSION}:{hashlib.sha256(self.source.read_bytes()).hexdigest()}"
+
+    def _index_digest(self) -> str | None:
+        if not self.path.exists():
+            return None
+        try:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+            try:
+                row = conn.execute("SELECT value FROM meta WHERE key = 'digest'").fetchone()
+            finally:
+                conn.close()
+        except sqlite3.DatabaseError:
+            return None
+        return row[0] if row else None
+
+    def open(self) -> None:
+        """Build the index if it is missing or stale and map it into memory."""
+
+        if self._conn is not None:
+            return
+        started = time.monotonic()
+        digest = self._digest()
+        if self._index_digest() != digest:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            count = build_index(self.source, self.path, digest)
+            logger.info("Gazetteer index built: %s places -> %s", count, self.path)
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        conn.execute(f"PRAGMA mmap_size = {self.path.stat().st_size * 2}")
+        self._conn = conn
+        logger.info("Gazetteer loaded in %.1f ms", (time.monotonic() - started) * 1000)
+
+    async def load(self) -> None:
+        """:meth:`open` off the event loop; a no-op once the index is open."""
+
+        if self._conn is None:
+            await asyncio.to_thread(self.open)
+
+    def _query(self, sql: str, params: tuple[object, ...]) -> list[tuple]:
+        if self._conn is None:
+            self.open()
+        started = time.perf_counter()
+        rows = self._conn.execute(sql, params).fetchall()  # type: ignore[union-attr]
+        self.lookup_seconds += time.perf_counter() - started
+        self.lookups += 1
+        return rows
+
+    @staticmethod
+    def _place(row: tuple) -> Place:
+        return Place(row[1], True, row[2], row[3], row[4])
+
+    def lookup(self, text: str) -> Place | None:
+        """The place ``text`` names exactly (up to :func:`place_key`); the most populous on a clash."""
+
+        key = place_key(text)
+        if not key:
+            return None
+        rows = self._query(
+            f"SELECT {_PLACE_COLUMNS} FROM aliases a JOIN places p ON p.id = a.place_id "
+            "WHERE a.key = ? ORDER BY p.population DESC LIMIT 1",
+            (key,),
+        )
+        return self._place(rows[0]) if rows else None
+
+    def complete(self, text: str, limit: int = 5) -> list[Place]:
+        """Places with a spelling starting with ``text``, most populous first."""
+
+        key = place_key(text)
+        if not key:
+            return []
+        rows = self._query(
+            f"SELECT DISTINCT {_PLACE_COLUMNS}, p.population FROM aliases a JOIN places p ON p.id = a.place_id "
+            "WHERE a.key >= ? AND a.key < ? ORDER BY p.population DESC LIMIT ?",
+            (key, key + _MAX_CHAR, limit),
+        )
+        return [self._place(row) for row in rows]
+
+    def fuzzy(self, text: str, limit: int = 5) -> list[Place]:
+        """Places with a spelling similar to ``text`` ("Масква", "Новосибирк"), best match first."""
+
+        key = place_key(text)
+        if len(key) < 3:
+            return []
+        trigrams = {key[index : index + 3] for index in range(len(key) - 2)}
+        match = " OR ".join('"' + trigram.replace('"', '""') + '"' for trigram in sorted(trigrams))
+        candidates = self._query(
+            "SELECT key, place_id FROM alias_trigrams WHERE alias_trigrams MATCH ? ORDER BY rank LIMIT ?",
+            (match, FUZZY_CANDIDATES),
+        )
+        scores: dict[int, float] = {}
+        for candidate, place_id in candidates:
+            score = SequenceMatcher(None, key, candidate).ratio()
+            if score >= FUZZY_CUTOFF and score > scores.get(place_id, 0.0):
+                scores[place_id] = score
+        best = sorted(scores, key=scores.__getitem__, reverse=True)[:limit]
+        if not best:
+            return []
+        rows = self._query(
+            f"SELECT {_PLACE_COLUMNS} FROM places p WHERE p.id IN ({', '.join('?' * len(best))})", tuple(best)
+        )
+        by_id = {row[0]: self._place(row) for row in rows}
+        return [by_id[place_id] for place_id in best]
+
+    def suggest(self, text: str, limit: int = 3) -> list[Place]:
+        """Candidates for an unrecognised name: prefix matches first, then fuzzy ones."""
+
+        self.suggestions += 1
+        found: dict[str, Place] = {}
+        for place in (*self.complete(text, limit), *self.fuzzy(text, limit)):
+            found.setdefault(place.name, place)
+        return list(found.values())[:limit]
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "lookups": self.lookups,
+            "suggestions": self.suggestions,
+            "avg_lookup_us": round(self.lookup_seconds / self.lookups * 1e6, 1) if self.lookups else 0.0,
+        }
+
+
+gazetteer = Gazetteer()
@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import logging
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable
+
+from app.config.settings import settings
+from app.services.ai_service import AIService, AIServiceError
+from app.services.metrics import LatencyWindow
+from app.services.prompt_builder import BuiltPrompt, TokenUsage
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass(slots=True)
+class _Attempt:
+    backend: int
+    prompt: BuiltPrompt
+    started: float = dataclasses.field(default_factory=time.monotonic)
+    # Text already received from a streaming attempt, for the cost of a cancelled loser.
+    streamed_chars: int = 0
+
+
+class HedgingAIService(AIService):
+    """Routes each request to several AI backends to cut tail latency.
+
+    The request goes to the primary backend first. If it has not answered after the
+    ``percentile`` of recent latencies (never less than ``min_delay_s``), the same
+    prompt is sent to the next backend and the first answer wins; the other attempt
+    is cancelled. A backend that fails before the hedge fires hands over to the next
+    one at once. At most ``max_ratio`` of requests are hedged so an overloaded
+    provider is not hit twice as hard. For streams, the race is for the first chunk.
+
+    Tokens of cancelled attempts are still billed: their usage (or an estimate of the
+    prompt and the text streamed so far) goes to ``prompt.extra_usage``.
+    """
+
+    def __init__(
+        self,
+        backends: list[AIService],
+        percentile: float | None = None,
+        min_delay_s: float | None = None,
+        initial_delay_s: float | None = None,
+        min_samples: int | None = None,
+        max_ratio: float | None = None,
+    ) -> None:
+        if not backends:
+            raise ValueError("Нужен хотя бы один AI backend")
+        self.backends = backends
+        self.percentile = percentile if percentile is not None else settings.ai_hedge_percentile
+        self.min_delay_s = min_delay_s if min_delay_s is not None else settings.ai_hedge_min_delay_s
+        self.initial_delay_s = initial_delay_s if initial_delay_s is not None else settings.ai_hedge_initial_delay_s
+        self.min_samples = min_samples if min_samples is not None else settings.ai_hedge_min_samples
+        self.max_ratio = max_ratio if max_ratio is not None else settings.ai_hedge_max_ratio
+        # Full answers and time to the first streamed chunk have very different scales.
+        self.latencies = LatencyWindow()
+        self.first_chunk = LatencyWindow()
+        self.requests = 0
+        self.hedged = 0
+        self.failovers = 0
+        self.wins = [0] * len(backends)
+        self.wasted_tokens = 0
+
+    async def healthcheck(self) -> str:
+        return await self.backends[0].healthcheck()
+
+    def hedge_delay(self, window: LatencyWindow) -> float:
+        if len(window) < self.min_samples:
+            return max(self.min_delay_s, self.initial_delay_s)
+        return max(self.min_delay_s, window.percentile(self.percentile))
+
+    def _may_hedge(self) -> bool:
+        return self.hedged < self.max_ratio * self.requests
+
+    async def _race(
+        self,
+        prompt: BuiltPrompt,
+        start: Callable[[_Attempt], Awaitable[Any]],
+        window: LatencyWindow,
+        discard: Callable[[Any], Awaitable[None]] | None = None,
+    ) -> Any:
+        self.requests += 1
+        tasks: dict[asyncio.Task[Any], _Attempt] = {}
+        errors: list[BaseException] = []
+        next_backend = 0
+
+        def launch() -> None:
+            nonlocal next_backend
+            attempt = _Attempt(next_backend, dataclasses.replace(prompt, usage=None, extra_usage=[]))
+            tasks[asyncio.create_task(start(attempt))] = attempt
+            next_backend += 1
+
+        launch()
+        winner: asyncio.Task[Any] | None = None
+        try:
+            while winner is None:
+                running = {task for task in tasks if not task.done()}
+                if not running:
+                    break
+                hedge_at = None
+                if next_backend < len(self.backends) and self._may_hedge():
+                    hedge_at = self.hedge_delay(window)
+                done, _ = await asyncio.wait(running, timeout=hedge_at, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self.hedged += 1
+                    logger.info("AI request hedged to backend #%s after %.2f s", next_backend, hedge_at)
+                    launch()
+                    continue
+                for task in done:
+                    if task.exception() is None:
+                        winner = task
+                        break
+                    errors.append(task.exception())  # type: ignore[arg-type]
+                    if next_backend < len(self.backends):
+                        self.failovers += 1
+                        launch()
+        finally:
+            await self._cancel_losers(prompt, tasks, winner, discard)
+
+        if winner is None:
+            raise errors[-1] if errors else AIServiceError("Ни один AI backend не ответил")
+        attempt = tasks[winner]
+        window.add(time.monotonic() - attempt.started)
+        self.wins[attempt.backend] += 1
+        prompt.usage = attempt.prompt.usage
+        return winner.result()
+
+    async def _cancel_losers(
+        self,
+        prompt: BuiltPrompt,
+        tasks: dict[asyncio.Task[Any], _Attempt],
+        winner: asyncio.Task[Any] | None,
+        discard: Callable[[Any], Awaitable[None]] | None,
+    ) -> None:
+        for task, attempt in tasks.items():
+            if task is winner or (task.done() and not task.cancelled() and task.exception() is not None):
+                # Failed attempts are not billed.
+                continue
+            task.cancel()
+            try:
+                result = await task
+            except BaseException:
+                pass
+            else:
+                # Finished in the same loop turn as the winner.
+                if discard is not None:
+                    await discard(result)
+            usage = attempt.prompt.usage or TokenUsage(
+                (len(attempt.prompt.system_prompt) + len(attempt.prompt.user_prompt)) // 3,
+                attempt.streamed_chars // 3,
+            )
+            prompt.extra_usage.append(usage)
+            self.wasted_tokens += usage.total_tokens
+
+    async def generate(self, prompt: BuiltPrompt) -> str:
+        async def start(attempt: _Attempt) -> str:
+            return await self.backends[attempt.backend].generate(attempt.prompt)
+
+        return await self._race(prompt, start, self.latencies)
+
+    async def generate_stream(self, prompt: BuiltPrompt) -> AsyncIterator[str]:
+        async def start(attempt: _Attempt) -> tuple[AsyncIterator[str], str | None, BuiltPrompt]:
+            stream = self.backends[attempt.backend].generate_stream(attempt.prompt)
+            try:
+                first = await stream.__anext__()  # type: ignore[attr-defined]
+            except StopAsyncIteration:
+                return stream, None, attempt.prompt
+            except BaseException:
+                await stream.aclose()  # type: ignore[attr-defined]
+                raise
+            attempt.streamed_chars = len(first)
+            return stream, first, attempt.prompt
+
+        async def discard(result: tuple[AsyncIterator[str], str | None, BuiltPrompt]) -> None:
+            await result[0].aclose()  # type: ignore[attr-defined]
+
+        stream, first, attempt_prompt = await self._race(prompt, start, self.first_chunk, discard)
+        try:
+            if first is None:
+                return
+            yield first
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()  # type: ignore[attr-defined]
+            # Streams report usage with their last chunk.
+            prompt.usage = attempt_prompt.usage
+
+    def stats(self) -> dict[str, object]:
+        return {
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "failovers": self.failovers,
+            "wins": self.wins,
+            "wasted_tokens": self.wasted_tokens,
+            "hedge_delay_s": round(self.hedge_delay(self.latencies), 2),
+            "latency": self.latencies.summary(),
+            "first_chunk": self.first_chunk.summary(),
+            "backends": [
+                backend.stats() for backend in self.backends if hasattr(backend, "stats")  # type: ignore[attr-defined]
+            ],
+        }
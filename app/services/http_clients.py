@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import ssl
+import time
+from functools import partial
+from typing import Awaitable, Callable, Iterable
+
+import certifi
+import httpx
+from aiogram import __version__ as aiogram_version
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiohttp import ClientSession, TCPConnector
+
+from app.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+try:  # pragma: no cover - optional
+    import h2  # noqa: F401
+
+    HTTP2_AVAILABLE = True
+except Exception:  # pragma: no cover
+    HTTP2_AVAILABLE = False
+
+TELEGRAM_URL = "https://api.telegram.org"
+OPENAI_URL = "https://api.openai.com/v1"
+
+
+class TelegramSession(AiohttpSession):
+    """AiohttpSession whose connector keeps idle connections for ``keepalive_s``.
+
+    aiogram has no option for the keep-alive timeout, so the aiohttp session is built
+    here with its own ``TCPConnector``, using aiogram's defaults for everything else.
+    """
+
+    def __init__(self, limit: int, keepalive_s: float) -> None:
+        super().__init__(limit=limit)
+        self.limit = limit
+        self.keepalive_s = keepalive_s
+
+    async def create_session(self) -> ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = ClientSession(
+                connector=TCPConnector(
+                    ssl=ssl.create_default_context(cafile=certifi.where()),
+                    limit=self.limit,
+                    keepalive_timeout=self.keepalive_s,
+                    ttl_dns_cache=3600,
+                ),
+                headers={"User-Agent": f"aiogram/{aiogram_version}"},
+            )
+        return self._session
+
+
+class HttpClients:
+    """Process-wide HTTP connection pools for the Telegram Bot API and OpenAI.
+
+    Both pools are created lazily with the limits from ``Settings`` and shared by
+    every caller in the event loop (the bot, the OpenAI backends, batch jobs).
+    :meth:`warm_up` opens connections to both APIs at startup so the first user
+    request does not pay for DNS and TLS handshakes.
+
+    Pooled connections belong to the loop that opened them, so there is one OpenAI
+    pool per running loop: the launcher runs each action in a fresh ``asyncio.run``
+    and must neither reuse a pool of a closed loop nor close the bot's one.
+    """
+
+    def __init__(self) -> None:
+        self._openai: dict[asyncio.AbstractEventLoop, httpx.AsyncClient] = {}
+        self._telegram: TelegramSession | None = None
+
+    def openai(self) -> httpx.AsyncClient:
+        """Pool of the running event loop; must be called from inside it."""
+
+        loop = asyncio.get_running_loop()
+        for stale in [other for other in self._openai if other.is_closed()]:
+            # Its connections died with the loop; there is nothing left to close.
+            del self._openai[stale]
+        client = self._openai.get(loop)
+        if client is None or client.is_closed:
+            http2 = settings.http_openai_http2 and HTTP2_AVAILABLE
+            if settings.http_openai_http2 and not HTTP2_AVAILABLE:
+                logger.warning("HTTP_OPENAI_HTTP2=true, но пакет h2 не установлен: используется HTTP/1.1")
+            client = self._openai[loop] = httpx.AsyncClient(
+                http2=http2,
+                limits=httpx.Limits(
+                    max_connections=settings.http_openai_max_connections,
+                    max_keepalive_connections=settings.http_openai_max_keepalive,
+                    keepalive_expiry=settings.http_keepalive_s,
+                ),
+                timeout=httpx.Timeout(settings.ai_attempt_timeout_s, connect=settings.http_connect_timeout_s),
+            )
+        return client
+
+    def telegram(self) -> TelegramSession:
+        if self._telegram is None:
+            self._telegram = TelegramSession(settings.http_telegram_max_connections, settings.http_keepalive_s)
+        return self._telegram
+
+    async def _open_telegram(self) -> None:
+        session = await self.telegram().create_session()
+        async with session.head(TELEGRAM_URL) as response:
+            await response.read()
+
+    async def _open_openai(self, url: str) -> None:
+        # Any status (401 without a key) means the connection is up and now kept alive.
+        await self.openai().head(url)
+
+    async def _warm(self, name: str, opener: Callable[[], Awaitable[None]]) -> bool:
+        started = time.monotonic()
+        count = max(1, settings.http_warmup_connections)
+        results = await asyncio.gather(*(opener() for _ in range(count)), return_exceptions=True)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if len(errors) == count:
+            logger.warning("Не удалось подключиться к %s: %s. Проверьте сеть.", name, errors[0])
+            return False
+        elapsed_ms = (time.monotonic() - started) * 1000
+        logger.info("%s доступен, открыто соединений: %s за %.0f мс", name, count - len(errors), elapsed_ms)
+        return True
+
+    async def warm_up(
+        self, openai: bool | None = None, openai_urls: Iterable[str | None] = (None,)
+    ) -> dict[str, bool]:
+        """Pre-open pooled connections; returns reachability per API.
+
+        ``openai_urls`` are the base URLs of the AI backends (``None`` for OpenAI itself);
+        every distinct host among them is warmed.
+        """
+
+        if openai is None:
+            openai = settings.use_openai and bool(settings.openai_api_key)
+        targets: dict[str, Callable[[], Awaitable[None]]] = {"Telegram": self._open_telegram}
+        if openai:
+            for url in dict.fromkeys(url or OPENAI_URL for url in openai_urls):
+                name = "OpenAI" if url == OPENAI_URL else f"OpenAI ({httpx.URL(url).host})"
+                targets[name] = partial(self._open_openai, url)
+        results = await asyncio.gather(*(self._warm(name, opener) for name, opener in targets.items()))
+        return dict(zip(targets, results))
+
+    async def close(self) -> None:
+        """Close the Telegram session and the OpenAI pool of the running loop."""
+
+        if self._telegram is not None:
+            await self._telegram.close()
+            self._telegram = None
+        client = self._openai.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+
+http_clients = HttpClients()
@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import logging
+from collections import OrderedDict
+
+from app.config.settings import settings
+from app.db.storage import Database
+
+logger = logging.getLogger(__name__)
+
+
+class KnownUsers:
+    """Bounded LRU of telegram ids that already have ``users`` and ``quotas`` rows."""
+
+    def __init__(self, max_size: int | None = None) -> None:
+        self.max_size = max_size or settings.known_users_max
+        self._ids: OrderedDict[int, None] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def check(self, telegram_id: int) -> bool:
+        if telegram_id in self._ids:
+            self._ids.move_to_end(telegram_id)
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def add(self, telegram_id: int) -> None:
+        self._ids[telegram_id] = None
+        self._ids.move_to_end(telegram_id)
+        while len(self._ids) > self.max_size:
+            self._ids.popitem(last=False)
+
+    async def warm(self, db: Database, limit: int | None = None) -> int:
+        """Preload the most recently active users; returns how many ids were added."""
+
+        limit = min(limit or settings.known_users_warm, self.max_size)
+        rows = await db.fetchall(
+            "SELECT telegram_id FROM quotas ORDER BY updated_at DESC LIMIT ?",
+            (limit,),
+        )
+        # Oldest first so the most recent users end up at the hot end of the LRU.
+        for row in reversed(rows):
+            self.add(int(row["telegram_id"]))
+        logger.info("Known users warmed: %s", len(rows))
+        return len(rows)
+
+    def stats(self) -> dict[str, int]:
+        return {"size": len(self._ids), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,36 @@
+from __future__ import annotations
+
+from collections import deque
+
+
+class LatencyWindow:
+    """Sliding window of recent durations (seconds) with percentile queries."""
+
+    def __init__(self, size: int = 500) -> None:
+        self._values: deque[float] = deque(maxlen=size)
+        self.count = 0
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def add(self, value: float) -> None:
+        self._values.append(value)
+        self.count += 1
+
+    def percentile(self, pct: float) -> float:
+        if not self._values:
+            return 0.0
+        ordered = sorted(self._values)
+        index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def mean(self) -> float:
+        return sum(self._values) / len(self._values) if self._values else 0.0
+
+    def summary(self) -> dict[str, float]:
+        return {
+            "count": self.count,
+            "avg_ms": round(self.mean() * 1000, 1),
+            "p50_ms": round(self.percentile(50) * 1000, 1),
+            "p95_ms": round(self.percentile(95) * 1000, 1),
+        }
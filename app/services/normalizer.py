@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass
+from datetime import date, time
+
+from app.config.settings import settings
+from app.core.validators import DATE_FORMAT, TIME_FORMAT, validate_date, validate_time
+from app.services.gazetteer import Gazetteer, Place, gazetteer, tidy_place
+from app.services.prompt_builder import HoroscopeRequest, zodiac_sign
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True, frozen=True)
+class CanonicalRequest:
+    """A horoscope request with parsed values; equal requests have equal ``key`` and prompts.
+
+    ``key`` is known before any prompt is built, so the response cache and
+    single-flight can be consulted without building one.
+    """
+
+    mode: str
+    birth_date: date
+    birth_time: time | None
+    birth_place: str
+    gender: str
+    focus: str
+    sign: str
+    place: Place
+
+    @property
+    def key(self) -> str:
+        birth_time = self.birth_time.strftime(TIME_FORMAT) if self.birth_time else "-"
+        return "|".join(
+            (self.mode, self.birth_date.isoformat(), birth_time, self.birth_place, self.gender, self.focus)
+        )
+
+    def to_request(self) -> HoroscopeRequest:
+        return HoroscopeRequest(
+            mode=self.mode,
+            birth_date=self.birth_date.strftime(DATE_FORMAT),
+            birth_time=self.birth_time.strftime(TIME_FORMAT) if self.birth_time else None,
+            birth_place=self.birth_place,
+            gender=self.gender,
+            focus=self.focus,
+        )
+
+
+class RequestNormalizer:
+    """Turns raw dialogue input into canonical values so equal requests build equal prompts.
+
+    Dates and times are parsed into typed values and printed back in one format;
+    places are resolved through the offline :class:`Gazetteer` ("г. Москва",
+    "москва ", "Питер" and "Москва, Россия" all become a known place with
+    coordinates). The gazetteer index is opened on first use.
+    """
+
+    def __init__(self, places: Gazetteer | None = None) -> None:
+        self.gazetteer = places or gazetteer
+        self.places_known = 0
+        self.places_unknown = 0
+
+    def _lookup(self, text: str) -> Place | None:
+        # "Москва, Россия": the city alone is enough to match.
+        return self.gazetteer.lookup(text) or self.gazetteer.lookup(text.split(",")[0])
+
+    async def place(self, text: str) -> Place:
+        """Canonical place; coordinates and time zone when the gazetteer knows it."""
+
+        await self.gazetteer.load()
+        place = self._lookup(text)
+        if place is not None:
+            self.places_known += 1
+            return place
+        self.places_unknown += 1
+        return Place(tidy_place(text))
+
+    async def suggest(self, text: str) -> list[Place]:
+        """Options for a "did you mean" keyboard; empty when the gazetteer knows the place."""
+
+        await self.gazetteer.load()
+        if self._lookup(text) is not None:
+            return []
+        return self.gazetteer.suggest(text.split(",")[0], settings.gazetteer_suggestions)
+
+    async def normalize(self, req: HoroscopeRequest) -> CanonicalRequest | None:
+        """Canonical form of ``req``, ``None`` if its date or time does not parse."""
+
+        birth_date = validate_date(req.birth_date)
+        if birth_date is None:
+            return None
+        birth_time = None
+        if req.birth_time:
+            birth_time = validate_time(req.birth_time)
+            if birth_time is None:
+                return None
+        place = await self.place(req.birth_place)
+        return CanonicalRequest(
+            mode=req.mode,
+            birth_date=birth_date,
+            birth_time=birth_time,
+            birth_place=place.name,
+            gender=req.gender,
+            focus=req.focus,
+            sign=zodiac_sign(birth_date) or "",
+            place=place,
+        )
+
+    def stats(self) -> dict[str, int]:
+        return {"places_known": self.places_known, "places_unknown": self.places_unknown}
@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from app.config.settings import settings
+from app.services.batch import BatchGenerator, BatchReport
+from app.services.prompt_builder import (
+    FOCUS_LABELS,
+    GENDER_LABELS,
+    MODE_TODAY,
+    MODE_WEEK,
+    ZODIAC_STARTS,
+    BuiltPrompt,
+    HoroscopeRequest,
+    build_sign_prompt,
+    zodiac_sign,
+)
+from app.services.response_cache import CachingAIService
+
+logger = logging.getLogger(__name__)
+
+PRECOMPUTE_MODES = (MODE_TODAY, MODE_WEEK)
+BATCH_JOB = "sign-precompute"
+
+
+def sign_matrix(modes: tuple[str, ...] = PRECOMPUTE_MODES) -> list[tuple[str, str, str, str]]:
+    """Every (sign, mode, focus, gender) combination served from the precomputed matrix."""
+
+    return [
+        (sign, mode, focus, gender)
+        for mode in modes
+        for _, sign in ZODIAC_STARTS
+        for focus in FOCUS_LABELS
+        for gender in GENDER_LABELS
+    ]
+
+
+@dataclass(slots=True)
+class PrecomputeReport:
+    total: int = 0
+    generated: int = 0
+    cached: int = 0
+    failed: int = 0
+
+
+class SignHoroscopes:
+    """Sign-level horoscopes kept in the response cache, filled ahead of demand.
+
+    Entries live under the same keys as the shared sign prompts
+    (:func:`build_sign_prompt`), so they expire with the daily/weekly TTL of the
+    response cache and the degradation path sees them too.
+    """
+
+    def __init__(self, cache: CachingAIService, modes: tuple[str, ...] = PRECOMPUTE_MODES) -> None:
+        self.cache = cache
+        self.modes = modes
+        self.hits = 0
+        self.misses = 0
+
+    async def lookup(self, req: HoroscopeRequest) -> str | None:
+        sign = zodiac_sign(req.birth_date)
+        if sign is None or req.mode not in self.modes:
+            return None
+        cached = await self.cache.lookup(build_sign_prompt(sign, req.mode, req.focus, req.gender))
+        if cached is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return cached
+
+    async def precompute(self, concurrency: int | None = None) -> PrecomputeReport:
+        """Generate every missing matrix entry in the background lane; existing entries are kept."""
+
+        prompts = self.prompts()
+        report = PrecomputeReport(total=len(prompts))
+        semaphore = asyncio.Semaphore(concurrency or settings.precompute_concurrency)
+
+        async def _one(prompt: BuiltPrompt) -> None:
+            async with semaphore:
+                if await self.cache.lookup(prompt) is not None:
+                    report.cached += 1
+                    return
+                try:
+                    await self.cache.generate(prompt)
+                except Exception as exc:
+                    report.failed += 1
+                    logger.warning("Precompute failed for %s: %s", prompt.user_prompt[:80], exc)
+                    return
+                if prompt.fallback:
+                    report.failed += 1
+                else:
+                    report.generated += 1
+
+        await asyncio.gather(*(_one(prompt) for prompt in prompts))
+        logger.info(
+            "Sign precompute done: %s generated, %s already cached, %s failed (of %s)",
+            report.generated,
+            report.cached,
+            report.failed,
+            report.total,
+        )
+        return report
+
+    def prompts(self) -> list[BuiltPrompt]:
+        prompts = []
+        for combo in sign_matrix(self.modes):
+            prompt = build_sign_prompt(*combo)
+            prompt.priority = "background"
+            prompts.append(prompt)
+        return prompts
+
+    async def precompute_batch(self, generator: BatchGenerator, max_wait_s: float | None = None) -> BatchReport:
+        """Same matrix through a batch job (half the token price, no interactive rate limits)."""
+
+        return await generator.run(BATCH_JOB, self.prompts(), max_wait_s=max_wait_s)
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def seconds_until(clock: str, now: datetime | None = None) -> float:
+    """Seconds until the next local ``ЧЧ:ММ``."""
+
+    now = now or datetime.now()
+    hour, minute = (int(part) for part in clock.split(":"))
+    target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if target <= now:
+        target += timedelta(days=1)
+    return (target - now).total_seconds()
+
+
+class PrecomputeJob:
+    """Fills the sign matrix every day at ``run_at`` (local time), and at startup when ``on_start`` is set.
+
+    A full run is 360 AI calls, so a restart does not trigger one unless asked to.
+    With a ``generator`` the matrix goes out as one batch job, polled until the
+    next run at most; a batch still in flight then is resumed instead of resubmitted.
+    """
+
+    def __init__(
+        self,
+        signs: SignHoroscopes,
+        run_at: str | None = None,
+        on_start: bool | None = None,
+        generator: BatchGenerator | None = None,
+    ) -> None:
+        self.signs = signs
+        self.run_at = run_at or settings.precompute_at
+        self.on_start = on_start if on_start is not None else settings.precompute_on_start
+        self.generator = generator
+        self._task: asyncio.Task[None] | None = None
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run(), name="sign-precompute")
+        logger.info(
+            "Sign precompute scheduled daily at %s%s", self.run_at, " (batch)" if self.generator is not None else ""
+        )
+
+    async def _run(self) -> None:
+        if not self.on_start:
+            await asyncio.sleep(seconds_until(self.run_at))
+        while True:
+            try:
+                await self._fill()
+            except Exception:  # pragma: no cover - runtime guard
+                logger.exception("Sign precompute failed")
+            await asyncio.sleep(seconds_until(self.run_at))
+
+    async def _fill(self) -> None:
+        if self.generator is None:
+            await self.signs.precompute()
+        else:
+            await self.signs.precompute_batch(self.generator, max_wait_s=seconds_until(self.run_at))
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
@@ -1,9 +1,12 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+import hashlib
+from dataclasses import dataclass, field
+from datetime import date, datetime
 
 from app.config.runtime import runtime_config
-from app.modules.horoscope.prompts import HOROSCOPE_TEMPLATE
+from app.modules.horoscope.prompts import HOROSCOPE_TEMPLATE, SIGN_TEMPLATE
+from app.modules.natal.prompts import NATAL_TEMPLATE
 
 
 @dataclass(slots=True)
@@ -16,11 +19,54 @@ class HoroscopeRequest:
     focus: str
 
 
+@dataclass(slots=True)
+class TokenUsage:
+    prompt_tokens: int
+    completion_tokens: int
+    model: str = ""
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
 @dataclass(slots=True)
 class BuiltPrompt:
     system_prompt: str
     user_prompt: str
+    mode: str = ""
+    # Focus key (``focus_love``); used to break down AI spend.
+    focus: str = ""
+    fresh: bool = False
+    max_tokens: int = 700
+    # Scheduler lane: "paid", "free" or "background".
+    priority: str = "free"
+    # Filled in by the backend that actually called the provider.
+    usage: TokenUsage | None = None
+    # Billed but unused attempts (hedged requests that lost the race).
+    extra_usage: list[TokenUsage] = field(default_factory=list)
+    # Set when the answer came from a fallback backend (circuit open); such answers are not cached.
+    fallback: bool = False
+    # Canonical request key with the answer variant; when set, the response cache and
+    # single-flight identify the answer by it instead of the prompt hash.
+    request_key: str = ""
+
+    def estimated_tokens(self) -> int:
+        # Cyrillic text averages roughly three characters per token.
+        return (len(self.system_prompt) + len(self.user_prompt)) // 3 + self.max_tokens
 
+    def billed_tokens(self) -> int | None:
+        """Tokens the provider charged for this prompt, ``None`` if it reported no usage."""
+
+        if self.usage is None and not self.extra_usage:
+            return None
+        total = self.usage.total_tokens if self.usage is not None else 0
+        return total + sum(usage.total_tokens for usage in self.extra_usage)
+
+
+MODE_TODAY = "Прогноз на сегодня"
+MODE_WEEK = "Прогноз на неделю"
+MODE_NATAL = "Натальная карта"
 
 FOCUS_LABELS = {
     "focus_love": "любовь",
@@ -36,38 +82,128 @@ GENDER_LABELS = {
     "gender_o": "другое",
 }
 
+# First (month, day) of each sun sign; a sign lasts until the next entry starts.
+ZODIAC_STARTS = [
+    ((1, 20), "Водолей"),
+    ((2, 19), "Рыбы"),
+    ((3, 21), "Овен"),
+    ((4, 20), "Телец"),
+    ((5, 21), "Близнецы"),
+    ((6, 21), "Рак"),
+    ((7, 23), "Лев"),
+    ((8, 23), "Дева"),
+    ((9, 23), "Весы"),
+    ((10, 23), "Скорпион"),
+    ((11, 22), "Стрелец"),
+    ((12, 22), "Козерог"),
+]
 
-def build_horoscope_prompt(req: HoroscopeRequest) -> BuiltPrompt:
-    focus = FOCUS_LABELS.get(req.focus, "общее")
-    gender = GENDER_LABELS.get(req.gender, "")
-    time_info = req.birth_time if req.birth_time else "неизвестно"
 
-    style = runtime_config.prompt_style
-    tone = style.get("tone")
-    bullets = style.get("bullets_count") or style.get("bullets") or 6
+def zodiac_sign(birth_date: str | date) -> str | None:
+    """Sun sign for a date or a ``ДД.ММ.ГГГГ`` string, ``None`` if the string does not parse."""
+
+    if isinstance(birth_date, date):
+        parsed = birth_date
+    else:
+        try:
+            parsed = datetime.strptime(birth_date, "%d.%m.%Y").date()
+        except ValueError:
+            return None
+    sign = "Козерог"
+    for start, name in ZODIAC_STARTS:
+        if (parsed.month, parsed.day) >= start:
+            sign = name
+    return sign
+
 
+def _system_prompt(bullets_range: str) -> str:
     system_prompt = (
         "Ты опытный астролог и психолог. Отвечай по-русски, вежливо и без шарлатанства. "
         "Не давай медицинских диагнозов, избегай упоминаний о магии и эзотерике. "
-        "Формат ответа — структурированный список из 6-10 пунктов с короткими заголовками: "
+        f"Формат ответа — структурированный список из {bullets_range} пунктов с короткими заголовками: "
         "Любовь, Финансы, Здоровье, Карьера, Совет дня."
     )
+    tone = runtime_config.prompt_style.get("tone")
     if tone:
         system_prompt = f"{system_prompt} Тон: {tone}."
+    return system_prompt
 
-    user_prompt = HOROSCOPE_TEMPLATE.format(
-        mode=req.mode,
-        birth_date=req.birth_date,
-        birth_time=time_info,
-        birth_place=req.birth_place,
-        gender=gender,
-        focus=focus,
-    )
-    user_prompt = (
-        f"{user_prompt} Сформируй список из {bullets} пунктов (не менее 6 и не более 10). "
+
+def _format_instructions(bullets: int, compact: bool) -> str:
+    limits = "" if compact else " (не менее 6 и не более 10)"
+    return (
+        f"Сформируй список из {bullets} пунктов{limits}. "
         "Каждый пункт начинай с названия блока и эмодзи: "
         "• Любовь: …; • Финансы: …; • Здоровье: …; • Карьера: …; • Совет дня: … "
         "Делай выводы и рекомендации, избегай общих фраз."
     )
 
-    return BuiltPrompt(system_prompt=system_prompt, user_prompt=user_prompt)
+
+def build_horoscope_prompt(
+    req: HoroscopeRequest, bullets: int | None = None, max_tokens: int | None = None, chart: str | None = None
+) -> BuiltPrompt:
+    """Personal horoscope prompt; ``bullets``/``max_tokens`` shorten the answer under load.
+
+    With ``chart`` (a computed natal chart summary) the natal reading template is used.
+    """
+
+    focus = FOCUS_LABELS.get(req.focus, "общее")
+    gender = GENDER_LABELS.get(req.gender, "")
+    time_info = req.birth_time if req.birth_time else "неизвестно"
+
+    style = runtime_config.prompt_style
+    compact = bullets is not None
+    if bullets is None:
+        bullets = style.get("bullets_count") or style.get("bullets") or 6
+
+    system_prompt = _system_prompt(f"{bullets}" if compact else "6-10")
+
+    if chart is not None:
+        user_prompt = NATAL_TEMPLATE.format(
+            birth_date=req.birth_date,
+            birth_time=time_info,
+            birth_place=req.birth_place,
+            gender=gender,
+            focus=focus,
+            chart=chart,
+        )
+    else:
+        user_prompt = HOROSCOPE_TEMPLATE.format(
+            mode=req.mode,
+            birth_date=req.birth_date,
+            birth_time=time_info,
+            birth_place=req.birth_place,
+            gender=gender,
+            focus=focus,
+        )
+    user_prompt = f"{user_prompt} {_format_instructions(bullets, compact)}"
+
+    prompt = BuiltPrompt(system_prompt=system_prompt, user_prompt=user_prompt, mode=req.mode, focus=req.focus)
+    if max_tokens is not None:
+        prompt.max_tokens = max_tokens
+    return prompt
+
+
+def build_sign_prompt(sign: str, mode: str, focus: str, gender: str) -> BuiltPrompt:
+    """Shared horoscope for a zodiac sign; the same for every user with that sign, focus and gender."""
+
+    style = runtime_config.prompt_style
+    bullets = style.get("bullets_count") or style.get("bullets") or 6
+    user_prompt = SIGN_TEMPLATE.format(
+        mode=mode,
+        sign=sign,
+        gender=GENDER_LABELS.get(gender, ""),
+        focus=FOCUS_LABELS.get(focus, "общее"),
+    )
+    user_prompt = f"{user_prompt} {_format_instructions(bullets, False)}"
+    return BuiltPrompt(system_prompt=_system_prompt("6-10"), user_prompt=user_prompt, mode=mode, focus=focus)
+
+
+def prompt_hash(prompt: BuiltPrompt) -> str:
+    return hashlib.sha256((prompt.system_prompt + prompt.user_prompt).encode()).hexdigest()
+
+
+def prompt_key(prompt: BuiltPrompt) -> str:
+    """What identifies the answer to ``prompt``: its canonical request key, or else its hash."""
+
+    return prompt.request_key or prompt_hash(prompt)
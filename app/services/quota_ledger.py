@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import OrderedDict
+
+from app.config.settings import settings
+from app.db.storage import Database
+
+logger = logging.getLogger(__name__)
+
+DURABILITY_MODES = {"batch", "sync"}
+
+
+class QuotaLedger:
+    """In-memory write-behind ledger of ``quotas.free_left`` for hot users.
+
+    Balances are seeded from the database on first sight and changed in memory.
+    Only the accumulated deltas are written back (``free_left = free_left + delta``),
+    so the ``quotas`` table stays the source of truth for any other writer.
+    In ``batch`` mode dirty entries are flushed every ``flush_interval_ms`` or after
+    ``flush_max_changes`` changes; in ``sync`` mode every change is flushed before
+    the caller continues.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        flush_interval_ms: int | None = None,
+        flush_max_changes: int | None = None,
+        max_entries: int | None = None,
+        durability: str | None = None,
+    ) -> None:
+        self.db = db
+        self.flush_interval = (flush_interval_ms or settings.quota_ledger_flush_ms) / 1000
+        self.flush_max_changes = flush_max_changes or settings.quota_ledger_flush_changes
+        self.max_entries = max_entries or settings.quota_ledger_max_entries
+        self.durability = (durability or settings.quota_ledger_durability).lower()
+        if self.durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown quota ledger durability mode: {self.durability}")
+        self._balances: OrderedDict[int, int] = OrderedDict()
+        self._paid: set[int] = set()
+        self._pending: dict[int, int] = {}
+        self._inflight: dict[int, int] = {}
+        self._changes = 0
+        self._flush_lock = asyncio.Lock()
+        self._wake: asyncio.Event | None = None
+        self._task: asyncio.Task[None] | None = None
+        self.flushes = 0
+        self.rows_flushed = 0
+
+    def is_loaded(self, telegram_id: int) -> bool:
+        return telegram_id in self._balances
+
+    def seed(self, telegram_id: int, free_left: int, paid: bool = False) -> None:
+        """Remember the database balance unless the user is already tracked."""
+
+        if telegram_id not in self._balances:
+            self._balances[telegram_id] = free_left
+            if paid:
+                self._paid.add(telegram_id)
+            self._evict()
+
+    def is_paid(self, telegram_id: int) -> bool:
+        return telegram_id in self._paid
+
+    def balance(self, telegram_id: int) -> int:
+        self._balances.move_to_end(telegram_id)
+        return self._balances[telegram_id]
+
+    async def take(self, telegram_id: int) -> int | None:
+        """Decrement a seeded balance. Returns the remaining balance or ``None`` if empty.
+
+        An entry evicted since it was seeded is reloaded from the database first.
+        """
+
+        if telegram_id not in self._balances:
+            await self._load(telegram_id)
+        balance = self.balance(telegram_id)
+        if balance <= 0:
+            return None
+        self._balances[telegram_id] = balance - 1
+        await self._record(telegram_id, -1)
+        return balance - 1
+
+    async def _load(self, telegram_id: int) -> None:
+        row = await self.db.fetchone(
+            "SELECT free_left, paid_total FROM quotas WHERE telegram_id = ?", (telegram_id,)
+        )
+        free_left, paid_total = (int(row["free_left"]), int(row["paid_total"])) if row else (0, 0)
+        self.seed(telegram_id, free_left, paid=paid_total > 0)
+
+    async def give(self, telegram_id: int) -> int:
+        return await self.credit(telegram_id, 1)
+
+    async def credit(self, telegram_id: int, count: int, paid: bool = False) -> int:
+        balance = self._balances.get(telegram_id, 0) + count
+        self._balances[telegram_id] = balance
+        if paid:
+            self._paid.add(telegram_id)
+        await self._record(telegram_id, count)
+        return balance
+
+    async def _record(self, telegram_id: int, delta: int) -> None:
+        self._pending[telegram_id] = self._pending.get(telegram_id, 0) + delta
+        self._changes += 1
+        if self.durability == "sync" or self._task is None:
+            await self.flush()
+        elif self._changes >= self.flush_max_changes and self._wake is not None:
+            self._wake.set()
+
+    def _evict(self) -> None:
+        # Only clean entries may be forgotten; dirty ones wait for the next flush.
+        if len(self._balances) <= self.max_entries:
+            return
+        for telegram_id in list(self._balances):
+            if len(self._balances) <= self.max_entries:
+                break
+            if telegram_id not in self._pending and telegram_id not in self._inflight:
+                del self._balances[telegram_id]
+                self._paid.discard(telegram_id)
+
+    async def flush(self) -> int:
+        """Write pending deltas in one transaction. Returns the number of rows written."""
+
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            pending, self._pending = self._pending, {}
+            self._inflight = pending
+            self._changes = 0
+            rows = [(delta, telegram_id) for telegram_id, delta in pending.items() if delta]
+            try:
+                async with self.db.connect() as conn:
+                    await conn.executemany(
+                        "UPDATE quotas SET free_left = free_left + ?, updated_at = datetime('now') WHERE telegram_id = ?",
+                        rows,
+                    )
+                    await conn.commit()
+            except Exception:
+                # Put the deltas back so nothing is lost; they are retried on the next flush.
+                for telegram_id, delta in pending.items():
+                    self._pending[telegram_id] = self._pending.get(telegram_id, 0) + delta
+                raise
+            finally:
+                self._inflight = {}
+            self.flushes += 1
+            self.rows_flushed += len(rows)
+            self._evict()
+            return len(rows)
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="quota-ledger-flush")
+        logger.info(
+            "Quota ledger started (%s, every %.0f ms or %s changes)",
+            self.durability,
+            self.flush_interval * 1000,
+            self.flush_max_changes,
+        )
+
+    async def _run(self) -> None:
+        assert self._wake is not None
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception:  # pragma: no cover - runtime guard
+                logger.exception("Quota ledger flush failed")
+
+    async def stop(self) -> None:
+        """Stop the background flusher and write every pending change."""
+
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._wake = None
+        written = await self.flush()
+        logger.info("Quota ledger stopped, final flush wrote %s rows", written)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "tracked": len(self._balances),
+            "dirty": len(self._pending),
+            "flushes": self.flushes,
+            "rows_flushed": self.rows_flushed,
+        }
@@ -1,19 +1,56 @@
 from __future__ import annotations
 
 import logging
+import uuid
+from dataclasses import dataclass
 
 from app.db.storage import Database
 from app.config.runtime import runtime_config
+from app.services.known_users import KnownUsers
+from app.services.quota_ledger import QuotaLedger
+from app.services.request_log_writer import RequestLogWriter
 
 logger = logging.getLogger(__name__)
 
 
+TIER_FREE = "free"
+TIER_PAID = "paid"
+
+
+@dataclass(slots=True)
+class QuotaReservation:
+    token: str
+    telegram_id: int
+    remaining: int
+    tier: str = TIER_FREE
+
+
 class QuotaService:
-    def __init__(self, db: Database, free_quota: int | None = None) -> None:
+    def __init__(
+        self,
+        db: Database,
+        free_quota: int | None = None,
+        ledger: QuotaLedger | None = None,
+        log_writer: RequestLogWriter | None = None,
+        known_users: KnownUsers | None = None,
+    ) -> None:
         self.db = db
         self.free_quota = free_quota or runtime_config.free_quota
+        self.ledger = ledger
+        self.log_writer = log_writer
+        self.known_users = known_users
+        self._reservations: dict[str, QuotaReservation] = {}
+
+    def _is_known(self, telegram_id: int) -> bool:
+        return self.known_users is not None and self.known_users.check(telegram_id)
+
+    def _mark_known(self, telegram_id: int) -> None:
+        if self.known_users is not None:
+            self.known_users.add(telegram_id)
 
     async def ensure_user(self, telegram_id: int) -> None:
+        if self._is_known(telegram_id):
+            return
         async with self.db.connect() as conn:
             await conn.execute(
                 "INSERT OR IGNORE INTO users (telegram_id, created_at) VALUES (?, datetime('now'))",
@@ -24,43 +61,141 @@ class QuotaService:
                 (telegram_id, self.free_quota),
             )
             await conn.commit()
+        self._mark_known(telegram_id)
 
     async def get_free_left(self, telegram_id: int) -> int:
+        if self.ledger is not None:
+            await self._seed_ledger(telegram_id)
+            return self.ledger.balance(telegram_id)
+        free_left, _ = await self._read_balance(telegram_id)
+        return free_left
+
+    async def get_tier(self, telegram_id: int) -> str:
+        if self.ledger is not None:
+            await self._seed_ledger(telegram_id)
+            return TIER_PAID if self.ledger.is_paid(telegram_id) else TIER_FREE
+        _, paid_total = await self._read_balance(telegram_id)
+        return TIER_PAID if paid_total > 0 else TIER_FREE
+
+    async def _read_balance(self, telegram_id: int) -> tuple[int, int]:
         await self.ensure_user(telegram_id)
-        row = await self.db.fetchone("SELECT free_left FROM quotas WHERE telegram_id = ?", (telegram_id,))
-        return int(row["free_left"]) if row else 0
+        row = await self.db.fetchone(
+            "SELECT free_left, paid_total FROM quotas WHERE telegram_id = ?", (telegram_id,)
+        )
+        return (int(row["free_left"]), int(row["paid_total"])) if row else (0, 0)
 
-    async def consume_one(self, telegram_id: int) -> bool:
+    async def _seed_ledger(self, telegram_id: int) -> None:
+        assert self.ledger is not None
+        if not self.ledger.is_loaded(telegram_id):
+            free_left, paid_total = await self._read_balance(telegram_id)
+            self.ledger.seed(telegram_id, free_left, paid=paid_total > 0)
+
+    async def reserve(self, telegram_id: int) -> QuotaReservation | None:
+        """Atomically create the user if needed and take one request from the balance.
+
+        Returns ``None`` when the balance is exhausted. The reservation must be
+        finished with :meth:`commit` or :meth:`release`.
+        """
+
+        if self.ledger is not None:
+            await self._seed_ledger(telegram_id)
+            remaining = await self.ledger.take(telegram_id)
+            tier = TIER_PAID if self.ledger.is_paid(telegram_id) else TIER_FREE
+            return self._register(telegram_id, remaining, tier)
+
+        known = self._is_known(telegram_id)
         async with self.db.connect() as conn:
-            await conn.execute("BEGIN")
-            await conn.execute(
-                "INSERT OR IGNORE INTO users (telegram_id, created_at) VALUES (?, datetime('now'))",
-                (telegram_id,),
+            await conn.execute("BEGIN IMMEDIATE")
+            if not known:
+                await conn.execute(
+                    "INSERT OR IGNORE INTO users (telegram_id, created_at) VALUES (?, datetime('now'))",
+                    (telegram_id,),
+                )
+            cursor = await conn.execute(
+                "INSERT INTO quotas (telegram_id, free_left, updated_at) "
+                "SELECT ?, ? - 1, datetime('now') WHERE ? > 0 "
+                "ON CONFLICT(telegram_id) DO UPDATE SET free_left = free_left - 1, updated_at = datetime('now') "
+                "WHERE free_left > 0 "
+                "RETURNING free_left, paid_total",
+                (telegram_id, self.free_quota, self.free_quota),
             )
-            await conn.execute(
-                "INSERT OR IGNORE INTO quotas (telegram_id, free_left, updated_at) VALUES (?, ?, datetime('now'))",
-                (telegram_id, self.free_quota),
-            )
-            cursor = await conn.execute("SELECT free_left FROM quotas WHERE telegram_id = ?", (telegram_id,))
             row = await cursor.fetchone()
-            if not row or int(row["free_left"]) <= 0:
-                await conn.execute("ROLLBACK")
-                return False
-            await conn.execute(
-                "UPDATE quotas SET free_left = free_left - 1, updated_at = datetime('now') WHERE telegram_id = ?",
-                (telegram_id,),
-            )
+            await cursor.close()
             await conn.commit()
-            return True
+
+        if not known:
+            self._mark_known(telegram_id)
+        if row is None:
+            return None
+        tier = TIER_PAID if int(row["paid_total"]) > 0 else TIER_FREE
+        return self._register(telegram_id, int(row["free_left"]), tier)
+
+    def _register(self, telegram_id: int, remaining: int | None, tier: str) -> QuotaReservation | None:
+        if remaining is None:
+            return None
+        reservation = QuotaReservation(
+            token=uuid.uuid4().hex, telegram_id=telegram_id, remaining=remaining, tier=tier
+        )
+        self._reservations[reservation.token] = reservation
+        return reservation
+
+    async def commit(self, reservation: QuotaReservation) -> bool:
+        """Mark the reserved request as spent. Returns ``False`` if it was already finished."""
+
+        return self._reservations.pop(reservation.token, None) is not None
+
+    async def release(self, reservation: QuotaReservation) -> bool:
+        """Return the reserved request to the balance exactly once."""
+
+        if self._reservations.pop(reservation.token, None) is None:
+            logger.warning("Reservation %s already finished, refund skipped", reservation.token)
+            return False
+        await self.refund_one(reservation.telegram_id)
+        return True
+
+    async def consume_one(self, telegram_id: int) -> bool:
+        reservation = await self.reserve(telegram_id)
+        if reservation is None:
+            return False
+        await self.commit(reservation)
+        return True
 
     async def refund_one(self, telegram_id: int) -> None:
+        if self.ledger is not None:
+            await self._seed_ledger(telegram_id)
+            await self.ledger.give(telegram_id)
+            return
         await self.db.execute(
             "UPDATE quotas SET free_left = free_left + 1, updated_at = datetime('now') WHERE telegram_id = ?",
             (telegram_id,),
         )
 
-    async def log_request(self, telegram_id: int, module: str, action: str, prompt_hash: str) -> None:
+    async def credit_paid(self, telegram_id: int, count: int) -> None:
+        """Add purchased requests to the balance; the user moves to the paid tier."""
+
+        await self.ensure_user(telegram_id)
+        if self.ledger is not None:
+            await self._seed_ledger(telegram_id)
+            await self.ledger.credit(telegram_id, count, paid=True)
+            await self.db.execute(
+                "UPDATE quotas SET paid_total = paid_total + ?, updated_at = datetime('now') WHERE telegram_id = ?",
+                (count, telegram_id),
+            )
+            return
+        await self.db.execute(
+            "UPDATE quotas SET free_left = free_left + ?, paid_total = paid_total + ?, updated_at = datetime('now') "
+            "WHERE telegram_id = ?",
+            (count, count, telegram_id),
+        )
+
+    async def log_request(
+        self, telegram_id: int, module: str, action: str, prompt_hash: str, tier: str = "free"
+    ) -> None:
+        if self.log_writer is not None and self.log_writer.running:
+            await self.log_writer.enqueue(telegram_id, module, action, prompt_hash, tier)
+            return
         await self.db.execute(
-            "INSERT INTO requests_log (telegram_id, module, action, prompt_hash, created_at) VALUES (?, ?, ?, ?, datetime('now'))",
-            (telegram_id, module, action, prompt_hash),
+            "INSERT INTO requests_log (telegram_id, module, action, prompt_hash, tier, created_at) "
+            "VALUES (?, ?, ?, ?, ?, datetime('now'))",
+            (telegram_id, module, action, prompt_hash, tier),
         )
@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+
+from app.config.settings import settings
+from app.db.storage import Database
+
+logger = logging.getLogger(__name__)
+
+INSERT_SQL = (
+    "INSERT INTO requests_log (telegram_id, module, action, prompt_hash, tier, created_at) VALUES (?, ?, ?, ?, ?, ?)"
+)
+
+LogRow = tuple[int, str, str, str, str, str]
+
+
+def _utc_timestamp() -> str:
+    # Same format as SQLite datetime('now') so rows compare correctly with older data.
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class RequestLogWriter:
+    """Background writer for ``requests_log``.
+
+    Handlers only enqueue rows; a single task drains the bounded queue and
+    inserts rows with ``executemany`` in one transaction per batch. When the
+    queue is full, callers wait for space (counted in ``blocked``) instead of
+    dropping audit rows.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        max_queue: int | None = None,
+        batch_size: int | None = None,
+        flush_interval_ms: int | None = None,
+    ) -> None:
+        self.db = db
+        self.batch_size = batch_size or settings.request_log_batch_size
+        self.flush_interval = (flush_interval_ms or settings.request_log_flush_ms) / 1000
+        self._queue: asyncio.Queue[LogRow | None] = asyncio.Queue(maxsize=max_queue or settings.request_log_queue_size)
+        self._task: asyncio.Task[None] | None = None
+        self.enqueued = 0
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+        self.blocked = 0
+        self.max_depth = 0
+        self.blocked_seconds = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run(), name="requests-log-writer")
+        logger.info("Request log writer started (batch %s, queue %s)", self.batch_size, self._queue.maxsize)
+
+    async def enqueue(self, telegram_id: int, module: str, action: str, prompt_hash: str, tier: str = "free") -> None:
+        row: LogRow = (telegram_id, module, action, prompt_hash, tier, _utc_timestamp())
+        try:
+            self._queue.put_nowait(row)
+        except asyncio.QueueFull:
+            self.blocked += 1
+            started = time.perf_counter()
+            await self._queue.put(row)
+            self.blocked_seconds += time.perf_counter() - started
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+
+    async def _run(self) -> None:
+        while True:
+            row = await self._queue.get()
+            if row is None:
+                return
+            batch = [row]
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            await self._write(batch)
+            if stop:
+                return
+
+    async def _write(self, batch: list[LogRow]) -> None:
+        try:
+            async with self.db.connect() as conn:
+                await conn.executemany(INSERT_SQL, batch)
+                await conn.commit()
+        except Exception:  # pragma: no cover - runtime guard
+            self.failed += len(batch)
+            logger.exception("Failed to write %s requests_log rows", len(batch))
+            return
+        self.written += len(batch)
+        self.batches += 1
+
+    async def stop(self) -> None:
+        """Drain every queued row and stop the writer task."""
+
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        leftover: list[LogRow] = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                leftover.append(item)
+        for start in range(0, len(leftover), self.batch_size):
+            await self._write(leftover[start : start + self.batch_size])
+        logger.info("Request log writer stopped: %s", self.stats())
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "depth": self._queue.qsize(),
+            "max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "batches": self.batches,
+            "failed": self.failed,
+            "blocked": self.blocked,
+            "blocked_seconds": round(self.blocked_seconds, 3),
+        }
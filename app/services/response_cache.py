@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import logging
+import time
+from collections import OrderedDict
+from datetime import date, datetime, time as dt_time, timedelta, timezone, tzinfo
+from typing import AsyncIterator
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from app.config.settings import settings
+from app.db.storage import Database
+from app.services.ai_service import AIService, AIServiceWrapper
+from app.services.prompt_builder import MODE_NATAL, MODE_TODAY, MODE_WEEK, BuiltPrompt, prompt_key
+
+logger = logging.getLogger(__name__)
+
+
+def _cache_zone() -> tzinfo:
+    try:
+        return ZoneInfo(settings.response_cache_tz)
+    except ZoneInfoNotFoundError:
+        logger.warning("Часовой пояс %s не найден (нужен пакет tzdata), считаю время UTC", settings.response_cache_tz)
+        return timezone.utc
+
+
+def cache_expiry(mode: str, now: datetime | None = None) -> float | None:
+    """Unix time when a response for ``mode`` stops being valid, ``None`` if it is not cacheable.
+
+    The daily forecast expires at the next midnight in ``RESPONSE_CACHE_TZ``, the weekly
+    one at the start of next Monday. A natal reading does not depend on the date, so it
+    is kept for 30 days. Midnight is resolved with the UTC offset of the target date, so
+    the expiry stays right across a DST change.
+    """
+
+    zone = _cache_zone()
+    today = (now.astimezone(zone) if now else datetime.now(zone)).date()
+    if mode == MODE_TODAY:
+        return _midnight(today + timedelta(days=1), zone)
+    if mode == MODE_WEEK:
+        return _midnight(today + timedelta(days=7 - today.weekday()), zone)
+    if mode == MODE_NATAL:
+        return _midnight(today + timedelta(days=30), zone)
+    return None
+
+
+def _midnight(day: date, zone: tzinfo) -> float:
+    return datetime.combine(day, dt_time.min, tzinfo=zone).timestamp()
+
+
+class ResponseCache:
+    """Two-tier cache of AI responses: an in-memory LRU over the ``response_cache`` table."""
+
+    def __init__(self, db: Database, max_memory_items: int | None = None) -> None:
+        self.db = db
+        self.max_memory_items = max_memory_items or settings.response_cache_memory_items
+        self._memory: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def _remember(self, key: str, response: str, expires_at: float) -> None:
+        self._memory[key] = (response, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    async def get(self, key: str) -> str | None:
+        now = time.time()
+        cached = self._memory.get(key)
+        if cached is not None:
+            response, expires_at = cached
+            if expires_at > now:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return response
+            del self._memory[key]
+
+        row = await self.db.fetchone(
+            "SELECT response, expires_at FROM response_cache WHERE cache_key = ? AND expires_at > ?",
+            (key, int(now)),
+        )
+        if row is None:
+            self.misses += 1
+            return None
+        self.db_hits += 1
+        self._remember(key, row["response"], float(row["expires_at"]))
+        return row["response"]
+
+    async def put(self, key: str, response: str, mode: str, expires_at: float) -> None:
+        self._remember(key, response, expires_at)
+        await self.db.execute(
+            "INSERT INTO response_cache (cache_key, mode, response, created_at, expires_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(cache_key) DO UPDATE SET response = excluded.response, mode = excluded.mode, "
+            "created_at = excluded.created_at, expires_at = excluded.expires_at",
+            (key, mode, response, int(time.time()), int(expires_at)),
+        )
+
+    def stats(self) -> dict[str, float]:
+        hits = self.memory_hits + self.db_hits
+        total = hits + self.misses
+        return {
+            "memory_items": len(self._memory),
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / total, 3) if total else 0.0,
+        }
+
+
+class CachingAIService(AIServiceWrapper):
+    """Serves repeated prompts from :class:`ResponseCache`.
+
+    Only prompts whose mode has an expiry (daily/weekly forecasts) are cached.
+    ``prompt.fresh`` (the "regen" button) skips the lookup and overwrites the entry.
+    The namespace (AI mode) keeps stub answers from being served once OpenAI is on;
+    fallback answers given while the circuit breaker is open are not stored at all.
+    Personal prompts are stored under their canonical request key, which the
+    handlers can look up with :meth:`lookup_key` before building the prompt.
+    """
+
+    def __init__(self, inner: AIService, cache: ResponseCache, namespace: str = "") -> None:
+        super().__init__(inner)
+        self.cache = cache
+        self.namespace = namespace
+        self.bypassed = 0
+
+    def cache_key(self, prompt: BuiltPrompt) -> str:
+        return f"{self.namespace}:{prompt_key(prompt)}"
+
+    async def lookup(self, prompt: BuiltPrompt) -> str | None:
+        """Cached response for ``prompt`` without falling through to the AI."""
+
+        if cache_expiry(prompt.mode) is None:
+            return None
+        return await self.cache.get(self.cache_key(prompt))
+
+    async def lookup_key(self, request_key: str, mode: str) -> str | None:
+        """Cached response for a canonical request key, before any prompt is built."""
+
+        if cache_expiry(mode) is None:
+            return None
+        return await self.cache.get(f"{self.namespace}:{request_key}")
+
+    async def generate(self, prompt: BuiltPrompt) -> str:
+        expires_at = cache_expiry(prompt.mode)
+        if expires_at is None:
+            return await self.inner.generate(prompt)
+
+        key = self.cache_key(prompt)
+        if prompt.fresh:
+            self.bypassed += 1
+        else:
+            cached = await self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        response = await self.inner.generate(prompt)
+        if not prompt.fallback:
+            await self._store(key, response, prompt.mode, expires_at)
+        return response
+
+    async def generate_stream(self, prompt: BuiltPrompt) -> AsyncIterator[str]:
+        expires_at = cache_expiry(prompt.mode)
+        if expires_at is None:
+            async for chunk in self.inner.generate_stream(prompt):
+                yield chunk
+            return
+
+        key = self.cache_key(prompt)
+        if prompt.fresh:
+            self.bypassed += 1
+        else:
+            cached = await self.cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+
+        parts: list[str] = []
+        async for chunk in self.inner.generate_stream(prompt):
+            parts.append(chunk)
+            yield chunk
+        if not prompt.fallback:
+            await self._store(key, "".join(parts), prompt.mode, expires_at)
+
+    async def _store(self, key: str, response: str, mode: str, expires_at: float) -> None:
+        try:
+            await self.cache.put(key, response, mode, expires_at)
+        except Exception:  # pragma: no cover - runtime guard
+            logger.exception("Failed to store AI response in cache")
+
+    def stats(self) -> dict[str, float]:
+        return {**self.cache.stats(), "bypassed": self.bypassed}
@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import time
+from collections import Counter
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Iterable, Mapping, TypeVar
+
+from app.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+ERROR_TIMEOUT = "timeout"
+ERROR_CONNECTION = "connection"
+ERROR_RATE_LIMIT = "rate_limit"
+ERROR_SERVER = "server"
+ERROR_OTHER = "other"
+# Failures where the request never produced a result, so sending it again is safe.
+RETRYABLE = frozenset({ERROR_TIMEOUT, ERROR_CONNECTION, ERROR_RATE_LIMIT, ERROR_SERVER})
+
+
+def parse_retry_after(headers: Mapping[str, str] | None) -> float | None:
+    """Seconds to wait from ``retry-after-ms`` / ``retry-after`` (seconds or HTTP date)."""
+
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class Deadline:
+    """Absolute end of a request; every attempt and pause spends from the same budget."""
+
+    def __init__(self, seconds: float) -> None:
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+
+class RetryPolicy:
+    """Single retry and deadline layer for calls to the AI provider.
+
+    The whole request, attempts and pauses included, must fit in ``deadline_s``; a
+    single attempt is also capped at ``attempt_timeout_s``. Only error classes in
+    ``retryable`` are retried. Pauses use decorrelated jitter between ``base_s`` and
+    ``cap_s`` unless the provider sent ``Retry-After``; a pause that would not leave
+    any budget for the next attempt ends the retries. ``classify`` maps an exception
+    to an error class, ``retry_after`` extracts the provider's hint (seconds).
+    """
+
+    def __init__(
+        self,
+        classify: Callable[[BaseException], str],
+        retry_after: Callable[[BaseException], float | None] | None = None,
+        deadline_s: float | None = None,
+        attempt_timeout_s: float | None = None,
+        base_s: float | None = None,
+        cap_s: float | None = None,
+        max_attempts: int | None = None,
+        retryable: Iterable[str] = RETRYABLE,
+    ) -> None:
+        self.classify = classify
+        self.retry_after = retry_after or (lambda exc: None)
+        self.deadline_s = deadline_s if deadline_s is not None else settings.ai_request_deadline_s
+        self.attempt_timeout_s = attempt_timeout_s if attempt_timeout_s is not None else settings.ai_attempt_timeout_s
+        self.base_s = base_s if base_s is not None else settings.ai_retry_base_s
+        self.cap_s = cap_s if cap_s is not None else settings.ai_retry_cap_s
+        self.max_attempts = max_attempts or settings.ai_retry_max_attempts
+        self.retryable = frozenset(retryable)
+        self.attempts: Counter[str] = Counter()
+        self.retries: Counter[str] = Counter()
+        self.gave_up: Counter[str] = Counter()
+
+    def deadline(self) -> Deadline:
+        return Deadline(self.deadline_s)
+
+    def _next_pause(self, previous: float) -> float:
+        return min(self.cap_s, random.uniform(self.base_s, max(self.base_s, previous * 3)))
+
+    async def run(self, call: Callable[[], Awaitable[T]], deadline: Deadline | None = None) -> T:
+        """Await ``call()`` until it succeeds, fails for good or the deadline runs out."""
+
+        deadline = deadline or self.deadline()
+        pause = self.base_s
+        attempt = 0
+        while True:
+            attempt += 1
+            budget = deadline.remaining()
+            if budget <= 0:
+                self.gave_up[ERROR_TIMEOUT] += 1
+                raise asyncio.TimeoutError("AI request deadline exceeded")
+            try:
+                async with asyncio.timeout(min(budget, self.attempt_timeout_s)):
+                    result = await call()
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                error_class = ERROR_TIMEOUT if isinstance(exc, asyncio.TimeoutError) else self.classify(exc)
+                self.attempts[error_class] += 1
+                if error_class not in self.retryable or attempt >= self.max_attempts:
+                    self.gave_up[error_class] += 1
+                    raise
+                hint = self.retry_after(exc)
+                pause = hint if hint is not None else self._next_pause(pause)
+                if pause >= deadline.remaining():
+                    self.gave_up[error_class] += 1
+                    raise
+                self.retries[error_class] += 1
+                logger.warning(
+                    "AI attempt %s failed (%s), retrying in %.2f s: %r", attempt, error_class, pause, exc
+                )
+                await asyncio.sleep(pause)
+                continue
+            self.attempts["ok"] += 1
+            return result
+
+    def stats(self) -> dict[str, object]:
+        return {
+            "attempts": dict(self.attempts),
+            "retries": dict(self.retries),
+            "gave_up": dict(self.gave_up),
+        }
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import AsyncIterator
+
+from app.services.ai_scheduler import LANES, AIScheduler
+from app.services.ai_service import AIService, AIServiceError, AIServiceWrapper
+from app.services.prompt_builder import BuiltPrompt, prompt_key
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class _Flight:
+    result: asyncio.Future[str]
+    # The leader's prompt: joined callers copy its ``fallback`` flag along with the text.
+    prompt: BuiltPrompt
+    waiters: int = 0
+
+
+class SingleFlightAIService(AIServiceWrapper):
+    """Coalesces concurrent generations of the same prompt into one backend call.
+
+    Every caller awaits a shielded shared future, so a cancelled waiter only stops
+    waiting; a shared background call is cancelled when its last waiter is gone.
+    A streaming caller that starts a flight reads the provider stream through the
+    flight's task and everyone who joined meanwhile gets the full text; if the
+    leader leaves early, the stream goes on for them. ``prompt.fresh`` requests are
+    never coalesced. Prompts are matched by their canonical request key when they
+    carry one, otherwise by the prompt hash.
+
+    Flights are kept per scheduler lane: a caller joins a flight of its own lane or
+    a faster one, never a slower one, so a paid request does not wait behind a free
+    or background call queued for the same prompt.
+    """
+
+    def __init__(self, inner: AIService) -> None:
+        super().__init__(inner)
+        self._inflight: dict[str, _Flight] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def _register(self, key: str, result: asyncio.Future[str], prompt: BuiltPrompt) -> _Flight:
+        flight = _Flight(result=result, prompt=prompt)
+
+        def _done(future: asyncio.Future[str]) -> None:
+            if self._inflight.get(key) is flight:
+                del self._inflight[key]
+            if not future.cancelled():
+                future.exception()  # mark as retrieved even if every waiter has gone
+
+        result.add_done_callback(_done)
+        self._inflight[key] = flight
+        self.calls += 1
+        return flight
+
+    async def _wait(self, flight: _Flight) -> str:
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.result)
+        except asyncio.CancelledError:
+            if flight.result.cancelled() and not _cancelling():
+                # The shared call was cancelled from outside, not this waiter.
+                raise AIServiceError("Генерация была прервана") from None
+            raise
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and isinstance(flight.result, asyncio.Task) and not flight.result.done():
+                flight.result.cancel()
+
+    async def _join(self, flight: _Flight, prompt: BuiltPrompt) -> str:
+        self.coalesced += 1
+        response = await self._wait(flight)
+        prompt.fallback = prompt.fallback or flight.prompt.fallback
+        return response
+
+    def _find(self, prompt: BuiltPrompt) -> tuple[str, _Flight | None]:
+        """Key for a new flight of ``prompt`` and the flight it may join instead, if any."""
+
+        answer_key = prompt_key(prompt)
+        lane = AIScheduler.lane_of(prompt)
+        for candidate in LANES[: LANES.index(lane) + 1]:
+            flight = self._inflight.get(f"{candidate}:{answer_key}")
+            if flight is not None:
+                return f"{lane}:{answer_key}", flight
+        return f"{lane}:{answer_key}", None
+
+    async def generate(self, prompt: BuiltPrompt) -> str:
+        if prompt.fresh:
+            self.calls += 1
+            return await self.inner.generate(prompt)
+
+        key, flight = self._find(prompt)
+        if flight is not None:
+            return await self._join(flight, prompt)
+        task = asyncio.create_task(self.inner.generate(prompt), name=f"ai-flight-{key[:20]}")
+        return await self._wait(self._register(key, task, prompt))
+
+    async def generate_stream(self, prompt: BuiltPrompt) -> AsyncIterator[str]:
+        if prompt.fresh:
+            self.calls += 1
+            async for chunk in self.inner.generate_stream(prompt):
+                yield chunk
+            return
+
+        key, flight = self._find(prompt)
+        if flight is not None:
+            yield await self._join(flight, prompt)
+            return
+
+        chunks: asyncio.Queue[str | None] = asyncio.Queue()
+        task = asyncio.create_task(self._pump(prompt, chunks), name=f"ai-flight-{key[:20]}")
+        flight = self._register(key, task, prompt)
+        # The leader holds the flight like any waiter: leaving early only ends its own stream.
+        flight.waiters += 1
+        finished = False
+        try:
+            while (chunk := await chunks.get()) is not None:
+                yield chunk
+            finished = True
+        finally:
+            flight.waiters -= 1
+            if not finished and flight.waiters == 0:
+                task.cancel()
+        # Raises the provider's error, if the stream ended with one.
+        await self._wait(flight)
+
+    async def _pump(self, prompt: BuiltPrompt, chunks: asyncio.Queue[str | None]) -> str:
+        """Read the provider stream in the flight's own task, feeding the leader's queue."""
+
+        parts: list[str] = []
+        try:
+            async for chunk in self.inner.generate_stream(prompt):
+                parts.append(chunk)
+                chunks.put_nowait(chunk)
+        finally:
+            chunks.put_nowait(None)
+        return "".join(parts)
+
+    def stats(self) -> dict[str, int]:
+        return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._inflight)}
+
+
+def _cancelling() -> bool:
+    task = asyncio.current_task()
+    return bool(task and task.cancelling())
@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import multiprocessing
+import signal
+import socket
+from typing import Callable
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from app.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+HEALTH_PATH = "/healthz"
+REUSE_PORT_AVAILABLE = hasattr(socket, "SO_REUSEPORT")
+
+
+def effective_workers(requested: int | None = None) -> int:
+    """Worker processes that can actually share the port: one where ``SO_REUSEPORT`` is missing (Windows)."""
+
+    workers = max(1, requested if requested is not None else settings.webhook_workers)
+    if workers > 1 and not REUSE_PORT_AVAILABLE:
+        logger.warning("SO_REUSEPORT недоступен на этой платформе: вебхук обслуживает один процесс")
+        return 1
+    return workers
+
+
+def webhook_url() -> str | None:
+    if not settings.webhook_url:
+        return None
+    return settings.webhook_url.rstrip("/") + settings.webhook_path
+
+
+def build_webhook_app(dispatcher: Dispatcher, bot: Bot, secret: str) -> web.Application:
+    """aiohttp app that accepts Telegram updates on ``WEBHOOK_PATH``.
+
+    Requests without the right ``X-Telegram-Bot-Api-Secret-Token`` get 401. Valid
+    updates are answered with 200 at once and handled in a background task, so
+    Telegram never waits for an AI call and keeps its connections busy.
+    """
+
+    app = web.Application()
+    handler = SimpleRequestHandler(dispatcher=dispatcher, bot=bot, secret_token=secret, handle_in_background=True)
+    handler.register(app, path=settings.webhook_path)
+
+    async def health(_: web.Request) -> web.Response:
+        return web.Response(text="ok")
+
+    app.router.add_get(HEALTH_PATH, health)
+    setup_application(app, dispatcher, bot=bot)
+    return app
+
+
+async def start_webhook_site(
+    app: web.Application, host: str, port: int, reuse_port: bool = False
+) -> web.AppRunner:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port, reuse_port=reuse_port or None)
+    await site.start()
+    return runner
+
+
+async def serve_webhook(dispatcher: Dispatcher, bot: Bot, secret: str, worker: int, workers: int) -> None:
+    """Serve the webhook until the task is cancelled or the process gets SIGTERM."""
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGTERM, stop.set)
+    except (NotImplementedError, RuntimeError):  # pragma: no cover - Windows
+        pass
+    runner = await start_webhook_site(
+        build_webhook_app(dispatcher, bot, secret), settings.webhook_host, settings.webhook_port, workers > 1
+    )
+    logger.info(
+        "Webhook worker %s/%s listening on %s:%s%s",
+        worker + 1,
+        workers,
+        settings.webhook_host,
+        settings.webhook_port,
+        settings.webhook_path,
+    )
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+
+
+async def register_webhook(bot: Bot, secret: str, allowed_updates: list[str]) -> bool:
+    """Point Telegram at ``WEBHOOK_URL``; ``False`` when no public URL is configured (local testing)."""
+
+    url = webhook_url()
+    if url is None:
+        logger.warning("WEBHOOK_URL не задан: вебхук не зарегистрирован, сервер принимает только локальные запросы")
+        return False
+    await bot.set_webhook(
+        url,
+        secret_token=secret,
+        allowed_updates=allowed_updates,
+        max_connections=settings.webhook_max_connections,
+        drop_pending_updates=False,
+    )
+    logger.info("Webhook registered: %s", url)
+    return True
+
+
+def run_workers(target: Callable[[int, int, str], None], workers: int, secret: str) -> None:
+    """Run ``target(worker, workers, secret)`` in ``workers`` processes and wait for all of them.
+
+    The processes bind the same port with ``SO_REUSEPORT`` and the kernel spreads
+    Telegram's connections between them. Ctrl+C (or SIGTERM to the supervisor)
+    stops every worker.
+    """
+
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=target, args=(index, workers, secret), name=f"webhook-{index}")
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    def _terminate(*_: object) -> None:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, _terminate)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # Ctrl+C reaches the whole process group: give the workers time to shut down cleanly.
+        for process in processes:
+            process.join(timeout=10)
+        _terminate()
+    failed = [process.name for process in processes if process.exitcode not in (0, -signal.SIGTERM)]
+    if failed:
+        logger.error("Webhook workers exited with errors: %s", ", ".join(failed))
@@ -7,11 +7,13 @@ import os
 import platform
 import subprocess
 import sys
+from datetime import datetime
 from pathlib import Path
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 
 from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 from aiogram.exceptions import TelegramBadRequest, TelegramUnauthorizedError
 
@@ -24,6 +26,8 @@ from app.services.ai_service import (
     StubAIService,
     resolve_ai_service,
 )
+from app.services.circuit_breaker import read_worker_circuit_states
+from app.services.http_clients import http_clients
 from app.services.prompt_builder import HoroscopeRequest, build_horoscope_prompt
 from app.tools.bot_runner import BotRunner
 from app.tools.editor_store import EditorStore
@@ -290,8 +294,23 @@ class LauncherGUI:
             "Файл .env": f"{self.env_manager.path.resolve()} ({'есть' if self.env_manager.path.exists() else 'нет'})",
             "База данных": str(self._db_path().resolve()),
             "Каталог logs": str(LOG_DIR.resolve()),
+            "Цепь AI": self._circuit_info(),
         }
 
+    @staticmethod
+    def _circuit_info() -> str:
+        states = read_worker_circuit_states()
+        if not states:
+            return "замкнута (с запуска бота цепь не размыкалась)"
+        parts = []
+        for worker, state in states.items():
+            since = datetime.fromtimestamp(state.get("since", 0)).strftime("%d.%m %H:%M:%S")
+            info = f"{state.get('state')} с {since}"
+            if state.get("reason"):
+                info += f" — {state['reason']}"
+            parts.append(info if len(states) == 1 else f"процесс {worker}: {info}")
+        return "; ".join(parts)
+
     def _tab_diagnostics(self, parent: ttk.Notebook) -> ttk.Frame:
         frame = ttk.Frame(parent, padding=10)
 
@@ -393,9 +412,15 @@ class LauncherGUI:
             return
 
         async def _run() -> str:
-            bot = Bot(token=token, parse_mode=ParseMode.HTML)
-            me = await bot.get_me()
-            await bot.session.close()
+            bot = Bot(
+                token=token,
+                session=http_clients.telegram(),
+                default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+            )
+            try:
+                me = await bot.get_me()
+            finally:
+                await http_clients.close()
             return f"@{me.username}" if me.username else str(me.id)
 
         try:
@@ -420,6 +445,7 @@ class LauncherGUI:
             self._set_diag_status("Проверка токена завершилась ошибкой", warn=True)
 
     def _check_openai_ping(self) -> None:
+        self._refresh_status_info()
         self.openai_status.set("Выполняю запрос...")
         env = self.env_manager.load()
         use_openai = env.get("USE_OPENAI", "false").lower() == "true"
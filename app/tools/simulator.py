@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 import asyncio
-from dataclasses import dataclass, field
+from dataclasses import asdict, dataclass, field
 from typing import Dict, List
 
 from app.config.runtime import runtime_config
@@ -9,6 +9,7 @@ from app.config.settings import settings
 from app.core.validators import validate_date, validate_time
 from app.db.storage import Database
 from app.services.ai_service import resolve_ai_service
+from app.services.normalizer import RequestNormalizer
 from app.services.prompt_builder import HoroscopeRequest, build_horoscope_prompt
 from app.services.quota_service import QuotaService
 
@@ -38,6 +39,7 @@ class HoroscopeSimulator:
         self.db = Database(settings.db_path)
         self.ai_service = resolve_ai_service().service
         self.quota_service = QuotaService(self.db, free_quota=runtime_config.free_quota)
+        self.normalizer = RequestNormalizer()
         self._init_lock = asyncio.Lock()
 
     async def ensure_ready(self) -> None:
@@ -54,31 +56,43 @@ class HoroscopeSimulator:
 
     async def simulate(self) -> str:
         await self.ensure_ready()
-        await self.quota_service.ensure_user(self.state.user_id)
-        free_left = await self.quota_service.get_free_left(self.state.user_id)
-        if free_left <= 0:
-            return "Квота исчерпана"
-        consumed = await self.quota_service.consume_one(self.state.user_id)
-        if not consumed:
-            return "Квота недоступна"
+        try:
+            return await self._simulate()
+        finally:
+            # Each GUI action runs in its own event loop, so the pool is not kept between runs.
+            await self.db.close()
 
-        if not validate_date(self.state.birth_date):
+    async def _simulate(self) -> str:
+        if validate_date(self.state.birth_date) is None:
             return "Некорректная дата"
-        if self.state.birth_time and not validate_time(self.state.birth_time):
+        if self.state.birth_time and validate_time(self.state.birth_time) is None:
             return "Некорректное время"
 
-        req = HoroscopeRequest(
-            mode=self.state.mode,
-            birth_date=self.state.birth_date,
-            birth_time=self.state.birth_time,
-            birth_place=self.state.birth_place,
-            gender=self.state.gender,
-            focus=self.state.focus,
-        )
-        prompt = build_horoscope_prompt(req)
-        await self.quota_service.log_request(self.state.user_id, "horoscope", self.state.action, "simulated")
-        response = await self.ai_service.generate(prompt)
-        self.state.history.append(SimulationStep(role="user", text=str(req.__dict__)))
+        reservation = await self.quota_service.reserve(self.state.user_id)
+        if reservation is None:
+            return "Квота исчерпана"
+
+        try:
+            canonical = await self.normalizer.normalize(
+                HoroscopeRequest(
+                    mode=self.state.mode,
+                    birth_date=self.state.birth_date,
+                    birth_time=self.state.birth_time,
+                    birth_place=self.state.birth_place,
+                    gender=self.state.gender,
+                    focus=self.state.focus,
+                )
+            )
+            assert canonical is not None  # date and time were validated above
+            req = canonical.to_request()
+            prompt = build_horoscope_prompt(req)
+            await self.quota_service.log_request(self.state.user_id, "horoscope", self.state.action, "simulated")
+            response = await self.ai_service.generate(prompt)
+        except Exception:
+            await self.quota_service.release(reservation)
+            raise
+        await self.quota_service.commit(reservation)
+        self.state.history.append(SimulationStep(role="user", text=str(asdict(req))))
         self.state.history.append(SimulationStep(role="bot", text=response))
         return response
 
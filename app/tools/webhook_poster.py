@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import time
+from dataclasses import dataclass, field
+from typing import Any
+
+import aiohttp
+
+from app.config.settings import settings
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def make_update(update_id: int, user_id: int, text: str = "/start") -> dict[str, Any]:
+    """Minimal private-chat message update in the Bot API format."""
+
+    user = {"id": user_id, "is_bot": False, "first_name": f"Тест {user_id}"}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": user["first_name"]},
+            "from": user,
+            "text": text,
+        },
+    }
+
+
+@dataclass(slots=True)
+class PosterReport:
+    sent: int = 0
+    statuses: dict[int, int] = field(default_factory=dict)
+    latencies: list[float] = field(default_factory=list)
+    seconds: float = 0.0
+
+    def percentile(self, value: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * value / 100))]
+
+    def summary(self) -> str:
+        rate = self.sent / self.seconds if self.seconds else 0.0
+        return (
+            f"Отправлено {self.sent} обновлений за {self.seconds:.2f} с ({rate:.0f}/с), ответы {self.statuses}, "
+            f"задержка p50 {self.percentile(50) * 1000:.1f} мс, p95 {self.percentile(95) * 1000:.1f} мс"
+        )
+
+
+async def post_updates(
+    url: str,
+    secret: str,
+    count: int,
+    concurrency: int = 20,
+    users: int = 50,
+    text: str = "/start",
+) -> PosterReport:
+    """Stand in for Telegram: send ``count`` updates from ``users`` fake users, ``concurrency`` at a time.
+
+    Exercises the webhook server (secret check, fast 200, background handling,
+    several workers) without a public URL. Replies to the fake chats fail to
+    send, which the bot only logs.
+    """
+
+    report = PosterReport()
+    update_ids = itertools.count(1)
+    started = time.monotonic()
+
+    async def worker(session: aiohttp.ClientSession) -> None:
+        while report.sent < count:
+            report.sent += 1
+            update_id = next(update_ids)
+            update = make_update(update_id, 100_000 + update_id % users, text)
+            sent_at = time.monotonic()
+            async with session.post(url, json=update, headers={SECRET_HEADER: secret}) as response:
+                await response.read()
+                report.statuses[response.status] = report.statuses.get(response.status, 0) + 1
+            report.latencies.append(time.monotonic() - sent_at)
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+        await asyncio.gather(*(worker(session) for _ in range(max(1, concurrency))))
+    report.seconds = time.monotonic() - started
+    return report
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Локальная замена Telegram для проверки вебхука")
+    parser.add_argument(
+        "--url", default=f"http://127.0.0.1:{settings.webhook_port}{settings.webhook_path}", help="Адрес вебхука"
+    )
+    parser.add_argument("--secret", default=settings.webhook_secret, help="Секрет (по умолчанию WEBHOOK_SECRET)")
+    parser.add_argument("--count", type=int, default=200, help="Сколько обновлений отправить")
+    parser.add_argument("--concurrency", type=int, default=20, help="Одновременных запросов")
+    parser.add_argument("--users", type=int, default=50, help="Сколько разных пользователей имитировать")
+    parser.add_argument("--text", default="/start", help="Текст сообщения")
+    args = parser.parse_args(argv)
+    if not args.secret:
+        # Without WEBHOOK_SECRET the bot picks a random secret at every start, and every update would get 401.
+        parser.error("задайте WEBHOOK_SECRET в .env (тот же, что у запущенного бота) или передайте --secret")
+    report = asyncio.run(post_updates(args.url, args.secret, args.count, args.concurrency, args.users, args.text))
+    print(report.summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -2,27 +2,51 @@ from __future__ import annotations
 
 import asyncio
 import logging
+import secrets
 import sys
 import traceback
 
 from aiogram import Bot, Dispatcher
+from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
+from aiogram.fsm.storage.base import BaseStorage
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import ErrorEvent, Update
 
 from app.config.settings import settings
 from app.core.logging import setup_logging
 from app.core.router import setup_routers
+from app.db.maintenance import MaintenanceJob
 from app.db.storage import Database
 from app.modules.horoscope.handlers import init_horoscope_services
-from app.services.ai_service import AIServiceError, resolve_ai_service
+from app.modules.natal.engine import NatalEngine
+from app.services.ai_pipeline import build_ai_pipeline
+from app.services.ai_service import AIServiceError, parse_ai_backends, resolve_ai_service
+from app.services.batch import BatchGenerator, resolve_batch_provider
+from app.services.circuit_breaker import circuit_state_path
+from app.services.fsm_storage import SQLiteStorage
 from app.services.health import StartupError, perform_startup_checks
+from app.services.gazetteer import gazetteer
+from app.services.http_clients import http_clients
+from app.services.known_users import KnownUsers
+from app.services.normalizer import RequestNormalizer
 from app.services.payment_service import StubPaymentService
+from app.services.precompute import PrecomputeJob
+from app.services.quota_ledger import QuotaLedger
 from app.services.quota_service import QuotaService
+from app.services.request_log_writer import RequestLogWriter
+from app.services.webhook import effective_workers, register_webhook, run_workers, serve_webhook
 
 
-async def main() -> None:
-    log_file = setup_logging()
+async def main(webhook_secret: str | None = None, worker: int = 0, workers: int = 1) -> None:
+    """Run the bot: long polling by default, or one webhook worker when ``webhook_secret`` is given.
+
+    With several webhook workers only worker 0 runs the singleton background jobs
+    (maintenance, sign precompute) and registers the webhook; per-process caches
+    that would go stale across processes are turned off.
+    """
+
+    log_file = setup_logging(worker)
     logger = logging.getLogger("bot")
     try:
         perform_startup_checks()
@@ -31,19 +55,74 @@ async def main() -> None:
         logger.info("Подробности см. в %s", log_file)
         return
 
+    await http_clients.warm_up(openai_urls=[base_url for _, base_url in parse_ai_backends(settings.ai_backends)])
+
     db = Database(settings.db_path)
     await db.init()
 
-    quota_service = QuotaService(db)
-    ai_resolution = resolve_ai_service()
+    primary = worker == 0
+    shared = workers > 1
+    quota_ledger: QuotaLedger | None = None
+    if settings.quota_ledger_enabled and shared:
+        logger.warning("QUOTA_LEDGER_ENABLED не поддерживается с несколькими процессами вебхука, квоты пишутся в БД")
+    elif settings.quota_ledger_enabled:
+        quota_ledger = QuotaLedger(db)
+        await quota_ledger.start()
+    log_writer = RequestLogWriter(db)
+    await log_writer.start()
+    known_users = KnownUsers()
+    await known_users.warm(db)
+    quota_service = QuotaService(db, ledger=quota_ledger, log_writer=log_writer, known_users=known_users)
+    maintenance = MaintenanceJob(db)
+    if primary:
+        await maintenance.start()
+    # The breaker writes only on transitions; drop what a previous run of this worker left.
+    state_path = circuit_state_path(worker)
+    state_path.unlink(missing_ok=True)
+    ai_pipeline = build_ai_pipeline(db, resolve_ai_service(circuit_state_path=state_path), workers=workers)
+    natal: NatalEngine | None = None
+    if settings.natal_enabled:
+        natal = NatalEngine()
+        await natal.start()
+    if ai_pipeline.costs is not None:
+        await ai_pipeline.costs.start()
     payment_service = StubPaymentService()
-    init_horoscope_services(quota_service, ai_resolution.service, payment_service, mode=ai_resolution.mode)
+    init_horoscope_services(
+        quota_service,
+        ai_pipeline.service,
+        payment_service,
+        mode=ai_pipeline.mode,
+        degradation=ai_pipeline.degradation,
+        signs=ai_pipeline.signs,
+        normalizer=RequestNormalizer(),
+        natal=natal,
+        cache=ai_pipeline.cache,
+    )
+    precompute: PrecomputeJob | None = None
+    if settings.precompute_enabled and ai_pipeline.signs is not None and primary:
+        generator: BatchGenerator | None = None
+        if settings.precompute_batch:
+            generator = BatchGenerator(resolve_batch_provider(), ai_pipeline.signs.cache, ledger=ai_pipeline.costs)
+        precompute = PrecomputeJob(ai_pipeline.signs, generator=generator)
+        await precompute.start()
 
-    if ai_resolution.mode == "stub":
+    if ai_pipeline.mode == "stub":
         logger.warning("AI работает в режиме STUB, подключение OpenAI отключено или недоступно")
 
-    bot = Bot(token=settings.bot_token, parse_mode=ParseMode.HTML)
-    dp = Dispatcher(storage=MemoryStorage())
+    bot = Bot(
+        token=settings.bot_token,
+        session=http_clients.telegram(),
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+    )
+    storage: BaseStorage
+    if settings.fsm_storage == "memory":
+        storage = MemoryStorage()
+    else:
+        # Another worker may have changed the session, so each read goes to the database.
+        storage = SQLiteStorage(db, cache_size=0 if shared else None)
+        if primary:
+            await storage.start()
+    dp = Dispatcher(storage=storage)
     dp.include_router(setup_routers())
 
     @dp.errors()
@@ -62,10 +141,67 @@ async def main() -> None:
                     logger.exception("Failed to send error message to user")
         return True
 
-    await bot.delete_webhook(drop_pending_updates=True)
-    logger.info("Starting polling")
-    await dp.start_polling(bot)
+    try:
+        if webhook_secret is None:
+            await bot.delete_webhook(drop_pending_updates=True)
+            logger.info("Starting polling")
+            await dp.start_polling(bot)
+        else:
+            if primary:
+                await register_webhook(bot, webhook_secret, dp.resolve_used_update_types())
+            await serve_webhook(dp, bot, webhook_secret, worker, workers)
+    finally:
+        if precompute is not None:
+            await precompute.stop()
+        await maintenance.stop()
+        await storage.close()
+        if isinstance(storage, SQLiteStorage):
+            logger.info("FSM storage: %s", storage.stats())
+        await log_writer.stop()
+        logger.info("Known users cache: %s", known_users.stats())
+        logger.info("AI pipeline: %s", ai_pipeline.stats())
+        if ai_pipeline.costs is not None:
+            await ai_pipeline.costs.stop()
+        if natal is not None:
+            logger.info("Natal engine: %s", natal.stats())
+            natal.close()
+        logger.info("Gazetteer: %s", gazetteer.stats())
+        gazetteer.close()
+        await http_clients.close()
+        if quota_ledger is not None:
+            await quota_ledger.stop()
+        await db.close()
+
+
+def _webhook_worker(worker: int, workers: int, secret: str) -> None:
+    try:
+        asyncio.run(main(secret, worker, workers))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _migrate() -> None:
+    db = Database(settings.db_path)
+    await db.init()
+    await db.close()
+
+
+def run_webhook(workers: int | None = None) -> None:
+    """Serve updates through a webhook from ``WEBHOOK_WORKERS`` processes sharing one port."""
+
+    workers = effective_workers(workers)
+    # Every worker must accept the token Telegram sends; a random one is fine while nobody else needs it.
+    secret = settings.webhook_secret or secrets.token_urlsafe(32)
+    if workers == 1:
+        _webhook_worker(0, 1, secret)
+        return
+    # Migrations run once here, not concurrently in every worker.
+    asyncio.run(_migrate())
+    run_workers(_webhook_worker, workers, secret)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if "--webhook" in sys.argv:
+        run_webhook()
+    else:
+        asyncio.run(main())
@@ -26,6 +26,24 @@ def run_bot_cli() -> None:
     asyncio.run(main())
 
 
+def run_webhook_cli(workers: int | None = None) -> None:
+    from bot import run_webhook
+    from app.services.health import StartupError, perform_startup_checks
+
+    try:
+        perform_startup_checks()
+    except StartupError as exc:
+        print(f"Ошибка запуска бота: {exc}")
+        return
+    run_webhook(workers)
+
+
+def run_webhook_poster(count: int) -> None:
+    from app.tools.webhook_poster import main as poster_main
+
+    poster_main(["--count", str(count)])
+
+
 def run_test_ai() -> None:
     req = HoroscopeRequest(
         mode="Прогноз на сегодня",
@@ -58,6 +76,108 @@ def print_env() -> None:
     print("Overrides:", runtime_config.overrides_path)
 
 
+def run_maintenance_cli(vacuum: bool = False) -> None:
+    from app.config.settings import settings
+    from app.db.maintenance import enable_incremental_vacuum, run_maintenance
+    from app.db.storage import Database
+
+    async def _run() -> None:
+        db = Database(settings.db_path)
+        await db.init()
+        try:
+            report = await run_maintenance(db)
+        finally:
+            await db.close()
+        print(
+            f"Свёрнуто строк requests_log: {report.rolled_up} (пачек: {report.chunks}), "
+            f"удалено устаревших ответов из кэша: {report.expired_cache}, освобождено страниц: {report.freed_pages}"
+        )
+        if vacuum:
+            print("Перестраиваю БД с auto_vacuum=INCREMENTAL (VACUUM)...")
+            await enable_incremental_vacuum(settings.db_path)
+
+    asyncio.run(_run())
+
+
+def run_precompute_cli(batch: bool = False) -> None:
+    from app.config.settings import settings
+    from app.db.storage import Database
+    from app.services.ai_pipeline import build_ai_pipeline
+    from app.services.batch import FINAL_STATES, BatchGenerator, resolve_batch_provider
+
+    async def _run() -> None:
+        db = Database(settings.db_path)
+        await db.init()
+        try:
+            pipeline = build_ai_pipeline(db)
+            if pipeline.signs is None:
+                print("Кэш ответов выключен (RESPONSE_CACHE_ENABLED=false), сохранять прогнозы некуда.")
+                return
+            print(f"AI mode: {pipeline.mode}")
+            if pipeline.costs is not None:
+                await pipeline.costs.start()
+            try:
+                if batch:
+                    generator = BatchGenerator(resolve_batch_provider(), pipeline.signs.cache, ledger=pipeline.costs)
+                    batch_report = await pipeline.signs.precompute_batch(generator)
+                else:
+                    report = await pipeline.signs.precompute()
+            finally:
+                if pipeline.costs is not None:
+                    await pipeline.costs.stop()
+        finally:
+            await db.close()
+        if not batch:
+            print(
+                f"Прогнозы по знакам: всего {report.total}, сгенерировано {report.generated}, "
+                f"уже в кэше {report.cached}, ошибок {report.failed}"
+            )
+        elif not batch_report.batch_id:
+            print("Все прогнозы по знакам уже в кэше, пакет не нужен")
+        else:
+            print(
+                f"Пакет {batch_report.batch_id}: {batch_report.state}, запросов {batch_report.submitted}, "
+                f"сохранено {batch_report.ingested}, ошибок {batch_report.failed}, устарело {batch_report.expired}"
+            )
+            if batch_report.state not in FINAL_STATES:
+                print("Пакет ещё выполняется: запустите команду позже, она продолжит ожидание.")
+
+    asyncio.run(_run())
+
+
+def run_costs_cli() -> None:
+    from datetime import datetime, timezone
+
+    from app.config.settings import settings
+    from app.db.storage import Database
+    from app.services.cost_ledger import CostLedger
+
+    async def _run() -> None:
+        db = Database(settings.db_path)
+        await db.init()
+        try:
+            ledger = CostLedger(db)
+            await ledger.load()
+        finally:
+            await db.close()
+        now = datetime.now(timezone.utc)
+        day, month = now.strftime("%Y-%m-%d"), now.strftime("%Y-%m")
+        print(f"Расход AI сегодня (UTC): ${ledger.spent(day):.4f}, за месяц: ${ledger.spent(month):.4f}")
+        print(
+            f"Бюджеты: день {ledger.daily_budget_usd or 'выкл'}, месяц {ledger.monthly_budget_usd or 'выкл'}, "
+            f"по сегментам {ledger.segment_budgets or 'нет'}"
+        )
+        for group, items in ledger.breakdown(month).items():
+            print(f"За месяц по {group}:")
+            for key, summary in sorted(items.items(), key=lambda item: -item[1]["cost_usd"]):
+                print(
+                    f"  {key or '-'}: ${summary['cost_usd']}, запросов {summary['requests']}, "
+                    f"в среднем {summary['avg_prompt_tokens']} + {summary['avg_completion_tokens']} токенов"
+                )
+
+    asyncio.run(_run())
+
+
 def run_selftest() -> None:
     """Запуск встроенного набора проверок без GUI."""
 
@@ -83,14 +203,34 @@ def run_selftest() -> None:
 def main() -> None:
     parser = argparse.ArgumentParser(description="GOROSKOPE launcher")
     parser.add_argument("--run-bot", action="store_true", help="Запустить бота без GUI")
+    parser.add_argument("--webhook", action="store_true", help="Запустить бота в режиме вебхука (aiohttp)")
+    parser.add_argument("--workers", type=int, help="С --webhook: число процессов (по умолчанию WEBHOOK_WORKERS)")
+    parser.add_argument(
+        "--webhook-poster", type=int, metavar="N", help="Отправить N тестовых обновлений на локальный вебхук"
+    )
     parser.add_argument("--test-ai", action="store_true", help="Проверить AI и промпт")
     parser.add_argument("--print-env", action="store_true", help="Показать настройки")
     parser.add_argument("--selftest", action="store_true", help="Запустить самопроверку")
+    parser.add_argument("--maintenance", action="store_true", help="Свернуть старые логи и сжать БД")
+    parser.add_argument("--precompute", action="store_true", help="Заранее сгенерировать прогнозы по знакам")
+    parser.add_argument("--costs", action="store_true", help="Показать расход токенов и денег на AI")
+    parser.add_argument(
+        "--batch", action="store_true", help="С --precompute: через пакетный Batch API (дешевле, без спешки)"
+    )
+    parser.add_argument(
+        "--vacuum", action="store_true", help="С --maintenance: однократно включить инкрементальный VACUUM"
+    )
     args = parser.parse_args()
 
     if args.run_bot:
         run_bot_cli()
         return
+    if args.webhook:
+        run_webhook_cli(args.workers)
+        return
+    if args.webhook_poster:
+        run_webhook_poster(args.webhook_poster)
+        return
     if args.test_ai:
         run_test_ai()
         return
@@ -100,6 +240,15 @@ def main() -> None:
     if args.selftest:
         run_selftest()
         return
+    if args.maintenance:
+        run_maintenance_cli(vacuum=args.vacuum)
+        return
+    if args.precompute:
+        run_precompute_cli(batch=args.batch)
+        return
+    if args.costs:
+        run_costs_cli()
+        return
 
     setup_launcher_logging()
     try:
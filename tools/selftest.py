@@ -1,23 +1,87 @@
 from __future__ import annotations
 
 import asyncio
-from dataclasses import dataclass
+import shutil
+from dataclasses import asdict, dataclass
+from datetime import date, datetime, time, timezone
 from pathlib import Path
 from typing import Iterable
+from zoneinfo import ZoneInfo
 
+from aiogram import Bot, Dispatcher, Router
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.types import Message
+
+from app.config.settings import settings
+from app.core import texts
+from app.core.validators import validate_date, validate_time
 from app.core.keyboards import (
     focus_kb,
     gender_kb,
     horoscope_menu_kb,
     limit_kb,
     main_menu_kb,
+    place_suggestions_kb,
     result_kb,
     time_known_kb,
 )
 from app.core.router import setup_routers
+from app.core.states import HoroscopeStates
+from app.db.maintenance import rollup_requests_log
+from app.db.migrations import latest_version
 from app.db.storage import Database
-from app.services.prompt_builder import HoroscopeRequest, build_horoscope_prompt
+from app.modules.horoscope import handlers as horoscope_handlers
+from app.modules.natal import ephemeris
+from app.modules.natal.engine import NatalEngine, NatalInput
+from app.services.ai_scheduler import AIScheduler
+from app.services.ai_pipeline import build_ai_pipeline
+from app.services.ai_service import (
+    STUB_RESPONSE,
+    AIResolution,
+    AIService,
+    AIServiceError,
+    FakeAIService,
+    StubAIService,
+)
+from app.services.batch import BatchGenerator, LocalBatchProvider
+from app.services.circuit_breaker import (
+    STATE_CLOSED,
+    STATE_OPEN,
+    CircuitBreakerAIService,
+    CircuitGateAIService,
+    read_circuit_state,
+)
+from app.services.cost_ledger import CostAccountingAIService, CostGateAIService, CostLedger
+from app.services.degradation import LEVEL_ETA, LEVEL_NORMAL, DegradationController
+from app.services.fsm_storage import SQLiteStorage, decode_data, encode_data
+from app.services.gazetteer import Gazetteer, build_index
+from app.services.http_clients import HttpClients
+from app.services.normalizer import Place, RequestNormalizer
+from app.services.prompt_builder import (
+    MODE_NATAL,
+    MODE_TODAY,
+    MODE_WEEK,
+    BuiltPrompt,
+    HoroscopeRequest,
+    TokenUsage,
+    build_horoscope_prompt,
+    build_sign_prompt,
+    prompt_hash,
+    zodiac_sign,
+)
+from app.services.hedging import HedgingAIService
+from app.services.known_users import KnownUsers
+from app.services.precompute import PRECOMPUTE_MODES, SignHoroscopes, seconds_until, sign_matrix
+from app.services.payment_service import StubPaymentService
+from app.services.quota_ledger import QuotaLedger
 from app.services.quota_service import QuotaService
+from app.services.request_log_writer import RequestLogWriter
+from app.services.response_cache import CachingAIService, ResponseCache, cache_expiry
+from app.services.retry_policy import ERROR_OTHER, ERROR_SERVER, RetryPolicy, parse_retry_after
+from app.services.single_flight import SingleFlightAIService
+from app.services.webhook import build_webhook_app, start_webhook_site
+from app.tools.webhook_poster import post_updates
 
 HANDLED_CALLBACKS: set[str] = {
     "menu_horoscope",
@@ -42,9 +106,62 @@ HANDLED_CALLBACKS: set[str] = {
     "limit_sub",
     "back_horoscope",
     "regen",
+    "place_0",
+    "place_1",
+    "place_keep",
 }
 
 
+class CountingAIService(AIService):
+    """Offline AI double that counts calls and optionally waits before answering."""
+
+    def __init__(self, delay: float = 0.0) -> None:
+        self.calls = 0
+        self.delay = delay
+        self.active = 0
+        self.max_active = 0
+
+    async def generate(self, prompt: BuiltPrompt) -> str:
+        self.calls += 1
+        call_number = self.calls
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            if self.delay:
+                await asyncio.sleep(self.delay)
+        finally:
+            self.active -= 1
+        return f"ответ #{call_number}"
+
+
+@dataclass
+class FakeUser:
+    id: int
+
+
+class FakeMessage:
+    """Bot message double for driving handlers offline: records texts instead of calling Telegram."""
+
+    def __init__(self) -> None:
+        self.texts: list[str] = []
+
+    async def edit_text(self, text: str, **_: object) -> None:
+        self.texts.append(text)
+
+    async def answer(self, text: str, **_: object) -> None:
+        self.texts.append(text)
+
+
+class FakeCallback:
+    def __init__(self, user_id: int, data: str, message: FakeMessage) -> None:
+        self.from_user = FakeUser(user_id)
+        self.data = data
+        self.message = message
+
+    async def answer(self, *_: object, **__: object) -> None:
+        return None
+
+
 @dataclass
 class TestResult:
     name: str
@@ -60,6 +177,7 @@ def gather_keyboard_callbacks() -> set[str]:
         time_known_kb(),
         gender_kb(),
         focus_kb(),
+        place_suggestions_kb(["Москва", "Минск"]),
         limit_kb(),
         result_kb(),
     ]:
@@ -117,16 +235,1149 @@ async def check_quota_service() -> None:
     db = Database(str(db_path))
     await db.init()
     qs = QuotaService(db, free_quota=2)
-    await qs.ensure_user(42)
-    before = await qs.get_free_left(42)
-    if before != 2:
-        raise AssertionError(f"Ожидалось 2 свободных запроса, получено {before}")
-    consumed = await qs.consume_one(42)
-    if not consumed:
-        raise AssertionError("Не удалось списать квоту")
-    after = await qs.get_free_left(42)
-    if after != 1:
-        raise AssertionError(f"Неверный остаток квоты: {after}")
+    try:
+        await qs.ensure_user(42)
+        before = await qs.get_free_left(42)
+        if before != 2:
+            raise AssertionError(f"Ожидалось 2 свободных запроса, получено {before}")
+        consumed = await qs.consume_one(42)
+        if not consumed:
+            raise AssertionError("Не удалось списать квоту")
+        after = await qs.get_free_left(42)
+        if after != 1:
+            raise AssertionError(f"Неверный остаток квоты: {after}")
+    finally:
+        await db.close()
+
+
+async def check_quota_reservation() -> None:
+    tmp_dir = Path("logs")
+    tmp_dir.mkdir(exist_ok=True)
+    db_path = tmp_dir / "selftest-reserve.db"
+    if db_path.exists():
+        db_path.unlink()
+    db = Database(str(db_path))
+    await db.init()
+    qs = QuotaService(db, free_quota=1)
+    try:
+        reservation = await qs.reserve(7)
+        if reservation is None or reservation.remaining != 0:
+            raise AssertionError(f"Неверная резервация: {reservation}")
+        if await qs.reserve(7) is not None:
+            raise AssertionError("Резервация прошла при нулевом балансе")
+        if not await qs.release(reservation):
+            raise AssertionError("Возврат по резервации не выполнен")
+        if await qs.release(reservation):
+            raise AssertionError("Повторный возврат по той же резервации")
+        left = await qs.get_free_left(7)
+        if left != 1:
+            raise AssertionError(f"После возврата ожидался баланс 1, получено {left}")
+        if reservation.tier != "free":
+            raise AssertionError(f"Новый пользователь должен быть в free-полосе: {reservation.tier}")
+        await qs.credit_paid(7, 3)
+        paid = await qs.reserve(7)
+        if paid is None or paid.tier != "paid" or paid.remaining != 3:
+            raise AssertionError(f"После оплаты ожидалась paid-резервация: {paid}")
+    finally:
+        await db.close()
+
+
+async def check_quota_ledger() -> None:
+    tmp_dir = Path("logs")
+    tmp_dir.mkdir(exist_ok=True)
+    db_path = tmp_dir / "selftest-ledger.db"
+    if db_path.exists():
+        db_path.unlink()
+    db = Database(str(db_path))
+    await db.init()
+    ledger = QuotaLedger(db, flush_interval_ms=60_000, flush_max_changes=1000, durability="batch")
+    await ledger.start()
+    qs = QuotaService(db, free_quota=3, ledger=ledger)
+    try:
+        first = await qs.reserve(11)
+        second = await qs.reserve(11)
+        if first is None or second is None or second.remaining != 1:
+            raise AssertionError("Леджер не списал квоту в памяти")
+        await qs.release(second)
+        row = await db.fetchone("SELECT free_left FROM quotas WHERE telegram_id = ?", (11,))
+        if row is None or int(row["free_left"]) != 3:
+            raise AssertionError("Леджер записал изменения до сброса")
+        await ledger.stop()
+        row = await db.fetchone("SELECT free_left FROM quotas WHERE telegram_id = ?", (11,))
+        if row is None or int(row["free_left"]) != 2:
+            raise AssertionError(f"После остановки ожидался баланс 2, получено {row['free_left'] if row else None}")
+
+        # An entry evicted between seeding and taking is reloaded from the table.
+        small = QuotaLedger(db, max_entries=1, durability="sync")
+        small.seed(11, 2)
+        small.seed(12, 3)
+        if small.is_loaded(11) or await small.take(11) != 1:
+            raise AssertionError("Вытесненная запись должна перечитываться из базы при списании")
+    finally:
+        await db.close()
+
+
+async def check_request_log_writer() -> None:
+    tmp_dir = Path("logs")
+    tmp_dir.mkdir(exist_ok=True)
+    db_path = tmp_dir / "selftest-log-writer.db"
+    if db_path.exists():
+        db_path.unlink()
+    db = Database(str(db_path))
+    await db.init()
+    writer = RequestLogWriter(db, max_queue=4, batch_size=3, flush_interval_ms=10)
+    await writer.start()
+    qs = QuotaService(db, log_writer=writer)
+    try:
+        for idx in range(10):
+            await qs.log_request(idx, "horoscope", "hs_today", f"hash-{idx}")
+        await writer.stop()
+        row = await db.fetchone("SELECT count(*) AS total FROM requests_log")
+        if row is None or int(row["total"]) != 10:
+            raise AssertionError(f"Ожидалось 10 строк в requests_log, получено {row['total'] if row else None}")
+    finally:
+        await db.close()
+
+
+async def check_migrations() -> None:
+    tmp_dir = Path("logs")
+    tmp_dir.mkdir(exist_ok=True)
+    db_path = tmp_dir / "selftest-migrations.db"
+    if db_path.exists():
+        db_path.unlink()
+    db = Database(str(db_path))
+    await db.init()
+    await db.init()
+    try:
+        row = await db.fetchone("PRAGMA user_version")
+        if row is None or int(row[0]) != latest_version():
+            raise AssertionError(f"user_version {row[0] if row else None} != {latest_version()}")
+        dead = await db.fetchall("SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ('places', 'cities')")
+        if dead:
+            raise AssertionError(f"В схеме остались таблицы старого справочника: {[item[0] for item in dead]}")
+        plan = await db.fetchall("EXPLAIN QUERY PLAN SELECT count(*) FROM requests_log WHERE telegram_id = ?", (1,))
+        details = " ".join(str(item["detail"]) for item in plan)
+        if "INDEX" not in details:
+            raise AssertionError(f"Запрос по telegram_id не использует индекс: {details}")
+    finally:
+        await db.close()
+
+
+async def check_log_rollup() -> None:
+    tmp_dir = Path("logs")
+    tmp_dir.mkdir(exist_ok=True)
+    db_path = tmp_dir / "selftest-rollup.db"
+    if db_path.exists():
+        db_path.unlink()
+    db = Database(str(db_path))
+    await db.init()
+    try:
+        async with db.connect() as conn:
+            await conn.executemany(
+                "INSERT INTO requests_log (telegram_id, module, action, prompt_hash, tier, created_at) "
+                "VALUES (?, 'horoscope', 'hs_today', 'h', 'free', ?)",
+                [(idx, "2020-01-01 10:00:00") for idx in range(7)] + [(99, "2999-01-01 10:00:00")],
+            )
+            await conn.commit()
+        report = await rollup_requests_log(db, horizon_days=30, chunk_size=3, pause=0)
+        if report.rolled_up != 7 or report.chunks != 3:
+            raise AssertionError(f"Неверный отчёт свёртки: {report}")
+        daily = await db.fetchone("SELECT requests FROM requests_daily WHERE day = '2020-01-01'")
+        remaining = await db.fetchone("SELECT count(*) AS total FROM requests_log")
+        if daily is None or int(daily["requests"]) != 7 or int(remaining["total"]) != 1:  # type: ignore[index]
+            raise AssertionError("Свёртка requests_log посчитана неверно")
+    finally:
+        await db.close()
+
+
+async def check_known_users() -> None:
+    tmp_dir = Path("logs")
+    tmp_dir.mkdir(exist_ok=True)
+    db_path = tmp_dir / "selftest-known.db"
+    if db_path.exists():
+        db_path.unlink()
+    db = Database(str(db_path))
+    await db.init()
+    try:
+        await QuotaService(db).ensure_user(5)
+        known = KnownUsers(max_size=10)
+        if await known.warm(db) != 1:
+            raise AssertionError("Кэш пользователей не прогрелся из БД")
+        qs = QuotaService(db, known_users=known)
+        await qs.ensure_user(5)
+        await qs.ensure_user(6)
+        await qs.ensure_user(6)
+        if known.hits != 2 or known.misses != 1:
+            raise AssertionError(f"Неверные счётчики кэша пользователей: {known.stats()}")
+    finally:
+        await db.close()
+
+
+async def check_response_cache() -> None:
+    zone = ZoneInfo(settings.response_cache_tz)
+    now = datetime(2024, 5, 15, 18, 30, tzinfo=zone)  # среда
+    today_expiry = datetime.fromtimestamp(cache_expiry(MODE_TODAY, now) or 0, zone)
+    if (today_expiry.day, today_expiry.hour) != (16, 0):
+        raise AssertionError(f"Дневной прогноз должен истекать в полночь: {today_expiry}")
+    if cache_expiry("Технический пинг", now) is not None:
+        raise AssertionError("Режим без TTL не должен кэшироваться")
+    # The week crosses the switch to summer time: Monday midnight has another UTC offset.
+    original_tz = settings.response_cache_tz
+    settings.response_cache_tz = "Europe/Berlin"
+    try:
+        berlin = ZoneInfo("Europe/Berlin")
+        week_expiry = datetime.fromtimestamp(
+            cache_expiry(MODE_WEEK, datetime(2024, 3, 27, 12, 0, tzinfo=berlin)) or 0, berlin
+        )
+    finally:
+        settings.response_cache_tz = original_tz
+    if (week_expiry.day, week_expiry.hour) != (1, 0):
+        raise AssertionError(f"Недельный прогноз должен истекать в полночь понедельника: {week_expiry}")
+
+    tmp_dir = Path("logs")
+    tmp_dir.mkdir(exist_ok=True)
+    db_path = tmp_dir / "selftest-cache.db"
+    if db_path.exists():
+        db_path.unlink()
+    db = Database(str(db_path))
+    await db.init()
+    try:
+        backend = CountingAIService()
+        service = CachingAIService(backend, ResponseCache(db), namespace="test")
+        prompt = BuiltPrompt(system_prompt="s", user_prompt="u", mode=MODE_TODAY)
+        first = await service.generate(prompt)
+        second = await service.generate(BuiltPrompt(system_prompt="s", user_prompt="u", mode=MODE_TODAY))
+        if first != second or backend.calls != 1:
+            raise AssertionError("Повторный запрос не обслужен из кэша")
+        regen = await service.generate(BuiltPrompt(system_prompt="s", user_prompt="u", mode=MODE_TODAY, fresh=True))
+        if backend.calls != 2 or regen == first:
+            raise AssertionError("Кнопка regen должна обходить кэш")
+        persisted = await CachingAIService(backend, ResponseCache(db), namespace="test").generate(prompt)
+        if persisted != regen or backend.calls != 2:
+            raise AssertionError("Ответ не сохранён в SQLite-кэше")
+    finally:
+        await db.close()
+
+
+async def check_single_flight() -> None:
+    backend = CountingAIService(delay=0.05)
+    service = SingleFlightAIService(backend)
+
+    def make_prompt() -> BuiltPrompt:
+        return BuiltPrompt(system_prompt="s", user_prompt="одинаковый", mode=MODE_TODAY)
+
+    tasks = [asyncio.create_task(service.generate(make_prompt())) for _ in range(5)]
+    await asyncio.sleep(0.01)
+    tasks[0].cancel()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    if not isinstance(results[0], asyncio.CancelledError):
+        raise AssertionError("Отменённый ожидающий должен получить CancelledError")
+    if any(result != "ответ #1" for result in results[1:]):
+        raise AssertionError(f"Остальные ожидающие не получили общий ответ: {results}")
+    if backend.calls != 1 or service.coalesced != 4:
+        raise AssertionError(f"Ожидался один вызов backend, статистика: {service.stats()}")
+
+    # A paid caller does not join a free flight (it would wait in the free lane); a free caller joins a paid one.
+    def lane_prompt(priority: str) -> BuiltPrompt:
+        prompt = make_prompt()
+        prompt.priority = priority
+        return prompt
+
+    free_first = await asyncio.gather(service.generate(lane_prompt("free")), service.generate(lane_prompt("paid")))
+    paid_first = await asyncio.gather(service.generate(lane_prompt("paid")), service.generate(lane_prompt("free")))
+    if len(set(free_first)) != 2 or len(set(paid_first)) != 1 or backend.calls != 4:
+        raise AssertionError(f"Неверное объединение по полосам: {free_first}, {paid_first}")
+
+    # A streaming leader that stops reading early must not break the callers who joined its flight.
+    streaming = SingleFlightAIService(StubAIService(chunk_delay=0.005))
+    leader = streaming.generate_stream(make_prompt())
+    await leader.__anext__()
+    joined = asyncio.create_task(streaming.generate(make_prompt()))
+    await asyncio.sleep(0.01)
+    await leader.aclose()
+    if await joined != STUB_RESPONSE:
+        raise AssertionError("Уход ведущего потока не должен обрывать присоединившихся")
+    alone = streaming.generate_stream(make_prompt())
+    await alone.__anext__()
+    await alone.aclose()
+    await asyncio.sleep(0.01)
+    if streaming.stats()["in_flight"]:
+        raise AssertionError("Поток без слушателей должен отменяться")
+
+
+async def check_streaming() -> None:
+    tmp_dir = Path("logs")
+    tmp_dir.mkdir(exist_ok=True)
+    db_path = tmp_dir / "selftest-stream.db"
+    if db_path.exists():
+        db_path.unlink()
+    db = Database(str(db_path))
+    await db.init()
+    try:
+        service = SingleFlightAIService(CachingAIService(StubAIService(chunk_delay=0), ResponseCache(db)))
+        prompt = BuiltPrompt(system_prompt="s", user_prompt="stream", mode=MODE_TODAY)
+        chunks = [chunk async for chunk in service.generate_stream(prompt)]
+        if len(chunks) < 2 or "".join(chunks) != STUB_RESPONSE:
+            raise AssertionError(f"Поток собран неверно: {chunks}")
+        cached = [chunk async for chunk in service.generate_stream(prompt)]
+        if cached != [STUB_RESPONSE]:
+            raise AssertionError("Повторный поток должен прийти из кэша одним куском")
+    finally:
+        await db.close()
+
+
+async def check_ai_scheduler() -> None:
+    backend = CountingAIService(delay=0.05)
+    scheduler = AIScheduler(
+        backend, max_concurrency=2, requests_per_minute=0, tokens_per_minute=0, max_queue=3, max_wait_s=5
+    )
+    prompts = [BuiltPrompt(system_prompt="s", user_prompt=str(idx)) for idx in range(6)]
+    results = await asyncio.gather(*(scheduler.generate(p) for p in prompts), return_exceptions=True)
+    rejected = [r for r in results if isinstance(r, AIServiceError)]
+    if backend.max_active > 2:
+        raise AssertionError(f"Превышен лимит параллельности: {backend.max_active}")
+    if len(rejected) != 1 or scheduler.rejected != 1:
+        raise AssertionError(f"Ожидался один отказ из-за переполнения очереди: {scheduler.stats()}")
+
+    slow = AIScheduler(
+        CountingAIService(delay=0.3), max_concurrency=1, requests_per_minute=0, tokens_per_minute=0, max_wait_s=0.05
+    )
+    outcome = await asyncio.gather(*(slow.generate(p) for p in prompts[:2]), return_exceptions=True)
+    if not isinstance(outcome[1], AIServiceError) or slow.timed_out != 1 or slow.active != 0:
+        raise AssertionError(f"Ожидался таймаут ожидания в очереди: {slow.stats()}")
+
+
+async def check_scheduler_lanes() -> None:
+    order: list[str] = []
+
+    class RecordingAIService(AIService):
+        async def generate(self, prompt: BuiltPrompt) -> str:
+            order.append(prompt.priority)
+            await asyncio.sleep(0.01)
+            return "ok"
+
+    scheduler = AIScheduler(
+        RecordingAIService(),
+        max_concurrency=1,
+        requests_per_minute=0,
+        tokens_per_minute=0,
+        max_queue=50,
+        max_wait_s=5,
+        weights={"paid": 3, "free": 1, "background": 1},
+        starvation_s=60,
+    )
+    prompts = [
+        BuiltPrompt(system_prompt="s", user_prompt=str(idx), priority=lane)
+        for idx, lane in enumerate(["free"] * 8 + ["paid"] * 8)
+    ]
+    await asyncio.gather(*(scheduler.generate(p) for p in prompts))
+    # The first free request takes the idle slot; after that paid gets ~3 of every 4 slots.
+    first_half = order[1:9]
+    if first_half.count("paid") < 5 or "free" not in order[1:13]:
+        raise AssertionError(f"Неожиданный порядок полос: {order}")
+
+    order.clear()
+    starving = AIScheduler(
+        RecordingAIService(),
+        max_concurrency=1,
+        requests_per_minute=0,
+        tokens_per_minute=0,
+        max_wait_s=5,
+        weights={"paid": 1000, "free": 1, "background": 1},
+        starvation_s=0.03,
+    )
+    prompts = [
+        BuiltPrompt(system_prompt="s", user_prompt=str(idx), priority=lane)
+        for idx, lane in enumerate(["paid", "free"] + ["paid"] * 10)
+    ]
+    await asyncio.gather(*(starving.generate(p) for p in prompts))
+    if order.index("free") > 6 or starving.starvation_promotions < 1:
+        raise AssertionError(f"Бесплатная полоса не получила слот: {order} {starving.stats()}")
+
+
+async def check_degradation() -> None:
+    if zodiac_sign("15.08.1990") != "Лев" or zodiac_sign("05.01.2000") != "Козерог":
+        raise AssertionError("Неверное определение знака зодиака")
+    req = HoroscopeRequest(
+        mode=MODE_TODAY,
+        birth_date="15.08.1990",
+        birth_time=None,
+        birth_place="Москва",
+        gender="gender_f",
+        focus="focus_love",
+    )
+    compact = build_horoscope_prompt(req, bullets=4, max_tokens=350)
+    if compact.max_tokens != 350 or "из 4 пунктов" not in compact.user_prompt:
+        raise AssertionError("Сокращённый промпт не применился")
+
+    tmp_dir = Path("logs")
+    tmp_dir.mkdir(exist_ok=True)
+    db_path = tmp_dir / "selftest-degrade.db"
+    if db_path.exists():
+        db_path.unlink()
+    db = Database(str(db_path))
+    await db.init()
+    try:
+        scheduler = AIScheduler(
+            CountingAIService(delay=0.1), max_concurrency=1, requests_per_minute=0, tokens_per_minute=0, max_wait_s=5
+        )
+        cache = CachingAIService(scheduler, ResponseCache(db), namespace="test")
+        controller = DegradationController(
+            scheduler, cache, depth_thresholds=(1, 2, 3), p95_thresholds=(100, 100, 100), cooldown_s=0
+        )
+        if controller.level() != LEVEL_NORMAL:
+            raise AssertionError("Без очереди деградации быть не должно")
+        prompts = [BuiltPrompt(system_prompt="s", user_prompt=str(idx)) for idx in range(4)]
+        tasks = [asyncio.create_task(scheduler.generate(p)) for p in prompts]
+        await asyncio.sleep(0.01)
+        if controller.level() != LEVEL_ETA:
+            raise AssertionError(f"Ожидался уровень ETA при очереди {scheduler.queue_depth}")
+
+        sign_prompt = build_sign_prompt("Лев", req.mode, req.focus, req.gender)
+        await cache.cache.put(cache.cache_key(sign_prompt), "гороскоп для Льва", MODE_TODAY, cache_expiry(MODE_TODAY) or 0)
+        if await controller.sign_cached(req) != "гороскоп для Льва":
+            raise AssertionError("Гороскоп по знаку не найден в кэше")
+        natal = HoroscopeRequest(**{**asdict(req), "mode": MODE_NATAL})
+        if await controller.sign_cached(natal) is not None or controller.sign_cache_misses != 0:
+            raise AssertionError("Для натальной карты кэш по знаку проверяться не должен")
+
+        await asyncio.gather(*tasks)
+        if controller.level() != LEVEL_NORMAL or not controller.changes:
+            raise AssertionError(f"Уровень не вернулся к норме: {controller.stats()}")
+    finally:
+        await db.close()
+
+
+async def check_circuit_breaker() -> None:
+    class FlakyAIService(AIService):
+        def __init__(self) -> None:
+            self.healthy = False
+            self.calls = 0
+
+        async def generate(self, prompt: BuiltPrompt) -> str:
+            self.calls += 1
+            if not self.healthy:
+                raise AIServiceError("OpenAI недоступен")
+            return "ok"
+
+    tmp_dir = Path("logs")
+    tmp_dir.mkdir(exist_ok=True)
+    state_path = tmp_dir / "selftest-circuit.json"
+    state_path.unlink(missing_ok=True)
+    backend = FlakyAIService()
+    breaker = CircuitBreakerAIService(
+        backend,
+        fallback=StubAIService(chunk_delay=0),
+        window=4,
+        min_calls=2,
+        error_rate=0.5,
+        open_s=0.05,
+        state_path=state_path,
+    )
+    if state_path.exists():
+        raise AssertionError("Предохранитель должен писать состояние только при переходах")
+    scheduler = AIScheduler(breaker, max_concurrency=1, requests_per_minute=0, tokens_per_minute=0)
+    gate = CircuitGateAIService(scheduler, breaker)
+    for idx in range(2):
+        try:
+            await breaker.generate(BuiltPrompt(system_prompt="s", user_prompt=str(idx)))
+        except AIServiceError:
+            pass
+    if breaker.state != STATE_OPEN or (read_circuit_state(state_path) or {}).get("state") != STATE_OPEN:
+        raise AssertionError(f"Цепь не разомкнулась после ошибок: {breaker.stats()}")
+    prompt = BuiltPrompt(system_prompt="s", user_prompt="fallback", mode=MODE_TODAY)
+    if await gate.generate(prompt) != STUB_RESPONSE or not prompt.fallback or backend.calls != 2:
+        raise AssertionError("При разомкнутой цепи ожидался ответ заглушки без обращения к AI")
+    if scheduler.admitted != 0:
+        raise AssertionError("При разомкнутой цепи запрос не должен проходить через очередь планировщика")
+
+    backend.healthy = True
+    await asyncio.sleep(0.06)
+    await breaker.generate(BuiltPrompt(system_prompt="s", user_prompt="probe"))
+    await asyncio.sleep(0.01)
+    if breaker.state != STATE_CLOSED or breaker.probes != 1:
+        raise AssertionError(f"Пробный healthcheck не замкнул цепь: {breaker.stats()}")
+    if await breaker.generate(BuiltPrompt(system_prompt="s", user_prompt="after")) != "ok":
+        raise AssertionError("После восстановления запросы должны идти в AI")
+
+
+async def check_retry_policy() -> None:
+    if parse_retry_after({"retry-after": "2"}) != 2 or parse_retry_after({"retry-after-ms": "250"}) != 0.25:
+        raise AssertionError("Retry-After разобран неверно")
+
+    class ProviderError(Exception):
+        def __init__(self, error_class: str, retry_after: float | None = None) -> None:
+            super().__init__(error_class)
+            self.error_class = error_class
+            self.hint = retry_after
+
+    def make_policy(**kwargs: float) -> RetryPolicy:
+        options = {"deadline_s": 1.0, "attempt_timeout_s": 1.0, "base_s": 0.01, "cap_s": 0.02, "max_attempts": 4}
+        options.update(kwargs)
+        return RetryPolicy(
+            lambda exc: getattr(exc, "error_class", ERROR_OTHER),
+            retry_after=lambda exc: getattr(exc, "hint", None),
+            **options,  # type: ignore[arg-type]
+        )
+
+    failures = [ProviderError(ERROR_SERVER), ProviderError("rate_limit", retry_after=0.05)]
+
+    async def flaky() -> str:
+        if failures:
+            raise failures.pop(0)
+        return "ok"
+
+    policy = make_policy()
+    started = asyncio.get_running_loop().time()
+    if await policy.run(flaky) != "ok":
+        raise AssertionError("Повтор не вернул результат")
+    if asyncio.get_running_loop().time() - started < 0.05:
+        raise AssertionError("Пауза Retry-After не соблюдена")
+    if policy.attempts != {"server": 1, "rate_limit": 1, "ok": 1}:
+        raise AssertionError(f"Неверные счётчики попыток: {policy.stats()}")
+
+    async def rejected() -> str:
+        raise ProviderError(ERROR_OTHER)
+
+    try:
+        await policy.run(rejected)
+    except ProviderError:
+        pass
+    if policy.attempts[ERROR_OTHER] != 1:
+        raise AssertionError("Неповторяемая ошибка не должна повторяться")
+
+    async def hanging() -> str:
+        await asyncio.sleep(5)
+        return "late"
+
+    slow_policy = make_policy(deadline_s=0.15, attempt_timeout_s=0.1)
+    started = asyncio.get_running_loop().time()
+    try:
+        await slow_policy.run(hanging)
+        raise AssertionError("Ожидался таймаут по дедлайну")
+    except asyncio.TimeoutError:
+        pass
+    if asyncio.get_running_loop().time() - started > 0.3:
+        raise AssertionError("Повторы вышли за пределы общего дедлайна")
+
+
+async def check_hedging() -> None:
+    def make_router(primary: FakeAIService, secondary: FakeAIService) -> HedgingAIService:
+        return HedgingAIService(
+            [primary, secondary], min_delay_s=0.05, initial_delay_s=0.05, min_samples=100, max_ratio=1.0
+        )
+
+    slow = FakeAIService("primary", slow_latency_s=1.0, slow_every=1)
+    fast = FakeAIService("secondary", latency_s=0.02)
+    router = make_router(slow, fast)
+    prompt = BuiltPrompt(system_prompt="s", user_prompt="hedge")
+    started = asyncio.get_running_loop().time()
+    answer = await router.generate(prompt)
+    if not answer.startswith("secondary") or asyncio.get_running_loop().time() - started > 0.5:
+        raise AssertionError(f"Хедж-запрос не ускорил ответ: {answer}")
+    if slow.cancelled != 1 or len(prompt.extra_usage) != 1 or router.hedged != 1:
+        raise AssertionError(f"Проигравший запрос не отменён или не учтён: {router.stats()}")
+
+    chunks = [chunk async for chunk in router.generate_stream(BuiltPrompt(system_prompt="s", user_prompt="stream"))]
+    if not "".join(chunks).startswith("secondary") or slow.cancelled != 2:
+        raise AssertionError(f"Хедж для потока не сработал: {chunks}")
+
+    broken = make_router(
+        FakeAIService("primary", latency_s=0.01, fail_every=1), FakeAIService("secondary", latency_s=0.01)
+    )
+    if not (await broken.generate(BuiltPrompt(system_prompt="s", user_prompt="x"))).startswith("secondary"):
+        raise AssertionError("Ошибка основного backend не передала запрос запасному")
+    if broken.failovers != 1 or broken.hedged != 0:
+        raise AssertionError(f"Неверная статистика переключения: {broken.stats()}")
+
+
+async def check_precompute() -> None:
+    if len(sign_matrix(PRECOMPUTE_MODES)) != 12 * 5 * 3 * 2:
+        raise AssertionError("Матрица прогнозов по знакам неполная")
+    if seconds_until("00:05", datetime(2024, 5, 15, 23, 0)) != 65 * 60:
+        raise AssertionError("Неверный расчёт времени следующего запуска")
+
+    tmp_dir = Path("logs")
+    tmp_dir.mkdir(exist_ok=True)
+    db_path = tmp_dir / "selftest-precompute.db"
+    if db_path.exists():
+        db_path.unlink()
+    db = Database(str(db_path))
+    await db.init()
+    try:
+        backend = CountingAIService()
+        signs = SignHoroscopes(CachingAIService(backend, ResponseCache(db), namespace="test"), modes=(MODE_TODAY,))
+        report = await signs.precompute(concurrency=8)
+        if report.total != 180 or report.generated != 180 or backend.calls != 180:
+            raise AssertionError(f"Матрица не сгенерирована: {report}")
+        again = await signs.precompute(concurrency=8)
+        if again.cached != 180 or backend.calls != 180:
+            raise AssertionError(f"Повторный прогон должен брать всё из кэша: {again}")
+        req = HoroscopeRequest(
+            mode=MODE_TODAY,
+            birth_date="15.08.1990",
+            birth_time="10:00",
+            birth_place="Казань",
+            gender="gender_m",
+            focus="focus_money",
+        )
+        if not (await signs.lookup(req) or "").startswith("ответ #"):
+            raise AssertionError("Запрос не обслужен из матрицы по знаку")
+    finally:
+        await db.close()
+
+
+async def check_batch_precompute() -> None:
+    tmp_dir = Path("logs")
+    tmp_dir.mkdir(exist_ok=True)
+    work_dir = tmp_dir / "selftest-batch"
+    shutil.rmtree(work_dir, ignore_errors=True)
+    db_path = tmp_dir / "selftest-batch.db"
+    if db_path.exists():
+        db_path.unlink()
+    db = Database(str(db_path))
+    await db.init()
+    try:
+        backend = CountingAIService()
+        signs = SignHoroscopes(CachingAIService(backend, ResponseCache(db), namespace="test"), modes=(MODE_TODAY,))
+        provider = LocalBatchProvider(
+            work_dir / "provider", responder=lambda body: "пакетный ответ", polls_to_complete=2
+        )
+        ledger = CostLedger(db, prices={"local": (1000.0, 1000.0)}, segment_budgets={})
+        generator = BatchGenerator(provider, signs.cache, work_dir=work_dir, poll_interval_s=0.01, ledger=ledger)
+        first = await signs.precompute_batch(generator, max_wait_s=0)
+        if first.state != "in_progress" or first.submitted != 180 or first.ingested:
+            raise AssertionError(f"Пакет должен быть отправлен и ещё выполняться: {first}")
+        resumed = await signs.precompute_batch(generator, max_wait_s=1)
+        if resumed.batch_id != first.batch_id or resumed.ingested != 180 or provider.submitted != 1:
+            raise AssertionError(f"Повторный запуск должен дождаться того же пакета: {resumed}")
+        row = await db.fetchone(
+            "SELECT COUNT(*), SUM(prompt_tokens), SUM(completion_tokens), SUM(cost_usd) FROM ai_usage"
+        )
+        if row[0] != 180 or not row[1] or abs(row[3] - (row[1] + row[2]) * 1000 / 1_000_000 / 2) > 1e-9:
+            raise AssertionError(f"Расход пакета должен попасть в учёт по половинной цене: {tuple(row)}")
+        again = await signs.precompute_batch(generator, max_wait_s=1)
+        if again.batch_id or provider.submitted != 1 or backend.calls != 0:
+            raise AssertionError(f"Готовая матрица не должна отправляться заново: {again}")
+        req = HoroscopeRequest(
+            mode=MODE_TODAY,
+            birth_date="01.04.1990",
+            birth_time=None,
+            birth_place="Омск",
+            gender="gender_o",
+            focus="focus_health",
+        )
+        if await signs.lookup(req) != "пакетный ответ":
+            raise AssertionError("Результат пакета не попал в кэш ответов")
+
+        # A rejected line lands in the error file; an ingest cut short is redone without billing twice.
+        answered: list[dict[str, object]] = []
+
+        def picky(body: dict[str, object]) -> str:
+            answered.append(body)
+            if len(answered) == 2:
+                raise ValueError("invalid max_tokens")
+            return "пакетный ответ"
+
+        retry_cache = CachingAIService(backend, ResponseCache(db), namespace="retry")
+        retry = BatchGenerator(
+            LocalBatchProvider(work_dir / "retry-provider", responder=picky),
+            retry_cache,
+            work_dir=work_dir / "retry",
+            poll_interval_s=0.01,
+            ledger=ledger,
+        )
+        store = retry_cache.cache.put
+        puts = 0
+
+        async def interrupted_put(*args: object) -> None:
+            nonlocal puts
+            puts += 1
+            if puts == 5:
+                raise RuntimeError("бот остановлен")
+            await store(*args)
+
+        retry_cache.cache.put = interrupted_put  # type: ignore[method-assign]
+        try:
+            await retry.run("retry", signs.prompts()[:10], max_wait_s=1)
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError("Прерванная загрузка пакета должна завершиться ошибкой")
+        rows = await db.fetchone("SELECT COUNT(*) FROM ai_usage")
+        if rows[0] != 180:
+            raise AssertionError(f"Прерванная загрузка не должна учитывать расход: {rows[0]}")
+        redone = await retry.run("retry", signs.prompts()[:10], max_wait_s=1)
+        rows = await db.fetchone("SELECT COUNT(*) FROM ai_usage")
+        if redone.ingested != 9 or redone.failed != 1 or rows[0] != 189:
+            raise AssertionError(f"Пакет должен загрузиться один раз, без отклонённой строки: {redone}, {rows[0]}")
+    finally:
+        await db.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+async def check_cost_ledger() -> None:
+    tmp_dir = Path("logs")
+    tmp_dir.mkdir(exist_ok=True)
+    db_path = tmp_dir / "selftest-costs.db"
+    if db_path.exists():
+        db_path.unlink()
+    db = Database(str(db_path))
+    await db.init()
+    try:
+        # 1000 $ per million tokens: every token costs a tenth of a cent.
+        prices = {"fake": (1000.0, 1000.0)}
+        ledger = CostLedger(db, prices=prices, daily_budget_usd=0.05, monthly_budget_usd=0, segment_budgets={})
+        service = CostAccountingAIService(FakeAIService(latency_s=0), ledger)
+        req = HoroscopeRequest(
+            mode=MODE_TODAY,
+            birth_date="01.04.1990",
+            birth_time=None,
+            birth_place="Омск",
+            gender="gender_o",
+            focus="focus_love",
+        )
+        first = build_horoscope_prompt(req)
+        await service.generate(first)
+        if first.fallback or ledger.recorded != 1:
+            raise AssertionError("Первый запрос должен уйти в модель и быть учтён")
+        second = build_horoscope_prompt(req)
+        if await service.generate(second) != STUB_RESPONSE or not second.fallback or ledger.blocked != 1:
+            raise AssertionError("После исчерпания дневного бюджета должен отвечать stub")
+        scheduler = AIScheduler(service, max_concurrency=1, requests_per_minute=0, tokens_per_minute=0)
+        gated = build_horoscope_prompt(req)
+        if await CostGateAIService(scheduler, service).generate(gated) != STUB_RESPONSE or not gated.fallback:
+            raise AssertionError("Сверх бюджета шлюз должен сразу отвечать stub")
+        if scheduler.admitted != 0 or ledger.blocked != 2:
+            raise AssertionError("Сверх бюджета запрос не должен вставать в очередь планировщика")
+        row = await db.fetchone(
+            "SELECT prompt_tokens, completion_tokens, model, focus, cost_usd FROM ai_usage WHERE prompt_hash = ?",
+            (prompt_hash(first),),
+        )
+        if row is None or row[2] != "fake" or row[3] != "focus_love" or row[4] <= 0.05:
+            raise AssertionError(f"Строка ai_usage записана неверно: {tuple(row) if row else None}")
+
+        reloaded = CostLedger(db, prices=prices, daily_budget_usd=0, monthly_budget_usd=0.05, segment_budgets={})
+        await reloaded.load()
+        if reloaded.exhausted(build_horoscope_prompt(req)) != "monthly":
+            raise AssertionError("Месячный бюджет должен учитывать расход, сохранённый в БД")
+        segments = CostLedger(
+            db, prices=prices, daily_budget_usd=0, monthly_budget_usd=0, segment_budgets={"focus_love": 0.05}
+        )
+        await segments.load()
+        money = build_horoscope_prompt(HoroscopeRequest(**{**asdict(req), "focus": "focus_money"}))
+        if segments.exhausted(build_horoscope_prompt(req)) != "focus_love" or segments.exhausted(money):
+            raise AssertionError("Лимит по фокусу должен закрывать только свой фокус")
+        breakdown = segments.breakdown(datetime.now(timezone.utc).strftime("%Y-%m"))
+        if breakdown["focus"]["focus_love"]["requests"] != 1:
+            raise AssertionError(f"Неверная разбивка по фокусу: {breakdown}")
+
+        # Another webhook worker spends the same budgets: a shared ledger picks that up after its flush.
+        month = datetime.now(timezone.utc).strftime("%Y-%m")
+        peer = CostLedger(db, prices=prices, segment_budgets={}, flush_interval_ms=10, shared=True)
+        await peer.start()
+        try:
+            before = peer.spent(month)
+            await segments.record_usage("other-worker", MODE_TODAY, "focus_love", TokenUsage(10, 10, "fake"))
+            await asyncio.sleep(0.1)
+            if abs(peer.spent(month) - before - 0.02) > 1e-9:
+                raise AssertionError(f"Общий учёт не увидел расход другого процесса: {peer.spent(month)}")
+        finally:
+            await peer.stop()
+        pipeline = build_ai_pipeline(db, AIResolution(FakeAIService(latency_s=0), mode="test"), workers=4)
+        if pipeline.costs is None or not pipeline.costs.shared:
+            raise AssertionError("При нескольких процессах бюджеты должны считаться по общей БД")
+        share = settings.ai_requests_per_minute // 4
+        if pipeline.scheduler is None or pipeline.scheduler.request_bucket.capacity != share:
+            raise AssertionError("Каждый из 4 процессов должен получить четверть лимита запросов к OpenAI")
+    finally:
+        await db.close()
+
+
+async def check_normalizer() -> None:
+    if validate_date(" 1.1.1990") != date(1990, 1, 1) or validate_date("31.02.1990") is not None:
+        raise AssertionError("validate_date должен возвращать дату и отклонять несуществующие")
+    if validate_time("9:05") != time(9, 5) or validate_time("24:00") is not None:
+        raise AssertionError("validate_time должен возвращать время и отклонять неверное")
+    tmp_dir = Path("logs")
+    tmp_dir.mkdir(exist_ok=True)
+    places = Gazetteer(path=str(tmp_dir / "selftest-gazetteer.sqlite"))
+    try:
+        normalizer = RequestNormalizer(places)
+        variants = [
+            ("01.01.1990", "09:05", "Москва"),
+            ("1.1.1990", "9:05", "москва "),
+            ("1/1/1990", "09.05", "г. Москва"),
+            ("01-01-1990", "9 05", "Москва, Россия"),
+        ]
+        canonical = []
+        for birth_date, birth_time, place in variants:
+            req = HoroscopeRequest(MODE_TODAY, birth_date, birth_time, place, "gender_f", "focus_love")
+            result = await normalizer.normalize(req)
+            if result is None:
+                raise AssertionError(f"Запрос не нормализован: {req}")
+            canonical.append(result)
+        if len({item.key for item in canonical}) != 1:
+            raise AssertionError(f"Разные ключи для одного запроса: {[item.key for item in canonical]}")
+        prompts = {prompt_hash(build_horoscope_prompt(item.to_request())) for item in canonical}
+        if len(prompts) != 1 or canonical[0].sign != "Козерог" or not canonical[0].place.known:
+            raise AssertionError("Канонические запросы должны давать один промпт, знак и известное место")
+        spb = await normalizer.place("Питер")
+        if spb.name != "Санкт-Петербург" or not spb.known or spb.tz != "Europe/Moscow":
+            raise AssertionError(f"Синоним города не найден в справочнике: {spb}")
+        if await normalizer.place("  пгт   ильский ") != Place("Ильский"):
+            raise AssertionError("Неизвестное место должно приводиться к аккуратному виду")
+        if await normalizer.suggest("Москва") or not await normalizer.suggest("Масква"):
+            raise AssertionError("Подсказки нужны только для незнакомых мест")
+    finally:
+        places.close()
+
+
+def check_gazetteer() -> None:
+    tmp_dir = Path("logs")
+    tmp_dir.mkdir(exist_ok=True)
+    index_path = tmp_dir / "selftest-gazetteer.sqlite"
+    index_path.unlink(missing_ok=True)
+    places = Gazetteer(path=str(index_path))
+    try:
+        if places._conn is not None or index_path.exists():
+            raise AssertionError("Справочник не должен загружаться до первого поиска")
+        ekb = places.lookup("Свердловск")
+        if ekb is None or ekb.name != "Екатеринбург" or ekb.tz != "Asia/Yekaterinburg":
+            raise AssertionError(f"Старое название не найдено: {ekb}")
+        if places.lookup("Кёнигсберг") != places.lookup("kaliningrad") or places.lookup("Атлантида"):
+            raise AssertionError("Точный поиск должен учитывать варианты написания и не угадывать")
+        prefix = [place.name for place in places.complete("ново", 3)]
+        if prefix[:2] != ["Новосибирск", "Новокузнецк"]:
+            raise AssertionError(f"Поиск по префиксу должен сортировать по населению: {prefix}")
+        for typo, expected in (("Масква", "Москва"), ("Новосибирк", "Новосибирск"), ("Екатеренбург", "Екатеринбург")):
+            found = places.suggest(typo)
+            if not found or found[0].name != expected:
+                raise AssertionError(f"Для «{typo}» ожидалась подсказка {expected}: {found}")
+        if places.suggest("Щщщщщщ"):
+            raise AssertionError("Для бессмыслицы подсказок быть не должно")
+        if places.stats()["avg_lookup_us"] > 5000:
+            raise AssertionError(f"Поиск слишком медленный: {places.stats()}")
+        # A stale index (different digest) is rebuilt on the next open.
+        places.close()
+        build_index(places.source, index_path, "stale")
+        if places.lookup("Москва") is None or places._index_digest() != places._digest():
+            raise AssertionError("Устаревший индекс должен пересобираться")
+    finally:
+        places.close()
+
+
+async def check_fsm_storage() -> None:
+    last_request = {"mode": MODE_TODAY, "birth_date": "01.01.1990", "birth_place": "Санкт-Петербург" * 20}
+    packed = encode_data({"last_request": last_request})
+    if decode_data(packed) != {"last_request": last_request} or packed[:1] != b"z" or encode_data({}) is not None:
+        raise AssertionError("Данные FSM должны сжиматься и читаться обратно без потерь")
+
+    tmp_dir = Path("logs")
+    tmp_dir.mkdir(exist_ok=True)
+    db_path = tmp_dir / "selftest-fsm.db"
+    if db_path.exists():
+        db_path.unlink()
+    db = Database(str(db_path))
+    await db.init()
+    try:
+        keys = [StorageKey(bot_id=1, chat_id=user, user_id=user) for user in range(1, 6)]
+        storage = SQLiteStorage(db, cache_size=2, sweep_interval_min=0)
+        await storage.set_state(keys[0], HoroscopeStates.waiting_for_regeneration)
+        await storage.update_data(keys[0], {"last_request": last_request})
+        for key in keys[1:]:
+            await storage.update_data(key, {"mode": MODE_TODAY})
+        if len(storage._cache) != 2:
+            raise AssertionError(f"LRU должен быть ограничен: {storage.stats()}")
+
+        # A new instance is what the bot sees after a restart.
+        restarted = SQLiteStorage(db, cache_size=2, sweep_interval_min=0)
+        if await restarted.get_state(keys[0]) != HoroscopeStates.waiting_for_regeneration.state:
+            raise AssertionError("Состояние должно пережить перезапуск")
+        if (await restarted.get_data(keys[0])).get("last_request") != last_request:
+            raise AssertionError("last_request должен пережить перезапуск")
+
+        # A write that reaches the database late must not overwrite a newer one.
+        await db.execute(
+            "INSERT INTO fsm_sessions (session_key, state, data, updated_ns) "
+            "VALUES ('1:1:1:::default', NULL, NULL, 1) "
+            "ON CONFLICT(session_key) DO UPDATE SET state = excluded.state, data = excluded.data, "
+            "updated_ns = excluded.updated_ns WHERE excluded.updated_ns > fsm_sessions.updated_ns"
+        )
+        if await SQLiteStorage(db, cache_size=0).get_state(keys[0]) is None:
+            raise AssertionError("Устаревшая запись перезаписала новую")
+
+        await restarted.set_state(keys[1], None)
+        await restarted.set_data(keys[1], {})
+        idle = SQLiteStorage(db, cache_size=0, ttl_days=0, sweep_batch=2)
+        if await idle.get_data(keys[2]):
+            raise AssertionError("Сессия старше TTL должна читаться как пустая")
+        removed = await idle.sweep(pause=0)
+        row = await db.fetchone("SELECT count(*) FROM fsm_sessions")
+        if removed != 5 or row[0] != 0:
+            raise AssertionError(f"Чистка должна удалить все старые и пустые сессии: {removed}, осталось {row[0]}")
+    finally:
+        await db.close()
+
+
+async def check_horoscope_flow() -> None:
+    tmp_dir = Path("logs")
+    tmp_dir.mkdir(exist_ok=True)
+    db_path = tmp_dir / "selftest-flow.db"
+    if db_path.exists():
+        db_path.unlink()
+    db = Database(str(db_path))
+    await db.init()
+    try:
+        quota = QuotaService(db, free_quota=3)
+        ai = CountingAIService()
+        horoscope_handlers.init_horoscope_services(quota, ai, StubPaymentService(), mode="openai")
+        key = StorageKey(bot_id=1, chat_id=77, user_id=77)
+        state = FSMContext(SQLiteStorage(db, sweep_interval_min=0), key)
+        await state.update_data(
+            mode=MODE_TODAY,
+            action="hs_today",
+            birth_date="15.08.1990",
+            birth_time=None,
+            birth_place="Москва",
+            gender="gender_f",
+        )
+        await state.set_state(HoroscopeStates.waiting_for_focus)
+        message = FakeMessage()
+        await horoscope_handlers.focus(FakeCallback(77, "focus_love", message), state)
+        if message.texts[-1] != "ответ #1" or await quota.get_free_left(77) != 2:
+            raise AssertionError(f"Ответ должен прийти и списать один запрос: {message.texts}")
+
+        # "Regen" after a restart: last_request is read back from SQLite.
+        restarted = FSMContext(SQLiteStorage(db, sweep_interval_min=0), key)
+        if (await restarted.get_data()).get("last_request", {}).get("focus") != "focus_love":
+            raise AssertionError("last_request не сохранён в хранилище FSM")
+        await horoscope_handlers.regenerate(FakeCallback(77, "regen", message), restarted)
+        if ai.calls != 2 or message.texts[-1] != "ответ #2" or await quota.get_free_left(77) != 1:
+            raise AssertionError(f"«Сгенерировать заново» должна дать новый ответ: {message.texts}")
+
+        # With PRECOMPUTE_SERVE the sign matrix answers first: free, and without calling the AI.
+        signs = SignHoroscopes(CachingAIService(ai, ResponseCache(db), namespace="test"), modes=(MODE_TODAY,))
+        sign_prompt = build_sign_prompt("Лев", MODE_TODAY, "focus_love", "gender_f")
+        await signs.cache.cache.put(
+            signs.cache.cache_key(sign_prompt), "общий прогноз", MODE_TODAY, cache_expiry(MODE_TODAY) or 0
+        )
+        horoscope_handlers.init_horoscope_services(quota, ai, StubPaymentService(), mode="openai", signs=signs)
+        await restarted.set_state(HoroscopeStates.waiting_for_focus)
+        serve, settings.precompute_serve = settings.precompute_serve, True
+        try:
+            await horoscope_handlers.focus(FakeCallback(77, "focus_love", message), restarted)
+            if ai.calls != 2 or not message.texts[-1].endswith("общий прогноз") or await quota.get_free_left(77) != 1:
+                raise AssertionError(f"Прогноз по знаку не должен списывать запрос: {message.texts[-1]}")
+            # Not even a zero balance stands in the way of a free answer.
+            await quota.ensure_user(78)
+            await db.execute("UPDATE quotas SET free_left = 0 WHERE telegram_id = 78")
+            await restarted.set_state(HoroscopeStates.waiting_for_focus)
+            await horoscope_handlers.focus(FakeCallback(78, "focus_love", message), restarted)
+            if not message.texts[-1].endswith("общий прогноз"):
+                raise AssertionError(f"Прогноз по знаку не должен требовать остатка: {message.texts[-1]}")
+        finally:
+            settings.precompute_serve = serve
+
+        class BudgetExhaustedAIService(AIService):
+            async def generate(self, prompt: BuiltPrompt) -> str:
+                prompt.fallback = True
+                return STUB_RESPONSE
+
+        # A fallback (stub) answer is withheld: the user is told and the request is not charged.
+        horoscope_handlers.init_horoscope_services(quota, BudgetExhaustedAIService(), StubPaymentService())
+        await horoscope_handlers.regenerate(FakeCallback(77, "regen", message), restarted)
+        if message.texts[-1] != texts.AI_UNAVAILABLE or await quota.get_free_left(77) != 1 or quota._reservations:
+            raise AssertionError(f"Ответ заглушки не должен списывать запрос: {message.texts[-1]}")
+
+        class BrokenNormalizer(RequestNormalizer):
+            async def normalize(self, req: HoroscopeRequest) -> None:
+                raise RuntimeError("справочник недоступен")
+
+        # A failure between reserve() and the answer must give the request back.
+        horoscope_handlers.init_horoscope_services(
+            quota, ai, StubPaymentService(), mode="openai", normalizer=BrokenNormalizer()
+        )
+        try:
+            await horoscope_handlers.regenerate(FakeCallback(77, "regen", message), restarted)
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError("Ошибка нормализации должна дойти до обработчика ошибок")
+        if await quota.get_free_left(77) != 1 or quota._reservations:
+            raise AssertionError("Запрос должен вернуться на баланс, а резервация — закрыться")
+
+        # A differently spelled repeat is found by its canonical key before any prompt is built.
+        await db.execute("UPDATE quotas SET free_left = 5 WHERE telegram_id = 77")
+        places = Gazetteer(path=str(tmp_dir / "selftest-flow-gazetteer.sqlite"))
+        cache = CachingAIService(ai, ResponseCache(db), namespace="keyed")
+        horoscope_handlers.init_horoscope_services(
+            quota, cache, StubPaymentService(), mode="openai", normalizer=RequestNormalizer(places), cache=cache
+        )
+        build_prompt = horoscope_handlers._build_prompt
+        try:
+            for birth_date, place in (("15.08.1990", "Москва"), ("15.8.1990", "г. Москва")):
+                await restarted.update_data(birth_date=birth_date, birth_place=place)
+                await restarted.set_state(HoroscopeStates.waiting_for_focus)
+                await horoscope_handlers.focus(FakeCallback(77, "focus_money", message), restarted)
+
+                def no_prompt(*args: object) -> BuiltPrompt:
+                    raise AssertionError("Промпт не должен строиться при попадании в кэш по ключу")
+
+                horoscope_handlers._build_prompt = no_prompt  # type: ignore[assignment]
+        finally:
+            horoscope_handlers._build_prompt = build_prompt  # type: ignore[assignment]
+            places.close()
+        if ai.calls != 3 or message.texts[-1] != "ответ #3":
+            raise AssertionError(f"Повтор запроса должен прийти из кэша по ключу: {message.texts[-2:]}")
+    finally:
+        await db.close()
+
+
+async def check_webhook() -> None:
+    handled: list[int] = []
+    router = Router()
+
+    @router.message()
+    async def slow_handler(message: Message) -> None:
+        await asyncio.sleep(0.3)
+        handled.append(message.from_user.id)
+
+    dispatcher = Dispatcher()
+    dispatcher.include_router(router)
+    bot = Bot(token="42:" + "A" * 35)
+    runner = await start_webhook_site(build_webhook_app(dispatcher, bot, "selftest-secret"), "127.0.0.1", 0)
+    try:
+        port = runner.addresses[0][1]
+        url = f"http://127.0.0.1:{port}{settings.webhook_path}"
+        report = await post_updates(url, "selftest-secret", count=30, concurrency=10, users=5)
+        if report.statuses != {200: 30}:
+            raise AssertionError(f"Все обновления должны приниматься: {report.statuses}")
+        if report.percentile(95) >= 0.3:
+            raise AssertionError(f"Ответ 200 должен приходить до обработки: p95 {report.percentile(95):.3f} с")
+        rejected = await post_updates(url, "wrong-secret", count=3, concurrency=1)
+        if rejected.statuses != {401: 3}:
+            raise AssertionError(f"Запросы с неверным секретом должны отклоняться: {rejected.statuses}")
+        for _ in range(50):
+            if len(handled) == 30:
+                break
+            await asyncio.sleep(0.05)
+        if len(handled) != 30:
+            raise AssertionError(f"Обработано {len(handled)} обновлений из 30")
+    finally:
+        await runner.cleanup()
+
+
+async def check_natal() -> None:
+    # Reference positions from Meeus, "Astronomical Algorithms" (examples 25.a, 47.a, 33.a).
+    jd = ephemeris.julian_day([1992, 1992, 1992], [10, 4, 12], [13, 12, 20], [0, 0, 0])
+    positions = ephemeris.longitudes(jd)
+    for body, index, expected in (("sun", 0, 199.909), ("moon", 1, 133.163), ("venus", 2, 313.081)):
+        if abs(positions[body][index] - expected) > 0.1:
+            raise AssertionError(f"{body}: {positions[body][index]:.3f}° вместо {expected}°")
+
+    engine = NatalEngine(workers=1)
+    try:
+        inputs = [
+            NatalInput(date(1990, 8, 15), time(9, 5), 55.7558, 37.6173, "Europe/Moscow"),
+            NatalInput(date(1990, 8, 15)),
+            NatalInput(date(1985, 3, 1), time(23, 30), 43.1155, 131.8855, "Asia/Vladivostok"),
+        ]
+        charts = await engine.charts(inputs)
+        if engine.batches != 1 or len(charts) != 3:
+            raise AssertionError(f"Пакет карт должен считаться одним вызовом: {engine.stats()}")
+        full, partial = charts[0], charts[1]
+        if full.ascendant is None or full.houses is None or len(full.houses) != 12:
+            raise AssertionError("Для известных времени и места нужны асцендент и дома")
+        if partial.ascendant is not None or "Асцендент" in partial.describe():
+            raise AssertionError("Без времени рождения асцендент не определяется")
+        if not full.describe().startswith("Солнце — Лев") or abs(full.positions["sun"] - partial.positions["sun"]) > 1:
+            raise AssertionError(f"Неверное положение Солнца: {full.describe()}")
+    finally:
+        engine.close()
+    req = HoroscopeRequest("Натальная карта", "15.08.1990", "09:05", "Москва", "gender_f", "focus_love")
+    prompt = build_horoscope_prompt(req, chart=full.describe())
+    if full.describe() not in prompt.user_prompt:
+        raise AssertionError("Натальная карта не попала в промпт")
+
+
+async def check_http_clients() -> None:
+    clients = HttpClients()
+    try:
+        openai = clients.openai()
+        if clients.openai() is not openai:
+            raise AssertionError("Клиент OpenAI должен переиспользоваться")
+        pool = openai._transport._pool  # type: ignore[attr-defined]
+        if pool._max_connections != settings.http_openai_max_connections:
+            raise AssertionError(f"Лимит пула OpenAI не применён: {pool._max_connections}")
+
+        async def other_loop() -> object:
+            # Like a launcher action: its own asyncio.run, closing its clients at the end.
+            client = clients.openai()
+            await clients.close()
+            return client
+
+        if await asyncio.to_thread(asyncio.run, other_loop()) is openai or clients.openai() is not openai:
+            raise AssertionError("Каждый цикл событий должен получать свой пул OpenAI")
+        if openai.is_closed:
+            raise AssertionError("close() в другом цикле не должен закрывать пул этого цикла")
+        telegram = clients.telegram()
+        connector = (await telegram.create_session()).connector
+        if clients.telegram() is not telegram or connector is None or connector.limit != telegram.limit:
+            raise AssertionError("Сессия Telegram должна быть общей и с лимитом из настроек")
+        if connector._keepalive_timeout != settings.http_keepalive_s:  # type: ignore[attr-defined]
+            raise AssertionError("Соединения Telegram должны жить HTTP_KEEPALIVE_S")
+
+        opened: list[str] = []
+        warmed: list[str] = []
+
+        async def ok() -> None:
+            opened.append("telegram")
+
+        async def down(url: str) -> None:
+            warmed.append(url)
+            raise OSError("network is unreachable")
+
+        clients._open_telegram = ok  # type: ignore[method-assign]
+        clients._open_openai = down  # type: ignore[method-assign]
+        result = await clients.warm_up(openai=True)
+        if result != {"Telegram": True, "OpenAI": False}:
+            raise AssertionError(f"Неожиданный результат прогрева: {result}")
+        opened.clear()
+        warmed.clear()
+        custom = "https://llm.example.com/v1"
+        result = await clients.warm_up(openai=True, openai_urls=[custom, None, custom])
+        if result != {"Telegram": True, "OpenAI (llm.example.com)": False, "OpenAI": False}:
+            raise AssertionError(f"Прогрев должен идти на адреса из AI_BACKENDS: {result}")
+        if warmed.count(custom) != max(1, settings.http_warmup_connections):
+            raise AssertionError(f"Свой base_url должен прогреваться: {warmed}")
+        if len(opened) != max(1, settings.http_warmup_connections):
+            raise AssertionError(f"Прогрев должен открыть {settings.http_warmup_connections} соединения: {opened}")
+    finally:
+        await clients.close()
+    if clients._openai or clients._telegram is not None:
+        raise AssertionError("После close() пулы должны быть закрыты")
+
+
+async def check_database_pool() -> None:
+    tmp_dir = Path("logs")
+    tmp_dir.mkdir(exist_ok=True)
+    db_path = tmp_dir / "selftest-pool.db"
+    if db_path.exists():
+        db_path.unlink()
+    db = Database(str(db_path), pool_size=2)
+    await db.init()
+    try:
+        row = await db.fetchone("PRAGMA journal_mode")
+        if not row or str(row[0]).lower() != "wal":
+            raise AssertionError(f"Ожидался journal_mode=WAL, получено {row[0] if row else None}")
+        await asyncio.gather(*(db.fetchone("SELECT count(*) FROM users") for _ in range(8)))
+        if len(db._connections) > 2:
+            raise AssertionError(f"Пул превысил лимит: {len(db._connections)} соединений")
+    finally:
+        await db.close()
+    if db._connections:
+        raise AssertionError("После close() остались открытые соединения")
 
 
 async def main() -> None:
@@ -135,6 +1386,7 @@ async def main() -> None:
         ("Router handlers", check_router_handlers),
         ("Callback coverage", check_callback_coverage),
         ("Prompt builder", check_prompt_builder),
+        ("Gazetteer", check_gazetteer),
     ]:
         try:
             func()
@@ -142,11 +1394,39 @@ async def main() -> None:
         except Exception as exc:  # pragma: no cover - guard for selftest runner
             results.append(TestResult(name, False, str(exc)))
 
-    try:
-        await check_quota_service()
-        results.append(TestResult("Quota service", True))
-    except Exception as exc:  # pragma: no cover - guard
-        results.append(TestResult("Quota service", False, str(exc)))
+    for name, coro_func in [
+        ("Quota service", check_quota_service),
+        ("Quota reservation", check_quota_reservation),
+        ("Quota ledger", check_quota_ledger),
+        ("Request log writer", check_request_log_writer),
+        ("Database pool", check_database_pool),
+        ("Migrations", check_migrations),
+        ("Log rollup", check_log_rollup),
+        ("Known users", check_known_users),
+        ("Response cache", check_response_cache),
+        ("Single flight", check_single_flight),
+        ("Streaming", check_streaming),
+        ("AI scheduler", check_ai_scheduler),
+        ("Scheduler lanes", check_scheduler_lanes),
+        ("Degradation", check_degradation),
+        ("Circuit breaker", check_circuit_breaker),
+        ("Retry policy", check_retry_policy),
+        ("Hedging", check_hedging),
+        ("Sign precompute", check_precompute),
+        ("Batch precompute", check_batch_precompute),
+        ("HTTP clients", check_http_clients),
+        ("Cost ledger", check_cost_ledger),
+        ("Request normalizer", check_normalizer),
+        ("Natal chart", check_natal),
+        ("FSM storage", check_fsm_storage),
+        ("Horoscope flow", check_horoscope_flow),
+        ("Webhook", check_webhook),
+    ]:
+        try:
+            await coro_func()
+            results.append(TestResult(name, True))
+        except Exception as exc:  # pragma: no cover - guard
+            results.append(TestResult(name, False, str(exc)))
 
     for item in results:
         status = "OK" if item.success else "FAIL"